@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import brotli  # optional, smaller than gzip. Browsers only use it over https, so gzip is enough on the hotspot
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# The files of the web interface (see the client folder), kept in memory so serving them does not read the SD card.
+# Every file is read once when the server starts, and compressed right away with gzip (and brotli when it is
+# installed), so a request only copies the bytes that are already there.
+# Every file gets a strong ETag (a hash of its content). A browser that already has the file sends it back in
+# If-None-Match, and gets "304 Not Modified" without the file when it did not change.
+# The files only change when the program is updated, and it restarts then.
+# As there is only one set of files, all methods are static.
+
+# Encodings in the order they are preferred, when the client accepts them
+ENCODINGS = ("br", "gzip")
+
+
+# One file with its compressed variants
+class Asset():
+    def __init__(self, path, body, modified, cache_control):
+        self.path = path
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.cache_control = cache_control
+        self.last_modified = formatdate(modified, usegmt=True)
+        self.modified = int(modified)  # whole seconds, like the Last-Modified header
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        # encoding -> (body, etag). Every variant has its own etag, they are different bytes
+        self.variants = {"identity": (body, f'"{digest}"')}
+        for encoding in ENCODINGS:
+            compressed = Asset._compress(encoding, body)
+            if compressed is not None and len(compressed) < len(body):  # only when it is smaller
+                self.variants[encoding] = (compressed, f'"{digest}-{encoding}"')
+
+    @staticmethod
+    def _compress(encoding, body):
+        if encoding == "gzip":
+            return gzip.compress(body, compresslevel=9, mtime=0)  # no time in the header, the same every start
+        if encoding == "br" and brotli:
+            return brotli.compress(body)
+        return None
+
+    # The best variant for the Accept-Encoding header of a request: (encoding, body, etag)
+    def variant(self, accept_encoding):
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ENCODINGS:
+            if encoding in self.variants and encoding in accepted:
+                return (encoding, *self.variants[encoding])
+        return ("identity", *self.variants["identity"])
+
+    # True when the client already has this variant: its etag is in If-None-Match, or without that header,
+    # the file did not change since If-Modified-Since
+    def not_modified(self, etag, if_none_match, if_modified_since):
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+        if if_modified_since:
+            try:
+                return self.modified <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):  # not a valid date
+                return False
+        return False
+
+
+# The encodings a client accepts, from its Accept-Encoding header. Encodings with q=0 are refused
+def accepted_encodings(header):
+    accepted = set()
+    for part in (header or "").split(","):
+        encoding, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:] in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(encoding.strip().lower())
+    return accepted
+
+
+class Assets():
+    files = {}  # path -> Asset
+    # Cache-Control of the files: the page and its script are checked every time (a 304 when nothing changed),
+    # so a new version shows up right away. The icon hardly changes, the browser can keep it for a day
+    cache_control = {".html": "no-cache", ".js": "no-cache"}
+    default_cache_control = "public, max-age=86400"
+
+    # Read the files into memory and compress them. Files that do not exist are skipped
+    @staticmethod
+    def load(paths):
+        for path in paths:
+            try:
+                with open(path, "rb") as file:
+                    body = file.read()
+                modified = os.path.getmtime(path)
+            except OSError as e:
+                logger.warning(f"Can not load {path}: {e}")
+                continue
+            extension = os.path.splitext(path)[1]
+            asset = Asset(path, body, modified,
+                          Assets.cache_control.get(extension, Assets.default_cache_control))
+            Assets.files[path] = asset
+            sizes = ", ".join(f"{encoding} {len(body)}" for encoding, (body, etag) in asset.variants.items())
+            logger.debug(f"Loaded {path}: {sizes} bytes")
+        logger.info(f"Loaded {len(Assets.files)} web interface files" + ("" if brotli else " (no brotli)"))
+
+    # The file at path, None when it was not loaded
+    @staticmethod
+    def get(path):
+        return Assets.files.get(path)
@@ -0,0 +1,259 @@
+import argparse
+import json
+import logging
+import math
+import sys
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Finds pid tunings for one motor from a step response, instead of trying values by hand in the web interface.
+# The pid output is an acceleration (see Stepper._calc_pid), so from pid output to position the motor is a double
+# integrator: two integrations (acceleration -> velocity -> position) with a gain b and a delay tau on top.
+# b is 1 when the dish moves exactly as far as the steps say; slipping gears or a mount that does not match the
+# sensor make it smaller or larger. tau comes from the sensor (its sample period and latency) and the pid loop.
+# 1. identify: with the pid off, run the motor at a constant speed for a moment. The position measured by the
+#    sensor follows a straight line: its slope divided by the commanded speed is b, and where the line crosses the
+#    starting position is tau later than the start. The fit does not see the sample period of the sensor, so tau is
+#    at least sensor_delay (the sample period plus the latency)
+# 2. place the poles: with a PD controller (acceleration = kp * distance - kd * velocity) the loop behaves like
+#    x'' + kd*b*x' + kp*b*x = 0, a mass on a spring. Pick the natural frequency w and damping z that settle within
+#    the target settling time (about 4 / (z * w) seconds, aimed 10% sooner as the response is a bit slower than
+#    that estimate): kp = w^2 / b, kd = 2 * z * w / b.
+#    A delay eats phase margin, so w is kept below max_delay_ratio / tau, the loop settles slower then.
+#    The derivative term sees the noise of every new sample within one pid tick, kd * noise / pid_delay. When that
+#    gets near the acceleration limit the derivative is cut off and the loop loses its damping, so w is also kept
+#    low enough that it stays below max_noise_ratio of the limit
+# 3. verify: with the new tunings, step back to where the identification started and measure the rise time,
+#    overshoot and settling time, and the rate the pid loop actually ran at. The step is small, so it usually stays
+#    below the acceleration limit. A pid loop that runs faster than the sensor sees the movement of a whole sample
+#    period in one tick as well, which the model does not know about: when the step overshoots and misses the
+#    settling time, it is tried again with a lower w, and steps between the two ends of the identification.
+#    Tunings that still do not settle within the settling time raise AutoTuneFailed, with the report
+# No integral term: the plant already has two integrators, so it has no steady state error without a disturbance.
+# Works on anything with the interface of a Stepper (also StepperProxy), and waits with the given wait function.
+# That is job.sleep on the dish (see Dish.autotune), and the simulation itself offline:
+#   python src/autotune.py --settling-time 3
+
+
+# Difference between two angles in degrees, between -180 and 180
+def angle_difference(a, b):
+    return (a - b + 180) % 360 - 180
+
+
+# Raised when no tunings settle within the settling time, report is what the last verification measured
+class AutoTuneFailed(RuntimeError):
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+
+class AutoTune():
+    def __init__(self, motor, wait, clock, settling_time=3.0, damping=0.9,
+                 test_speed=0.5, test_time=1.0, sample_interval=0.01, max_delay_ratio=0.3,
+                 sensor_delay=0.0, max_noise_ratio=0.5, attempts=3, max_overshoot=5.0):
+        self.motor = motor  # Stepper or StepperProxy, with its pid controller stopped
+        self.wait = wait  # wait(seconds), raises to stop the tuning
+        self.clock = clock  # clock() -> time in seconds
+        self.settling_time = settling_time  # target settling time of a step in seconds
+        self.damping = damping  # damping ratio of the closed loop, below 1 overshoots a bit but settles sooner
+        self.test_speed = test_speed  # speed of the identification run in degrees per second
+        self.test_time = test_time  # duration of the identification run in seconds
+        self.sample_interval = sample_interval  # time between two measurements of the position in seconds
+        self.max_delay_ratio = max_delay_ratio  # limit of natural frequency * delay, keeps the loop stable
+        self.sensor_delay = sensor_delay  # sample period plus latency of the sensor in seconds, the least delay
+        self.max_noise_ratio = max_noise_ratio  # limit of the derivative of the noise / the acceleration limit
+        self.attempts = attempts  # steps tried before giving up, each one with a lower natural frequency
+        self.max_overshoot = max_overshoot  # percent, a step that overshoots more is tried with a lower frequency
+        self.noise = 0.0  # standard deviation of the position around the fitted line in degrees, see identify
+
+    # Identify the motor, calculate tunings and verify them with a step.
+    # step is called with a description of what the tuning is doing, it can stop the tuning by raising.
+    # The new tunings stay on the motor, the pid is stopped afterwards. Returns the report as a dictionary,
+    # raises AutoTuneFailed when the tunings do not settle within the settling time
+    def run(self, step=lambda description: None):
+        step("Identify")
+        ends = [self.motor.sensor_position]
+        gain, delay = self.identify()
+        ends.append(self.motor.sensor_position)
+        frequency, limited_by = self.frequency(gain, delay)
+
+        step("Verify")
+        for attempt in range(self.attempts):
+            tunings = self.tunings(gain, frequency)
+            logger.info(f"Auto-tune: gain {gain:.3f}, delay {delay * 1000:.1f} ms, noise {self.noise:.4f} degrees "
+                        f"-> tunings {tunings}")
+            self.motor.tune(*tunings)
+            response = self.verify(ends[attempt % 2])
+            settled = response["settling_time"]
+            if (settled is not None and settled <= self.settling_time) or \
+                    response["overshoot"] <= self.max_overshoot:
+                break  # a lower frequency would only settle slower
+            frequency *= 0.8
+            limited_by = "overshoot"
+
+        report = {
+            "gain": gain,
+            "delay": delay,
+            "noise": self.noise,
+            "tunings": tunings,
+            "limited_by": limited_by,
+            "target_settling_time": self.settling_time,
+            **response,
+        }
+        if settled is None or settled > self.settling_time:
+            raise AutoTuneFailed(
+                f"No tunings settle within {self.settling_time:g} s: the last ones ({tunings[0]}, {tunings[2]}) "
+                + (f"settled after {settled:.2f} s" if settled is not None else "did not settle")
+                + f" with {response['overshoot']:.0f}% overshoot" + (f", limited by {limited_by}" if limited_by else ""),
+                report)
+        return report
+
+    # Run the motor at test_speed and fit a line through the measured positions
+    # Returns the gain b (measured / commanded speed) and the delay tau in seconds
+    def identify(self):
+        speed = self.test_speed * self.motor.steps_per_rev / 360
+        try:
+            times, positions = self._record(lambda: self.motor._set_speed(speed), self.test_time)
+        finally:
+            self.motor._set_speed(0)
+        self.wait(0.2)  # let the motor and the sensor come to rest
+
+        moved = positions[-1]
+        # only the part where it is clearly moving, the start is still the delay
+        mask = np.abs(positions) > 0.2 * abs(moved)
+        if abs(moved) < 0.2 * self.test_speed * self.test_time or np.count_nonzero(mask) < 3:
+            raise RuntimeError(f"The motor moved {moved:.2f} degrees instead of "
+                               f"{self.test_speed * self.test_time:.2f}, check the motor and the sensor")
+        slope, intercept = np.polyfit(times[mask], positions[mask], 1)
+        self.noise = float(np.std(positions[mask] - (slope * times[mask] + intercept)))
+        gain = slope / self.test_speed
+        if gain <= 0:  # a pid with this sign would run away
+            raise RuntimeError("The sensor measures the motor moving the wrong way, check the mount geometry")
+        delay = max(0.0, -intercept / slope)
+        return float(gain), float(delay)
+
+    # Natural frequency of the closed loop for the gain and delay, and what made it lower than the settling time
+    # asks for: None, "delay" or "noise"
+    def frequency(self, gain, delay):
+        frequency = 4.4 / (self.damping * self.settling_time)
+        limited_by = None
+        # the loop can not react faster than its own tick, or the samples of the sensor
+        pid_delay = getattr(self.motor, "pid_delay", 0)
+        delay = max(delay, pid_delay, self.sensor_delay)
+        if delay > 0 and frequency * delay > self.max_delay_ratio:
+            frequency, limited_by = self.max_delay_ratio / delay, "delay"
+        # derivative of the noise: kd * sqrt(2) * noise (in steps) / pid_delay, with kd = 2 * damping * frequency / b
+        noise = math.sqrt(2) * self.noise * self.motor.steps_per_rev / 360
+        if noise > 0 and pid_delay > 0:
+            highest = self.max_noise_ratio * self.motor.max_acceleration * pid_delay * gain / (2 * self.damping * noise)
+            if frequency > highest:
+                frequency, limited_by = highest, "noise"
+        return frequency, limited_by
+
+    # Tunings (p, i, d) for the gain and the natural frequency.
+    # The pid gets the distance to the goal as its input with setpoint 0, so the tunings are negative
+    def tunings(self, gain, frequency):
+        kp = frequency ** 2 / gain
+        kd = 2 * self.damping * frequency / gain
+        return -round(kp, 4), 0, -round(kd, 4)
+
+    # Step with the pid controller to target (degrees) and measure the response
+    def verify(self, target):
+        start = self.motor.sensor_position
+        size = angle_difference(target, start)
+        self.motor.set_target(degrees=target)
+        self.motor.start_pid()
+        peak = [0.0]
+
+        def track_acceleration():
+            peak[0] = max(peak[0], abs(self.motor.acceleration))
+        try:
+            times, positions = self._record(track_acceleration, 2 * self.settling_time, start)
+            stats = self.motor.pid_stats()
+        finally:
+            self.motor.stop_pid()
+
+        # the response as a fraction of the step: 0 at the start, 1 at the target
+        response = positions / size if size else np.ones_like(positions)
+        # settled within 2% of the step, or within the noise when that is larger
+        tolerance = max(0.02, 3 * self.noise / abs(size)) if size else 0.02
+        settled = settling_time(times, response, tolerance)
+        return {
+            "step": size,
+            "rise_time": rise_time(times, response),
+            "overshoot": max(0.0, float(np.max(response)) - 1) * 100,  # percent of the step
+            "settling_time": settled,
+            "final_error": float(angle_difference(target, self.motor.sensor_position)),
+            "saturated": peak[0] >= 0.99 * self.motor.max_acceleration,
+            "loop_rate": stats["achieved_rate"],
+        }
+
+    # Measure the position (relative to start, in degrees) every sample_interval for duration seconds
+    # action is called before every measurement
+    def _record(self, action, duration, start=None):
+        if start is None:
+            start = self.motor.sensor_position
+        begin = self.clock()
+        times, positions = [], []
+        while True:
+            action()
+            now = self.clock() - begin
+            times.append(now)
+            positions.append(angle_difference(self.motor.sensor_position, start))
+            if now >= duration:
+                break
+            self.wait(self.sample_interval)
+        return np.array(times), np.array(positions)
+
+
+# Time the response takes from 10% to 90% of the step, None if it never gets there
+def rise_time(times, response):
+    low = np.flatnonzero(response >= 0.1)
+    high = np.flatnonzero(response >= 0.9)
+    if not len(low) or not len(high):
+        return None
+    return float(times[high[0]] - times[low[0]])
+
+
+# Time after which the response stays within tolerance of 1 until the end, None if it never settles
+def settling_time(times, response, tolerance):
+    outside = np.flatnonzero(np.abs(response - 1) > tolerance)
+    if not len(outside):
+        return float(times[0])
+    if outside[-1] == len(times) - 1:
+        return None
+    return float(times[outside[-1] + 1])
+
+
+# Tune one axis of the simulated dish and print the report
+def main(argv=None):
+    from sim import Simulation  # only needed offline
+
+    parser = argparse.ArgumentParser(description="Auto-tune the pid controller of one axis in simulation")
+    parser.add_argument("--axis", choices=("azimuth", "elevation"), default="azimuth")
+    parser.add_argument("--settling-time", type=float, default=3.0, help="target settling time in seconds")
+    parser.add_argument("--damping", type=float, default=0.9, help="damping ratio of the closed loop")
+    parser.add_argument("--rate", type=float, default=1000, help="pid loop rate in Hz")
+    parser.add_argument("--sensor-rate", type=float, default=100, help="sensor rate in Hz")
+    parser.add_argument("--noise", type=float, default=0.0, help="sensor noise in degrees")
+    parser.add_argument("--latency", type=float, default=0.0, help="sensor latency in seconds")
+    args = parser.parse_args(argv)
+
+    sim = Simulation(pid_rate=args.rate, sensor_rate=args.sensor_rate, noise=args.noise, latency=args.latency)
+    sim.set_position(0, 45)
+    sim.run(0.5)  # fill the history of the sensor, it lags behind with latency
+    motor = sim.azimuth_motor if args.axis == "azimuth" else sim.elevation_motor
+    tuner = AutoTune(motor, sim.run, sim.clock.monotonic,
+                     settling_time=args.settling_time, damping=args.damping,
+                     sensor_delay=1 / args.sensor_rate + args.latency)
+    try:
+        print(json.dumps(tuner.run(), indent=2))
+    except AutoTuneFailed as e:
+        print(json.dumps(e.report, indent=2))
+        return str(e)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
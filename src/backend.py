@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# The backend decides whether the program talks to the real hardware or to a simulation of it.
+# On the raspberry pi the "hardware" backend uses the GPIO pins, the hardware pwm and the BNO055 sensor.
+# On any other computer the "sim" backend (see sim.py) replaces them with simulated versions,
+# so the whole program, including the pid controllers and the web interface, can run without the dish.
+# Dish and Stepper create their hardware through this class instead of importing the hardware libraries themselves.
+# As there is only one backend at a time, all methods are static.
+
+
+# The clock used by the program. Normally this is just the real time,
+# but the simulation replaces it with a virtual clock that can run faster than real time (see sim.SimClock)
+class Clock():
+    # current time in seconds, only useful to calculate time differences
+    def monotonic(self):
+        return time.monotonic()
+
+    # current time in integer nanoseconds, for counting without rounding errors
+    def monotonic_ns(self):
+        return time.monotonic_ns()
+
+    # wait for a number of seconds
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    # wait for a number of seconds or until the event is set. Returns true if the event is set
+    def wait(self, event: threading.Event, timeout):
+        return event.wait(timeout)
+
+
+class Backend():
+    name = ""  # "hardware" or "sim"
+    GPIO: any = None  # RPi.GPIO module, or a simulated version
+    clock: Clock = Clock()
+    _sensor = None  # the simulated sensor, used to attach the simulated motors to it
+
+    # Load a backend by name: "hardware", "sim" or "auto"
+    # auto uses the hardware when the hardware libraries are available and the simulation otherwise
+    @staticmethod
+    def load(name="auto", sensor_noise=0.0, sensor_latency=0.0):
+        if name in ("auto", "hardware"):
+            try:
+                import RPi.GPIO
+                import board
+                import rpi_hardware_pwm
+                import adafruit_bno055
+                Backend.GPIO = RPi.GPIO
+                Backend.name = "hardware"
+                logger.info("Detected Raspberry Pi environment.")
+                return
+            except (ImportError, RuntimeError, NotImplementedError) as e:
+                if name == "hardware":
+                    raise
+                logger.warning(
+                    f"Not a Raspberry Pi ({e}). Switching to simulation.")
+
+        if name not in ("auto", "sim"):
+            raise ValueError(f"Unknown backend: {name}")
+
+        import sim
+        Backend.GPIO = sim.SimGPIO()
+        Backend._sensor = sim.SimBNO055(
+            clock=Backend.clock, noise=sensor_noise, latency=sensor_latency)
+        Backend.name = "sim"
+
+    # Create the pwm controller that drives the step pin of one motor
+    # axis, dir_pin and enable_pin are only used by the simulation, to know which angle the motor moves
+    @staticmethod
+    def create_pwm(pwm_channel, hz, chip, axis=None, dir_pin=None, enable_pin=None):
+        if Backend.name == "hardware":
+            from rpi_hardware_pwm import HardwarePWM
+            return HardwarePWM(pwm_channel=pwm_channel, hz=hz, chip=chip)
+
+        import sim
+        pwm = sim.SimPWM(pwm_channel=pwm_channel, hz=hz, chip=chip, gpio=Backend.GPIO,
+                         dir_pin=dir_pin, enable_pin=enable_pin, clock=Backend.clock)
+        if axis:
+            Backend._sensor.attach(axis, pwm)
+        return pwm
+
+    # Create the position sensor
+    @staticmethod
+    def create_sensor():
+        if Backend.name == "hardware":
+            import board
+            from adafruit_bno055 import BNO055_I2C
+            i2c = board.I2C()  # configure the I2C bus
+            # everything else is handled by the library
+            return BNO055_I2C(i2c)
+
+        return Backend._sensor
@@ -0,0 +1,211 @@
+import argparse
+import collections
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+
+from sim import Simulation
+
+# Benchmark of the control loop: Stepper._calc_pid -> PID -> Stepper._set_speed -> pwm.change_frequency
+# It drives both Steppers in the simulation (see sim.py) through a set of target profiles and reports,
+# as JSON, how fast the loop runs on this computer and how well the dish follows the target.
+# Because the simulation runs on a virtual clock, the tracking results are the same on every run and every computer,
+# only the latency and cpu numbers depend on the computer. This makes it possible to compare tunings and code changes between commits.
+#
+# Usage (from the root of the repo):
+#   python src/benchmark.py                       run all profiles
+#   python src/benchmark.py --profile step slew   run some profiles
+#   python src/benchmark.py --output bench.json   write the report to a file
+
+# A target profile: where the dish starts, how long it runs and the target (azimuth, elevation) in degrees at time t
+Profile = collections.namedtuple("Profile", ["start", "duration", "target"])
+
+PROFILES = {
+    # a small step, the standard response test
+    "step": Profile(start=(0, 0), duration=30,
+                    target=lambda t: (30, 10)),
+    # a large move on both axes
+    "slew": Profile(start=(0, 0), duration=60,
+                    target=lambda t: (170, 60)),
+    # keep pointing at a geostationary satellite, which wobbles a tiny bit around its position
+    "geo": Profile(start=(180, 35), duration=120,
+                   target=lambda t: (180 + 0.05 * math.sin(2 * math.pi * t / 600),
+                                     35 + 0.02 * math.sin(2 * math.pi * t / 600))),
+    # follow a low earth orbit satellite passing high overhead, it crosses the sky in about ten minutes
+    "leo": Profile(start=(100, 10), duration=120,
+                   target=lambda t: (100 + 0.5 * t, 10 + 0.3 * t)),
+}
+
+# How often the target is updated and the error is measured (in seconds)
+SAMPLE_INTERVAL = 0.01
+
+
+# Difference between two angles in degrees, between -180 and 180
+def angle_error(target, position):
+    return (target - position + 180) % 360 - 180
+
+
+# The value below which the given fraction of the sorted values lie
+def percentile(values, fraction):
+    if not values:
+        return 0
+    index = min(len(values) - 1, int(fraction * len(values)))
+    return values[index]
+
+
+# Time after which the error stays within tolerance until the end, None if it never settles
+def settling_time(times, errors, tolerance):
+    settled = None
+    for t, error in zip(times, errors):
+        if abs(error) > tolerance:
+            settled = None
+        elif settled is None:
+            settled = t
+    return settled
+
+
+# Wrap a control loop callback to measure how long each call takes (in seconds)
+def timed(callback, samples):
+    def wrapper():
+        start = time.perf_counter()
+        callback()
+        samples.append(time.perf_counter() - start)
+    return wrapper
+
+
+def run_profile(profile, pid_rate, tunings, noise, latency, tolerance, feed_forward=False):
+    sim = Simulation(pid_rate=pid_rate, noise=noise, latency=latency, tunings=tunings)
+    sim.set_position(*profile.start)
+
+    axes = {"azimuth": sim.azimuth_motor, "elevation": sim.elevation_motor}
+    durations = {name: [] for name in axes}
+    errors = {name: [] for name in axes}
+    times = []
+    for name, motor in axes.items():
+        motor.control_loop.callback = timed(motor.control_loop.callback, durations[name])
+        motor.start_pid()
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    t = 0
+    while t < profile.duration:
+        azimuth, elevation = profile.target(t)
+        if feed_forward:
+            # give the speed of the target too, like the Tracker does
+            next_azimuth, next_elevation = profile.target(t + SAMPLE_INTERVAL)
+            sim.azimuth_motor.set_trajectory(azimuth, angle_error(next_azimuth, azimuth) / SAMPLE_INTERVAL)
+            sim.elevation_motor.set_trajectory(elevation, (next_elevation - elevation) / SAMPLE_INTERVAL)
+        else:
+            sim.azimuth_motor.set_target(degrees=azimuth)
+            sim.elevation_motor.set_target(degrees=elevation)
+        sim.run(SAMPLE_INTERVAL)
+        t += SAMPLE_INTERVAL
+
+        times.append(t)
+        position = sim.true_position()
+        errors["azimuth"].append(angle_error(azimuth, position[0]))
+        errors["elevation"].append(angle_error(elevation, position[1]))
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+
+    ticks = sum(motor.control_loop.ticks for motor in axes.values())
+    report = {
+        "duration": profile.duration,
+        "wall_time": wall_time,
+        "ticks": ticks,
+        "cpu_per_tick_us": cpu_time / ticks * 1e6 if ticks else 0,
+        # the highest loop rate this computer could run both axes at
+        "max_loop_rate": ticks / len(axes) / wall_time if wall_time else 0,
+        "axes": {},
+    }
+    # the last tenth of the run is used for the steady state error
+    steady_start = int(len(times) * 0.9)
+    for name, motor in axes.items():
+        samples = sorted(durations[name])
+        steady = errors[name][steady_start:]
+        report["axes"][name] = {
+            "loop": motor.pid_stats(),
+            "hardware_writes": motor.write_stats(),
+            "latency_us": {
+                "p50": percentile(samples, 0.5) * 1e6,
+                "p90": percentile(samples, 0.9) * 1e6,
+                "p99": percentile(samples, 0.99) * 1e6,
+                "max": samples[-1] * 1e6 if samples else 0,
+            },
+            "settling_time": settling_time(times, errors[name], tolerance),
+            "steady_state_error": math.sqrt(sum(e ** 2 for e in steady) / len(steady)) if steady else 0,
+            "max_error": max(abs(e) for e in errors[name]) if errors[name] else 0,
+        }
+    return report
+
+
+# Run one motor through abrupt changes of speed (slow to fast and back) and compare the steps the Stepper counted
+# (see Stepper._count_steps) with the steps the simulated pwm made. It keeps running in one direction: the
+# simulation counts parts of steps, so at a stop or a change of direction the two differ by design.
+# Returns the largest difference in steps, below one when the count does not drift
+def step_count_error(changes=200, seed=1):
+    sim = Simulation()
+    motor = sim.azimuth_motor
+    rng = random.Random(seed)
+    largest = 0
+    for _ in range(changes):
+        motor._set_speed(10 ** rng.uniform(0.2, 4.5))
+        sim.clock.advance(rng.uniform(0.0001, 0.5))
+        motor.pwm.angle  # bring the steps of the pwm up to date
+        largest = max(largest, abs(motor.step_count() - motor.pwm.steps))
+    return largest
+
+
+# The git commit the benchmark is run on, so reports of different commits can be told apart
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the stepper control loop in simulation")
+    parser.add_argument("--profile", nargs="+", choices=sorted(PROFILES), default=sorted(PROFILES))
+    parser.add_argument("--rate", type=float, default=1000, help="pid loop rate in Hz")
+    parser.add_argument("--tunings", type=float, nargs=3, default=(-1, 0, -2.5), metavar=("P", "I", "D"))
+    parser.add_argument("--noise", type=float, default=0.0, help="sensor noise in degrees")
+    parser.add_argument("--latency", type=float, default=0.0, help="sensor latency in seconds")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="settling tolerance in degrees")
+    parser.add_argument("--feed-forward", action="store_true",
+                        help="give the speed of the target to the motors, like when tracking a satellite")
+    parser.add_argument("--output", help="write the report to this file instead of the terminal")
+    args = parser.parse_args(argv)
+
+    report = {
+        "commit": current_commit(),
+        "settings": {
+            "rate": args.rate,
+            "tunings": args.tunings,
+            "noise": args.noise,
+            "latency": args.latency,
+            "tolerance": args.tolerance,
+            "feed_forward": args.feed_forward,
+        },
+        "profiles": {},
+        "step_count_error": step_count_error(),
+    }
+    for name in args.profile:
+        report["profiles"][name] = run_profile(
+            PROFILES[name], args.rate, args.tunings, args.noise, args.latency, args.tolerance,
+            args.feed_forward)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
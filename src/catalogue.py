@@ -0,0 +1,172 @@
+import bisect
+import collections
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from config import Config
+from ephemeris import Ephemeris, Station
+
+logger = logging.getLogger(__name__)
+
+# The satellites the dish can point at, loaded from the TLE file in the config at startup.
+# The catalogue is indexed so the web interface can find satellites without looking at all of them:
+# - by NORAD id (a dictionary)
+# - by name prefix (a sorted list of names, searched with bisect)
+# - by orbital class (GEO, MEO or LEO, from the mean motion of the orbit)
+# For the question "which satellites can be seen", the azimuth and elevation of every satellite are
+# calculated in advance for the next table_hours, one column every table_step seconds (the look-angle table).
+# A background thread calculates a new table every table_refresh seconds, so a request only reads from it.
+# As there is only one catalogue, all methods are static.
+
+# Mean motion limits in revolutions per day
+GEO_MEAN_MOTION = (0.9, 1.1)  # one revolution per (sidereal) day
+LEO_MEAN_MOTION = 11.25  # orbital period below 128 minutes
+
+# The precalculated azimuth and elevation (degrees, float32) of all satellites,
+# arrays of shape (satellites, columns), column n is at unix time start + n * step
+LookAngleTable = collections.namedtuple("LookAngleTable", ["start", "step", "azimuth", "elevation"])
+
+
+# Orbital class of a satellite from its TLE set
+def orbital_class(satrec):
+    mean_motion = satrec.no_kozai * 1440 / (2 * math.pi)  # radians per minute -> revolutions per day
+    if GEO_MEAN_MOTION[0] <= mean_motion <= GEO_MEAN_MOTION[1] and satrec.ecco < 0.1:
+        return "GEO"
+    if mean_motion >= LEO_MEAN_MOTION:
+        return "LEO"
+    return "MEO"
+
+
+class Catalogue():
+    ephemeris: Ephemeris = None  # all satellites, also used to calculate the exact position when tracking
+    table: LookAngleTable = None
+    _names = []  # (upper case name, index) sorted by name, for prefix search
+    _classes = {}  # orbital class -> array of satellite indices
+    _stop = threading.Event()
+    _thread: threading.Thread = None
+
+    # Load the satellites, build the indices and the first table, run on startup
+    @staticmethod
+    def start():
+        path = Config.getTleFile()
+        station = Station(*Config.getStation())
+        if os.path.exists(path):
+            Catalogue.load(Ephemeris.from_file(path, station))
+        else:
+            logger.warning(f"No TLE file at {path}, satellite tracking unavailable")
+            Catalogue.load(Ephemeris([], station))
+
+        Catalogue._stop.clear()
+        Catalogue._thread = threading.Thread(target=Catalogue._refresh_loop, name="catalogue")
+        Catalogue._thread.daemon = True  # Makes sure the thread stops when the process ends/crashes
+        Catalogue._thread.start()
+
+    @staticmethod
+    def stop():
+        Catalogue._stop.set()
+
+    # Use the satellites of ephemeris and build the indices and table for them
+    @staticmethod
+    def load(ephemeris: Ephemeris):
+        satellites = ephemeris.satellites
+        Catalogue._names = sorted((satellite.name.upper(), i) for i, satellite in enumerate(satellites))
+        classes = collections.defaultdict(list)
+        for i, satellite in enumerate(satellites):
+            classes[orbital_class(satellite.satrec)].append(i)
+        Catalogue._classes = {name: np.array(indices, dtype=int) for name, indices in classes.items()}
+        Catalogue.ephemeris = ephemeris
+        Catalogue.refresh()
+
+    # Calculate a new look-angle table, starting now
+    @staticmethod
+    def refresh():
+        step = Config.getTableStep()
+        start = time.time()
+        times = start + np.arange(0, Config.getTableHours() * 3600 + step, step)
+        azimuth, elevation, _ = Catalogue.ephemeris.look_angles(times)
+        # replaced in one assignment, so requests never see half a table
+        Catalogue.table = LookAngleTable(start, step, azimuth.astype(np.float32), elevation.astype(np.float32))
+        logger.debug(f"Look-angle table of {azimuth.shape} calculated in {time.time() - start:.2f}s")
+
+    # The satellite with this NORAD id
+    @staticmethod
+    def get(norad):
+        return Catalogue.ephemeris.satellites[Catalogue.ephemeris.index(norad)]
+
+    # Indices of the satellites whose name starts with prefix (not case sensitive)
+    @staticmethod
+    def find_name(prefix):
+        prefix = prefix.upper()
+        names = Catalogue._names
+        start = bisect.bisect_left(names, (prefix,))
+        end = bisect.bisect_left(names, (prefix + "\uffff",), start)
+        return np.array([i for _, i in names[start:end]], dtype=int)
+
+    # Indices of the satellites of an orbital class (GEO, MEO or LEO)
+    @staticmethod
+    def find_class(name):
+        return Catalogue._classes.get(name.upper(), np.array([], dtype=int))
+
+    # The satellites above min_elevation (degrees) now or in the next hours, read from the look-angle table.
+    # The result can be narrowed down with a name prefix and an orbital class.
+    # Sorted with the highest satellites first
+    @staticmethod
+    def visible(min_elevation=0, hours=0, name=None, orbit=None, now=None):
+        table = Catalogue.table
+        now = time.time() if now is None else now
+        indices = np.arange(len(Catalogue.ephemeris.satellites))
+        if name:
+            indices = np.intersect1d(indices, Catalogue.find_name(name))
+        if orbit:
+            indices = np.intersect1d(indices, Catalogue.find_class(orbit))
+        if table is None or not len(indices):
+            return []
+
+        # the columns of the table around now, and the columns until now + hours
+        columns = table.elevation.shape[1]
+        position = min(max((now - table.start) / table.step, 0), columns - 1)
+        before = int(position)
+        after = min(before + 1, columns - 1)
+        fraction = position - before
+        last = min(int(math.ceil(position + hours * 3600 / table.step)), columns - 1)
+
+        azimuth = table.azimuth[indices]
+        elevation = table.elevation[indices]
+        # satellites that could not be propagated (NaN) are never selected
+        highest = np.nan_to_num(elevation[:, before:last + 1], nan=-90).max(axis=1)
+        selected = np.flatnonzero(highest >= min_elevation)
+
+        # the current position, interpolated between the two columns around now
+        elevation_now = elevation[selected, before] + \
+            (elevation[selected, after] - elevation[selected, before]) * fraction
+        turn = (azimuth[selected, after] - azimuth[selected, before] + 180) % 360 - 180
+        azimuth_now = (azimuth[selected, before] + turn * fraction) % 360
+
+        satellites = []
+        for row, az, el in zip(selected, azimuth_now, elevation_now):
+            satellite = Catalogue.ephemeris.satellites[indices[row]]
+            satellites.append({
+                "norad": satellite.norad,
+                "name": satellite.name,
+                "class": orbital_class(satellite.satrec),
+                "azimuth": float(az),
+                "elevation": float(el),
+                "max_elevation": float(highest[row]),
+                "visible": bool(el >= min_elevation),
+            })
+        satellites.sort(key=lambda satellite: satellite["elevation"], reverse=True)
+        return satellites
+
+    # This is what the thread is doing
+    @staticmethod
+    def _refresh_loop():
+        while not Catalogue._stop.wait(Config.getTableRefresh()):
+            try:
+                Catalogue.refresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh the look-angle table: {e}")
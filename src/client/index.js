@@ -19,9 +19,62 @@ function updateDishPosition() {
         },
     });
 
-    // Update status and signal strength for demonstration
     document.getElementById('status').textContent = 'Moving...';
-    document.getElementById('signal-strength').textContent = Math.floor(Math.random() * 100) + '%';
+}
+
+// Function to make the dish follow a satellite by its NORAD id
+// This ends up in server.py at RequestHandler.do_post
+function trackSatellite(norad) {
+    norad = norad || document.getElementById('norad').value;
+    fetch(`${window.location.origin}/api/track`, {
+        method: "POST",
+        body: JSON.stringify({ norad: norad }),
+        headers: {
+            "Content-type": "application/json",
+        },
+    }).then(response => {
+        document.getElementById('tracking').textContent = response.ok ? 'Tracking...' : 'Unknown satellite';
+    });
+}
+
+// Function to search the satellites that can be seen and list them with a Track button
+// This ends up in server.py at RequestHandler.sendSatellites
+function searchSatellites() {
+    const query = new URLSearchParams({
+        min_elevation: document.getElementById('min-elevation').value || 0,
+        hours: document.getElementById('hours').value || 0,
+        name: document.getElementById('satellite-name').value,
+        class: document.getElementById('orbit-class').value,
+    });
+    fetch(`${window.location.origin}/api/satellites?${query}`)
+        .then(response => response.json())
+        .then(satellites => {
+            const list = document.getElementById('satellites');
+            list.innerHTML = '';
+            satellites.forEach(satellite => {
+                const row = document.createElement('li');
+                row.textContent = `${satellite.name} (${satellite.norad}, ${satellite.class}) ` +
+                    `az ${satellite.azimuth.toFixed(1)}° el ${satellite.elevation.toFixed(1)}° ` +
+                    `max ${satellite.max_elevation.toFixed(1)}° `;
+                const button = document.createElement('button');
+                button.textContent = 'Track';
+                button.onclick = () => trackSatellite(satellite.norad);
+                row.appendChild(button);
+                list.appendChild(row);
+            });
+        });
+}
+
+// Function to stop following the satellite
+// This ends up in server.py at RequestHandler.do_post
+function stopTracking() {
+    fetch(`${window.location.origin}/api/track/stop`, {
+        method: "POST",
+        body: "",
+        headers: {
+            "Content-type": "application/json",
+        },
+    });
 }
 
 // Function to zero the dish
@@ -54,6 +107,36 @@ function updatePidValues(type) {
     });
 }
 
+// Function to fill the profile list with the tracking profiles of the server
+// This ends up in server.py at RequestHandler.do_GET
+function loadProfiles() {
+    fetch(`${window.location.origin}/api/profiles`)
+        .then(response => response.json())
+        .then(data => {
+            const select = document.getElementById('profile');
+            select.innerHTML = '';
+            data.profiles.forEach(profile => {
+                const option = document.createElement('option');
+                option.value = profile.name;
+                option.textContent = `${profile.name} (${profile.rate} Hz)`;
+                option.selected = profile.name === data.active;
+                select.appendChild(option);
+            });
+        });
+}
+
+// Function to switch to the selected tracking profile, the pid keeps running
+// This ends up in server.py at RequestHandler.do_post
+function setProfile() {
+    fetch(`${window.location.origin}/api/set-profile`, {
+        method: "POST",
+        body: JSON.stringify({ name: document.getElementById('profile').value }),
+        headers: {
+            "Content-type": "application/json",
+        },
+    });
+}
+
 // Function to turn the pid controller on or off
 // This ends up in server.py at RequestHandler.do_post
 function togglePid() {
@@ -67,6 +150,7 @@ function togglePid() {
 }
 
 // Function to perform the calibration sequence
+// The calibration runs in the background on the server, its progress is shown by showCalibration
 // This ends up in server.py at RequestHandler.do_post
 function calibrate() {
     fetch(`${window.location.origin}/api/calibrate`, {
@@ -75,16 +159,147 @@ function calibrate() {
         headers: {
             "Content-type": "application/json",
         },
+    }).then(response => {
+        if (!response.ok) {
+            document.getElementById('calibration-progress').textContent = response.statusText;
+            return;
+        }
+        response.json().then(showCalibration);
+    });
+}
+
+// Function to stop the calibration sequence
+// This ends up in server.py at RequestHandler.do_post
+function cancelCalibration() {
+    fetch(`${window.location.origin}/api/calibration/cancel`, {
+        method: "POST",
+        body: "",
+        headers: {
+            "Content-type": "application/json",
+        },
+    });
+}
+
+// Function to start searching for the strongest signal around the target
+// The search runs in the background on the server, its progress is shown by showPeakSearch
+// This ends up in server.py at RequestHandler.do_post
+function peakSearch() {
+    fetch(`${window.location.origin}/api/peak-search`, {
+        method: "POST",
+        body: "",
+        headers: {
+            "Content-type": "application/json",
+        },
+    }).then(response => {
+        if (!response.ok) {
+            document.getElementById('peak-progress').textContent = response.statusText;
+            return;
+        }
+        response.json().then(showPeakSearch);
     });
 }
 
+// Function to stop the peak search
+// This ends up in server.py at RequestHandler.do_post
+function cancelPeakSearch() {
+    fetch(`${window.location.origin}/api/peak-search/cancel`, {
+        method: "POST",
+        body: "",
+        headers: {
+            "Content-type": "application/json",
+        },
+    });
+}
+
+// Function to forget the offset found by the peak search
+// This ends up in server.py at RequestHandler.do_post
+function resetOffset() {
+    fetch(`${window.location.origin}/api/offset/reset`, {
+        method: "POST",
+        body: "",
+        headers: {
+            "Content-type": "application/json",
+        },
+    });
+}
+
+// Function to find pid tunings for the selected axis, the pid has to be turned off
+// The tuning runs in the background on the server, its progress and report are shown by showAutotune
+// This ends up in server.py at RequestHandler.do_post
+function autotune() {
+    fetch(`${window.location.origin}/api/autotune`, {
+        method: "POST",
+        body: JSON.stringify({
+            axis: document.getElementById('autotune-axis').value,
+            settling_time: document.getElementById('autotune-settling-time').value,
+            save: document.getElementById('autotune-save').checked,
+        }),
+        headers: {
+            "Content-type": "application/json",
+        },
+    }).then(response => {
+        if (!response.ok) {
+            document.getElementById('autotune-progress').textContent = response.statusText;
+            return;
+        }
+        response.json().then(showAutotune);
+    });
+}
+
+// Function to stop the auto-tune
+// This ends up in server.py at RequestHandler.do_post
+function cancelAutotune() {
+    fetch(`${window.location.origin}/api/autotune/cancel`, {
+        method: "POST",
+        body: "",
+        headers: {
+            "Content-type": "application/json",
+        },
+    });
+}
+
+// Function to show the progress of the auto-tune job, and the report of every axis when it is done
+// The report is built in autotune.py at AutoTune.run
+function showAutotune(job) {
+    if (!job) {
+        return;
+    }
+    let text = `${job.status} ${job.description} ${job.error}`;
+    for (const [axis, report] of Object.entries(job.result || {})) {
+        const settled = report.settling_time === null ? 'not settled' : `settled ${report.settling_time.toFixed(2)} s`;
+        text += ` | ${axis}: P ${report.tunings[0]} D ${report.tunings[2]}, ${settled}, ` +
+            `overshoot ${report.overshoot.toFixed(1)}%, ${report.loop_rate.toFixed(0)} Hz`;
+    }
+    document.getElementById('autotune-progress').textContent = text;
+}
+
+// Function to show the progress of the peak search job
+// The job state is built in job.py at Job.state
+function showPeakSearch(job) {
+    if (!job) {
+        return;
+    }
+    document.getElementById('peak-progress').textContent = `${job.status} ${job.description}`;
+}
+
+// Function to show the progress of the calibration job
+// The job state is built in job.py at Job.state
+function showCalibration(job) {
+    if (!job) {
+        return;
+    }
+    const percentage = Math.round(job.progress * 100);
+    document.getElementById('calibration-progress').textContent =
+        `${job.status} ${percentage}% ${job.description}`;
+}
+
 // Function to periodically fetch the current dish position
 // This ends up in server.py at RequestHandler.do_get
+// Only used when the telemetry stream is not available
 function fetchCurrentPosition() {
     fetch(`${window.location.origin}/api/get-current-position`) // perform the get request
         .then(response => {
             // after the response has been received
-            console.log(response)
             if (!response.ok) {
                 throw new Error("Network response was not ok");
             }
@@ -92,7 +307,6 @@ function fetchCurrentPosition() {
         })
         .then(data => {
             // after data has been converted
-            console.log(data)
             // Assuming `data` contains `{ azimuth: value, elevation: value }`
             document.getElementById('current-azimuth').textContent = data.azimuth;
             document.getElementById('current-elevation').textContent = data.elevation;
@@ -103,5 +317,59 @@ function fetchCurrentPosition() {
         });
 }
 
+// Function to show one telemetry frame on the page
+// The frame is built in dish.py at Dish.telemetry
+function showTelemetry(data) {
+    document.getElementById('current-azimuth').textContent = data.azimuth.position;
+    document.getElementById('current-elevation').textContent = data.elevation.position;
+    document.getElementById('velocity-azimuth').textContent = data.azimuth.velocity.toFixed(1);
+    document.getElementById('velocity-elevation').textContent = data.elevation.velocity.toFixed(1);
+    document.getElementById('pid-state').textContent = data.pid_active ? 'On' : 'Off';
+    document.getElementById('profile-state').textContent = data.profile;
+    document.getElementById('calibration-status').textContent = data.calibration.join(' / ');
+    showCalibration(data.calibration_job);
+    showPeakSearch(data.peak_job);
+    showAutotune(data.autotune_job);
+    document.getElementById('offset').textContent =
+        `${data.offset[0].toFixed(3)} / ${data.offset[1].toFixed(3)}`;
+    // signal strength measured by the SDR, see sdr.py
+    document.getElementById('signal-strength').textContent =
+        data.signal && data.signal.power !== null ? `${data.signal.power.toFixed(1)} dB` : 'N/A';
+    const tracking = data.tracking;
+    document.getElementById('tracking').textContent =
+        tracking.target === null ? 'Not tracking' : `${tracking.name} (${tracking.status})`;
+    if (tracking.target !== null && tracking.status === 'tracking') {
+        document.getElementById('goal-azimuth').textContent = tracking.azimuth.toFixed(2);
+        document.getElementById('goal-elevation').textContent = tracking.elevation.toFixed(2);
+    }
+}
+
 // Start polling the server for the current position every 0.5 seconds
-setInterval(fetchCurrentPosition, 500);
+// Used as a fallback for browsers or servers without the telemetry stream
+let pollTimer = null;
+function startPolling() {
+    if (pollTimer === null) {
+        pollTimer = setInterval(fetchCurrentPosition, 500);
+    }
+}
+
+// Open the telemetry stream, the server pushes new data to the page by itself
+// This ends up in server.py at RequestHandler.streamTelemetry
+function startTelemetry() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+    const source = new EventSource(`${window.location.origin}/api/stream`);
+    source.onmessage = event => showTelemetry(JSON.parse(event.data));
+    source.onerror = () => {
+        // The browser reconnects by itself, unless the stream could not be opened at all
+        if (source.readyState === EventSource.CLOSED) {
+            console.error("Telemetry stream unavailable, falling back to polling");
+            startPolling();
+        }
+    };
+}
+
+loadProfiles();
+startTelemetry();
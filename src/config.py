@@ -1,85 +1,520 @@
+import collections
 import configparser
 import os
 import logging
+import threading
+
+from pointing import parse_mount
 
 logger = logging.getLogger(__name__)
 
+# Tracking profiles are the config sections that start with this, see Config.getProfile
+PROFILE = "Profile "
+# Profiles added to the file use the defaults of this one for the values they leave out
+PROFILE_TEMPLATE = PROFILE + "LEO"
+
+# A tracking profile: the settings of the control loops that are switched together (see Dish.set_profile).
+# A geostationary satellite hardly moves and needs a different pid controller than one in a low earth orbit.
+# azimuth, elevation: pid tunings (p, i, d) of the motor
+# rate: how many times per second the pid controllers update (Hz)
+# max_velocity, max_acceleration: limits of the motors in steps per second and steps per second^2
+# sensor_rate: how many times per second the position sensor is read (Hz)
+Profile = collections.namedtuple(
+    "Profile", ["name", "azimuth", "elevation", "rate", "max_velocity", "max_acceleration", "sensor_rate"])
+
 # Copied from a previous project, a bit overkill for this project.
 # Allows to create, save and load different configurations during runtime.
-# This would allow the dish to have different "modes" each with different properties.
-# Say we would have a GEO and LEO mode, you could load the leo config from the webinterface during runtime
-# This would then for example load different pid tunings more optimized for moving targets
-# Right now this only loads the port that the webserver is hosted on, which has no reason to change during runtime
+# The different "modes" of the dish are the tracking profiles (see Profile), like GEO and LEO.
+# They can be switched from the webinterface during runtime, to use pid tunings more optimized for moving targets
+#
+# The getters are called from the control loops, so they read from a snapshot: a dictionary with the values
+# that were already converted to their type. It is replaced by an empty one whenever the config changes,
+# so a getter never needs a lock and never sees half a change.
+# Changes (Config.set) are written to the file after save_delay seconds, so a burst of changes is written once.
+# The file is written to a temporary file first and then renamed over the old one, which replaces it in one step:
+# when the program crashes while saving, the old file is still there.
+# A thread watches the file, when it is edited outside of the program it is loaded again and the subscribers
+# (see Config.subscribe) get the names of the values that changed, so they can use them without a restart.
 
 
 class Config():
     configFolder = "config/"
     currentConfig = ""
     version = '1'
+    # Seconds between a change and writing it to the file, see Config.save
+    save_delay = 1.0
+    # Seconds between two checks of the file for changes made outside of the program
+    watch_interval = 1.0
     __config = configparser.ConfigParser()
     __default = configparser.ConfigParser()
+    __snapshot = {}  # (type, section, name) -> value, filled by __get
+    __lock = threading.RLock()  # taken by everything that changes __config or the file
+    __subscribers = []
+    __save_timer: threading.Timer = None
+    __dirty = False  # there are changes that are not written to the file yet
+    __mtime = None  # modification time (ns) of the file when it was last read or written by us
+    __stop = threading.Event()
+    __watcher: threading.Thread = None
 
     def start():
         logger.debug('starting config')
         Config.__createDefault()
         Config.open()
+        Config.__stop.clear()
+        Config.__watcher = threading.Thread(target=Config.__watch, name="config")
+        Config.__watcher.daemon = True  # Makes sure the thread stops when the process ends/crashes
+        Config.__watcher.start()
+
+    # Stop watching the file and write the changes that are not saved yet
+    def stop():
+        Config.__stop.set()
+        Config.flush()
 
     def open(name="default.ini"):
         logger.debug('opening ' + name)
-        Config.save()
-        Config.currentConfig = name
-        path = Config.configFolder + name
-        if os.path.exists(path):
-            logger.info('opening config ' + name)
-            Config.__config.read(path)
-            version = ''
-            if Config.__config.has_section('Metadata'):
-                version = Config.__config['Metadata']['Version']
-            if not (version == Config.version):
-                logger.warn(
-                    "Config %s is outdated! Version is %s instead of required %s", name, version, Config.version)
+        with Config.__lock:
+            Config.flush()  # the changes to the previous config
+            Config.currentConfig = name
+            path = Config.__path()
+            if os.path.exists(path):
+                logger.info('opening config ' + name)
+                config = Config.__read(path)
+                if config is None:
+                    Config.__loadDefault()
+                else:
+                    Config.__use(config)
+            else:
+                logger.info('no config exists, opening default')
                 Config.__loadDefault()
-        else:
-            logger.info('no config exists, opening default')
-            Config.__loadDefault()
-            Config.save()
+                Config.__write()
 
+    # Write the changes to the file after save_delay seconds. Changes made in the meantime are written with them
     def save():
         if Config.currentConfig == "":
             logger.debug("Attempting to save default config")
             return
-        logger.info("Saving config: " + Config.currentConfig)
+        with Config.__lock:
+            Config.__dirty = True
+            if Config.__save_timer is None:
+                Config.__save_timer = threading.Timer(Config.save_delay, Config.flush)
+                Config.__save_timer.daemon = True
+                Config.__save_timer.start()
+
+    # Write the changes to the file now, if there are any
+    def flush():
+        with Config.__lock:
+            if Config.__save_timer:
+                Config.__save_timer.cancel()
+                Config.__save_timer = None
+            if Config.__dirty:
+                Config.__write()
+
+    # Change a value and save it (see Config.save). The subscribers are told about the change
+    def set(section, name, value):
+        with Config.__lock:
+            if not Config.__config.has_section(section):
+                Config.__config.add_section(section)
+            Config.__config[section][name] = str(value)
+            Config.__snapshot = {}
+        Config.save()
+        Config.__notify({(section, name)})
+
+    # Call callback with a set of (section, name) of the values that changed, every time the config changes
+    def subscribe(callback):
+        Config.__subscribers.append(callback)
 
-        path = Config.configFolder + Config.currentConfig
-        if os.path.exists(path):
-            logger.debug('removing old config')
-            os.remove(path)
+    def __notify(changed):
+        if not changed:
+            return
+        for callback in list(Config.__subscribers):
+            try:
+                callback(changed)
+            except Exception as e:
+                logger.error(f"Failed to apply config change {changed}: {e}")
 
-        logger.debug('writing new config')
-        with open(path, 'w') as configfile:
+    def __path():
+        return Config.configFolder + Config.currentConfig
+
+    # Write the config to a temporary file and put it in place of the old one
+    def __write():
+        path = Config.__path()
+        logger.info("Saving config: " + Config.currentConfig)
+        temporary = path + ".tmp"
+        with open(temporary, 'w') as configfile:
             Config.__config.write(configfile)
+            configfile.flush()
+            os.fsync(configfile.fileno())  # on the disk before the rename, or a crash could leave an empty file
+        os.replace(temporary, path)
+        Config.__mtime = os.stat(path).st_mtime_ns
+        Config.__dirty = False
+
+    # Read a config file, None when it can not be used
+    def __read(path):
+        Config.__mtime = os.stat(path).st_mtime_ns  # also when it is broken, it is reported once
+        config = configparser.ConfigParser()
+        try:
+            config.read(path)
+        except configparser.Error as e:
+            logger.error(f"Config {path} can not be read: {e}")
+            return None
+        version = ''
+        if config.has_section('Metadata'):
+            version = config['Metadata'].get('Version', '')
+        if not (version == Config.version):
+            logger.warning(
+                "Config %s is outdated! Version is %s instead of required %s", path, version, Config.version)
+            return None
+        return config
+
+    def __use(config):
+        Config.__config = config
+        Config.__snapshot = {}
+
+    # This is what the thread is doing: load the file again when it has been changed by something else
+    def __watch():
+        while not Config.__stop.wait(Config.watch_interval):
+            try:
+                Config.__reload()
+            except Exception as e:
+                logger.error(f"Failed to reload config: {e}")
+
+    def __reload():
+        with Config.__lock:
+            path = Config.__path()
+            if not Config.currentConfig or not os.path.exists(path) or \
+                    os.stat(path).st_mtime_ns == Config.__mtime:
+                return
+            logger.info("Config changed on disk, reloading " + Config.currentConfig)
+            config = Config.__read(path)
+            if config is None:  # keep using the old values
+                return
+            if Config.__dirty:
+                logger.warning("Config changed on disk before our changes were saved, using the file")
+                Config.__dirty = False
+            old = Config.__config
+            Config.__use(config)
+        Config.__notify(Config.__changes(old, config))
+
+    # The (section, name) of all values that differ between two configs
+    def __changes(old, new):
+        changed = set()
+        for section in set(old.sections()) | set(new.sections()):
+            names = set(old[section] if old.has_section(section) else ()) | \
+                set(new[section] if new.has_section(section) else ())
+            for name in names:
+                if old.get(section, name, fallback=None) != new.get(section, name, fallback=None):
+                    changed.add((section, name))
+        return changed
 
     def getWebPort() -> int:
-        logger.debug('getting web port')
         return Config.__getint('WebConfig', 'port')
 
+    # Connections the web interface accepts at the same time, see server.py
+    def getWebMaxClients() -> int:
+        return Config.__getint('WebConfig', 'max_clients')
+
+    # Threads that run the requests of the web interface (the calls to the Dish)
+    def getWebWorkers() -> int:
+        return Config.__getint('WebConfig', 'workers')
+
+    # Seconds an idle connection of the web interface stays open for the next request
+    def getWebKeepAlive() -> float:
+        return Config.__getfloat('WebConfig', 'keep_alive')
+
+    # How many telemetry frames per second are pushed to the web interface
+    def getStreamRate() -> float:
+        return Config.__getfloat('WebConfig', 'stream_rate')
+
+    # Which hardware to use: "hardware", "sim" or "auto" (see backend.py)
+    def getBackend() -> str:
+        return Config.__getstr('Hardware', 'backend')
+
+    # Standard deviation of the noise of the simulated sensor in degrees
+    def getSimNoise() -> float:
+        return Config.__getfloat('Hardware', 'sim_noise')
+
+    # Delay of the simulated sensor in seconds
+    def getSimLatency() -> float:
+        return Config.__getfloat('Hardware', 'sim_latency')
+
+    # How many records per second the recorder writes (see recorder.py), 0 to disable it
+    def getRecorderRate() -> float:
+        return Config.__getfloat('Recorder', 'rate')
+
+    # How many records fit in the recording before the oldest are overwritten
+    def getRecorderCapacity() -> int:
+        return Config.__getint('Recorder', 'capacity')
+
+    # File with the TLE sets of the satellites that can be tracked (see ephemeris.py)
+    def getTleFile() -> str:
+        return Config.__getstr('Ephemeris', 'tle_file')
+
+    # How many times per second the target of a tracked satellite is updated
+    def getTrackRate() -> float:
+        return Config.__getfloat('Ephemeris', 'track_rate')
+
+    # Satellites below this elevation (in degrees) are not tracked
+    def getMinElevation() -> float:
+        return Config.__getfloat('Ephemeris', 'min_elevation')
+
+    # Seconds between two columns of the look-angle table of the catalogue
+    def getTableStep() -> float:
+        return Config.__getfloat('Ephemeris', 'table_step')
+
+    # How many hours ahead the look-angle table of the catalogue goes
+    def getTableHours() -> float:
+        return Config.__getfloat('Ephemeris', 'table_hours')
+
+    # Seconds between two recalculations of the look-angle table
+    def getTableRefresh() -> float:
+        return Config.__getfloat('Ephemeris', 'table_refresh')
+
+    # Location of the ground station: latitude, longitude (degrees) and altitude (meters)
+    def getStation() -> tuple:
+        return (Config.__getfloat('Station', 'latitude'),
+                Config.__getfloat('Station', 'longitude'),
+                Config.__getfloat('Station', 'altitude'))
+
+    # Where the IQ samples for the signal strength come from: "none", "file" or "rtlsdr" (see sdr.py)
+    def getSdrSource() -> str:
+        return Config.__getstr('SDR', 'source')
+
+    # Recording that is replayed when the source is "file" (.cfile or .npy)
+    def getSdrFile() -> str:
+        return Config.__getstr('SDR', 'file')
+
+    # Samples per second of the SDR
+    def getSdrSampleRate() -> float:
+        return Config.__getfloat('SDR', 'sample_rate')
+
+    # Frequency the SDR is tuned to in Hz
+    def getSdrFrequency() -> float:
+        return Config.__getfloat('SDR', 'center_frequency')
+
+    # Gain of the SDR in dB, or "auto"
+    def getSdrGain():
+        gain = Config.__getstr('SDR', 'gain')
+        return gain if gain == 'auto' else float(gain)
+
+    # Amount of samples in one block, every block gives one signal strength measurement
+    def getSdrBlockSize() -> int:
+        return Config.__getint('SDR', 'block_size')
+
+    # Amount of samples in one FFT, sets the frequency resolution of the spectrum
+    def getSdrFftSize() -> int:
+        return Config.__getint('SDR', 'fft_size')
+
+    # Band (Hz, relative to the center frequency) in which the power is measured, None for all of it
+    def getSdrBand():
+        low = Config.__getstr('SDR', 'band_low')
+        high = Config.__getstr('SDR', 'band_high')
+        if not low or not high:
+            return None
+        return (float(low), float(high))
+
+    # Width of the main lobe of the dish in degrees, sets the size of the peak search pattern (see peak.py)
+    def getPeakBeamwidth() -> float:
+        return Config.__getfloat('PeakSearch', 'beamwidth')
+
+    # Seconds the signal power is measured at every point of the peak search
+    def getPeakDwell() -> float:
+        return Config.__getfloat('PeakSearch', 'dwell')
+
+    # Maximum amount of conical scans of the peak search
+    def getPeakIterations() -> int:
+        return Config.__getint('PeakSearch', 'iterations')
+
+    # The peak search stops when the peak moves less than this (degrees)
+    def getPeakTolerance() -> float:
+        return Config.__getfloat('PeakSearch', 'tolerance')
+
+    # How far (degrees) the peak search looks for a signal when there is none at the start
+    def getPeakSearchRadius() -> float:
+        return Config.__getfloat('PeakSearch', 'search_radius')
+
+    # Settling time (seconds) the auto-tune aims for with a small step, see autotune.py
+    def getAutoTuneSettlingTime() -> float:
+        return Config.__getfloat('AutoTune', 'settling_time')
+
+    # Damping ratio of the loop tuned by the auto-tune, 1 does not overshoot, lower settles sooner
+    def getAutoTuneDamping() -> float:
+        return Config.__getfloat('AutoTune', 'damping')
+
+    # Speed (degrees per second) and duration (seconds) of the run the auto-tune measures the motor with
+    def getAutoTuneTestSpeed() -> float:
+        return Config.__getfloat('AutoTune', 'test_speed')
+
+    def getAutoTuneTestTime() -> float:
+        return Config.__getfloat('AutoTune', 'test_time')
+
+    # Run the motors and sensor in their own process (see control_core.py)
+    def getCoreEnabled() -> bool:
+        return Config.__getbool('ControlCore', 'enabled')
+
+    # Cpu core the control core is pinned to, -1 to let the system choose
+    def getCoreCpu() -> int:
+        return Config.__getint('ControlCore', 'cpu')
+
+    # Real-time (SCHED_FIFO) priority of the control core, 1 to 99, 0 for normal priority. Needs root
+    def getCorePriority() -> int:
+        return Config.__getint('ControlCore', 'priority')
+
+    # How many times per second the control core reads commands and publishes its state
+    def getCoreSyncRate() -> float:
+        return Config.__getfloat('ControlCore', 'sync_rate')
+
+    # Name of the tracking profile in use
+    def getProfileName() -> str:
+        return Config.__getstr('PID', 'profile')
+
+    # Names of all tracking profiles, the sections called "Profile <name>"
+    def getProfileNames() -> list:
+        sections = set(Config.__config.sections()) | set(Config.__default.sections())
+        return sorted(section[len(PROFILE):] for section in sections if section.startswith(PROFILE))
+
+    # A tracking profile, the one in use when no name is given. Raises KeyError when it does not exist
+    def getProfile(name=None) -> Profile:
+        name = name or Config.getProfileName()
+        section = PROFILE + name
+        if not Config.__config.has_section(section) and not Config.__default.has_section(section):
+            raise KeyError(f"No profile {name}")
+        return Profile(name,
+                       Config.__gettunings(section, 'azimuth'),
+                       Config.__gettunings(section, 'elevation'),
+                       Config.__get('getfloat', section, 'rate', PROFILE_TEMPLATE),
+                       Config.__get('getfloat', section, 'max_velocity', PROFILE_TEMPLATE),
+                       Config.__get('getfloat', section, 'max_acceleration', PROFILE_TEMPLATE),
+                       Config.__get('getfloat', section, 'sensor_rate', PROFILE_TEMPLATE))
+
+    # Switch to another tracking profile. Raises KeyError when it does not exist
+    def setProfile(name):
+        Config.getProfile(name)
+        Config.set('PID', 'profile', name)
+
+    # Tunings (p, i, d) of the pid controller of a motor, "azimuth" or "elevation", in the profile in use
+    def getPidTunings(axis) -> tuple:
+        return getattr(Config.getProfile(), axis)
+
+    # Save new tunings of the pid controller of a motor in the profile in use
+    def setPidTunings(axis, p, i, d):
+        Config.set(PROFILE + Config.getProfileName(), axis, f"{p}, {i}, {d}")
+
+    # How many times per second the pid controllers update (Hz), in the profile in use
+    def getPidRate() -> float:
+        return Config.getProfile().rate
+
+    # How the position sensor is fixed to the dish, the directions used to turn its quaternion into azimuth and elevation (see pointing.py)
+    def getMount():
+        return parse_mount(Config.__getstr('Mount', 'boresight'),
+                           Config.__getstr('Mount', 'axle'),
+                           Config.__getstr('Mount', 'north'),
+                           Config.__getstr('Mount', 'east'))
+
     def __createDefault():
         logger.debug('loading default')
         Config.__default = configparser.ConfigParser()
         Config.__default['Metadata'] = {'version': Config.version}
         Config.__default['WebConfig'] = {'port': '8080',
-                                         'address': ''}
+                                         'address': '',
+                                         'stream_rate': '10',
+                                         'max_clients': '32',
+                                         'workers': '4',
+                                         'keep_alive': '15'}
+        Config.__default['Hardware'] = {'backend': 'auto',
+                                        'sim_noise': '0',
+                                        'sim_latency': '0'}
+        Config.__default['Recorder'] = {'rate': '100',
+                                        'capacity': '360000'}
+        Config.__default['Ephemeris'] = {'tle_file': 'config/satellites.tle',
+                                         'track_rate': '2',
+                                         'min_elevation': '0',
+                                         'table_step': '60',
+                                         'table_hours': '12',
+                                         'table_refresh': '600'}
+        Config.__default['SDR'] = {'source': 'none',
+                                   'file': 'recordings/signal.cfile',
+                                   'sample_rate': '2400000',
+                                   'center_frequency': '1420000000',
+                                   'gain': 'auto',
+                                   'block_size': '262144',
+                                   'fft_size': '1024',
+                                   'band_low': '',
+                                   'band_high': ''}
+        Config.__default['PeakSearch'] = {'beamwidth': '3',
+                                          'dwell': '0.5',
+                                          'iterations': '8',
+                                          'tolerance': '0.05',
+                                          'search_radius': '10'}
+        Config.__default['AutoTune'] = {'settling_time': '3',
+                                        'damping': '0.9',
+                                        'test_speed': '0.5',
+                                        'test_time': '1'}
+        Config.__default['ControlCore'] = {'enabled': 'false',
+                                           'cpu': '3',
+                                           'priority': '50',
+                                           'sync_rate': '500'}
+        Config.__default['PID'] = {'profile': 'LEO'}
+        # A geostationary satellite hardly moves: a slow loop that uses little cpu
+        Config.__default[PROFILE + 'GEO'] = {'azimuth': '-1, 0, -2.5',
+                                             'elevation': '-1, 0, -2.5',
+                                             'rate': '200',
+                                             'max_velocity': '20000',
+                                             'max_acceleration': '2000',
+                                             'sensor_rate': '50'}
+        # A low earth orbit satellite crosses the sky in minutes: a fast loop, all the speed the motors have
+        Config.__default[PROFILE + 'LEO'] = {'azimuth': '-1, 0, -2.5',
+                                             'elevation': '-1, 0, -2.5',
+                                             'rate': '1000',
+                                             'max_velocity': '100000',
+                                             'max_acceleration': '2000',
+                                             'sensor_rate': '100'}
+        Config.__default['Mount'] = {'boresight': '0, 1, 0',
+                                     'axle': '1, 0, 0',
+                                     'north': '0, 1, 0',
+                                     'east': '-1, 0, 0'}
+        Config.__default['Station'] = {'latitude': '52.0116',
+                                       'longitude': '4.3571',
+                                       'altitude': '0'}
         logger.debug(Config.__default)
 
     def __loadDefault():
-        Config.__config = Config.__default
+        config = configparser.ConfigParser()
+        config.read_dict(Config.__default)  # a copy, Config.set should not change the defaults
+        Config.__use(config)
         Config.currentConfig = 'default.ini'
 
-    def __getint(section, name) -> int:
-        logger.debug("getting value %s from config %s",
-                     name, Config.currentConfig)
-        default = Config.__default[section].getint(name)
-        if Config.__config.has_section(section):
-            return Config.__config[section].getint(name, fallback=default)
+    # The value of a setting converted with the getter of configparser (get, getint, getfloat or getboolean)
+    # Taken from the snapshot when it was converted before.
+    # Sections that have no defaults (like profiles added to the file) use the defaults of the template section
+    def __get(getter, section, name, template=None):
+        snapshot = Config.__snapshot  # the one of this moment, a change replaces it
+        key = (getter, section, name)
+        try:
+            return snapshot[key]
+        except KeyError:
+            pass
+        defaults = Config.__default[section if Config.__default.has_section(section) else template]
+        default = getattr(defaults, getter)(name)
+        config = Config.__config
+        if config.has_section(section):
+            value = getattr(config[section], getter)(name, fallback=default)
         else:
-            return default
+            value = default
+        snapshot[key] = value
+        return value
+
+    # Tunings (p, i, d) from comma separated values
+    def __gettunings(section, name) -> tuple:
+        return tuple(float(value) for value in Config.__get('get', section, name, PROFILE_TEMPLATE).split(","))
+
+    def __getint(section, name) -> int:
+        return Config.__get('getint', section, name)
+
+    def __getstr(section, name) -> str:
+        return Config.__get('get', section, name)
+
+    def __getbool(section, name) -> bool:
+        return Config.__get('getboolean', section, name)
+
+    def __getfloat(section, name) -> float:
+        return Config.__get('getfloat', section, name)
@@ -0,0 +1,551 @@
+import atexit
+import collections
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from sensor import Sample
+
+logger = logging.getLogger(__name__)
+
+# Runs the control loops of both motors and the position sensor in their own process (the control core).
+# In one process, everything (the web server threads, the telemetry, the LCD, the logs) has to share the GIL
+# with the pid controllers, so a burst of web requests makes the motors run late. In their own process the
+# control loops only compete with each other. The process can be pinned to one cpu core and run with real-time
+# priority (SCHED_FIFO), so the rest of the system does not disturb it either.
+#
+# The two processes talk through one block of shared memory with two parts:
+# - commands, written by the main program: mode, target, tunings and rates of both motors
+# - state, written by the control core: the latest sensor sample and the state of both motors
+# Each part is protected by a sequence lock (see SeqLock), so neither process ever waits for the other.
+# The main program uses StepperProxy and SamplerProxy, which look like Stepper and SensorSampler to the rest
+# of the program, so Dish and the web server work the same with or without the control core.
+# Enable it with enabled = true in the [ControlCore] section of the config.
+
+# What a motor should be doing
+MODE_IDLE = 0  # standing still
+MODE_PID = 1  # following the target with the pid controller
+MODE_VELOCITY = 2  # running at a fixed velocity (moves without pid, see motion.py)
+MODE_DISABLED = 3  # disabled, the program is stopping
+
+# Commands of one motor: mode, stops (counts Stepper.stop calls), goal (steps), goal rate (steps/s),
+# goal time (time.monotonic), p, i, d, pid rate (Hz), velocity (steps/s), max velocity (steps/s),
+# max acceleration (steps/s^2)
+AXIS_COMMAND = "12d"
+AXIS_COMMAND_SIZE = 12
+# Commands: shutdown, sensor rate (Hz), azimuth, elevation
+COMMAND = struct.Struct("<2d" + AXIS_COMMAND * 2)
+
+# State of one motor: sensor position (degrees), goal (steps), goal rate, velocity, acceleration, correction,
+# p, i and d components, target rate, achieved rate, jitter, max lateness, ticks, missed ticks,
+# writes issued, writes suppressed, pid enabled, steps per revolution, max acceleration, max velocity,
+# commanded steps, estimated position (degrees), dead reckoning
+AXIS_STATE = "24d"
+AXIS_STATE_SIZE = 24
+# State: sensor sample (timestamp, euler x3, quaternion x4, calibration x4), azimuth, elevation,
+# heartbeat (time.monotonic of the last update), updates, sensor errors
+STATE = struct.Struct("<12d" + AXIS_STATE * 2 + "3d")
+
+SEQUENCE = struct.Struct("<Q")
+COMMAND_OFFSET = 0
+STATE_OFFSET = 512  # COMMAND fits in the first part, SEQUENCE + STATE in the second
+SIZE = STATE_OFFSET + SEQUENCE.size + STATE.size
+
+
+# A sequence lock over a part of shared memory, for one writer and any amount of readers.
+# The writer makes the sequence number odd, writes the values and makes it even again.
+# A reader copies the values and checks that the sequence number was even and did not change while copying,
+# otherwise the writer was busy and it tries again. Neither side ever blocks the other.
+class SeqLock():
+    retries = 1000  # give up reading after this many tries (the writer crashed while writing)
+
+    def __init__(self, buffer, offset, layout: struct.Struct):
+        self.buffer = buffer
+        self.offset = offset
+        self.layout = layout
+        self._sequence = SEQUENCE.unpack_from(buffer, offset)[0]
+        self._values = None
+
+    def write(self, values):
+        self._sequence += 1  # odd: busy
+        SEQUENCE.pack_into(self.buffer, self.offset, self._sequence)
+        self.layout.pack_into(self.buffer, self.offset + SEQUENCE.size, *values)
+        self._sequence += 1  # even: done
+        SEQUENCE.pack_into(self.buffer, self.offset, self._sequence)
+
+    # The values and their sequence number. Returns the last values read when the writer stays busy
+    def read(self):
+        for _ in range(self.retries):
+            before = SEQUENCE.unpack_from(self.buffer, self.offset)[0]
+            if before & 1:
+                continue
+            values = self.layout.unpack_from(self.buffer, self.offset + SEQUENCE.size)
+            if SEQUENCE.unpack_from(self.buffer, self.offset)[0] == before:
+                self._values = (before, values)
+                return self._values
+        return self._values
+
+
+# Attach to the shared memory created by the main program.
+# The spawned process shares the resource tracker of the main program, which removes the memory if both crash
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # python 3.13 and newer
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _number(value):
+    return math.nan if value is None else float(value)
+
+
+def _optional(value):
+    return None if math.isnan(value) else value
+
+
+# The main program side of the control core: starts the process and gives access to it through the proxies
+class ControlCore():
+    start_timeout = 10  # seconds to wait for the control core to report for the first time
+
+    def __init__(self, settings, profile):
+        # settings: dictionary with the backend, cpu, priority and sync rate, passed to the process
+        # profile: the tracking profile the motors and sensor start with (see Config.getProfile)
+        self.settings = settings
+        self.memory = shared_memory.SharedMemory(create=True, size=SIZE)
+        self.memory.buf[:SIZE] = bytes(SIZE)
+        self.commands = SeqLock(self.memory.buf, COMMAND_OFFSET, COMMAND)
+        self.state = SeqLock(self.memory.buf, STATE_OFFSET, STATE)
+        # a sequence lock has one writer, the threads of the main program take turns
+        self._lock = threading.Lock()
+
+        # the commands as last written, the main program is the only writer so this is always up to date
+        self._command = [0.0, profile.sensor_rate]
+        for tunings in (profile.azimuth, profile.elevation):
+            self._command += [MODE_IDLE, 0, 0, 0, 0, *tunings, profile.rate, 0,
+                              profile.max_velocity, profile.max_acceleration]
+        self.commands.write(self._command)
+
+        self.azimuth = StepperProxy(self, 0)
+        self.elevation = StepperProxy(self, 1)
+        self.sampler = SamplerProxy(self, profile.sensor_rate)
+        # spawn starts a fresh interpreter, fork would copy the threads and locks of this process
+        self.process = multiprocessing.get_context("spawn").Process(
+            target=run, args=(self.memory.name, settings, os.getpid()), name="control-core")
+        self.process.daemon = True  # Makes sure the process stops when the program ends/crashes
+
+    def start(self):
+        logger.info(f"Starting control core (cpu {self.settings['cpu']}, priority {self.settings['priority']})")
+        self.process.start()
+        deadline = time.monotonic() + self.start_timeout
+        while self.heartbeat == 0:
+            if not self.process.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("Control core did not start, see logs/core.log")
+            time.sleep(0.05)
+        # the core ignores the terminate signal that multiprocessing sends its daemon processes at the exit,
+        # this stops it first when the program exits without Dish.stop
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        atexit.unregister(self.stop)
+        with self._lock:
+            self._command[0] = 1  # shutdown
+            self.commands.write(self._command)
+        self.process.join(timeout=5)
+        if self.process.is_alive():  # stuck, it ignores the terminate signal (see run)
+            self.process.kill()
+            self.process.join()
+        self.memory.close()
+        self.memory.unlink()
+
+    # Change some of the commands of a motor, see AXIS_COMMAND for the order
+    def command(self, axis, **values):
+        start = 2 + axis * AXIS_COMMAND_SIZE
+        with self._lock:
+            for name, value in values.items():
+                self._command[start + AXIS_FIELDS[name]] = float(value)
+            self.commands.write(self._command)
+
+    def get_command(self, axis, name):
+        return self._command[2 + axis * AXIS_COMMAND_SIZE + AXIS_FIELDS[name]]
+
+    def set_sensor_rate(self, rate):
+        with self._lock:
+            self._command[1] = rate
+            self.commands.write(self._command)
+
+    def read(self):
+        return self.state.read()[1]
+
+    @property
+    def heartbeat(self):
+        return self.read()[12 + AXIS_STATE_SIZE * 2]
+
+    @property
+    def alive(self):
+        return self.process.is_alive() and time.monotonic() - self.heartbeat < 1
+
+    def stats(self):
+        state = self.read()
+        return {
+            "alive": self.alive,
+            "updates": state[13 + AXIS_STATE_SIZE * 2],
+            "sensor_errors": state[14 + AXIS_STATE_SIZE * 2],
+            "cpu": self.settings["cpu"],
+            "priority": self.settings["priority"],
+        }
+
+
+AXIS_FIELDS = {name: i for i, name in enumerate(
+    ["mode", "stops", "goal", "goal_rate", "goal_time", "p", "i", "d", "pid_rate", "velocity",
+     "max_velocity", "max_acceleration"])}
+
+# The pid attribute of StepperProxy, has the same tunings and components attributes as simple_pid.PID
+PidView = collections.namedtuple("PidView", ["tunings", "components"])
+
+
+# Looks like a Stepper to the rest of the program, but sends the commands to the control core
+# and reads the state from it
+class StepperProxy():
+    def __init__(self, core: ControlCore, axis):
+        self.core = core
+        self.axis = axis
+
+    def _state(self):
+        start = 12 + self.axis * AXIS_STATE_SIZE
+        return self.core.read()[start:start + AXIS_STATE_SIZE]
+
+    @property
+    def steps_per_rev(self):
+        return self._state()[18]
+
+    @property
+    def max_acceleration(self):
+        return self._state()[19]
+
+    @property
+    def max_velocity(self):
+        return self._state()[20]
+
+    @property
+    def sensor_position(self):
+        return self._state()[0]
+
+    @property
+    def current_goal(self):
+        return self._state()[1]
+
+    @property
+    def estimated_position(self):
+        return _optional(self._state()[22])
+
+    @property
+    def dead_reckoning(self):
+        return bool(self._state()[23])
+
+    def step_count(self):
+        return int(self._state()[21])
+
+    @property
+    def goal(self):
+        return self.core.get_command(self.axis, "goal")
+
+    @property
+    def goal_rate(self):
+        return self.core.get_command(self.axis, "goal_rate")
+
+    @property
+    def goal_degrees(self):
+        return self.current_goal / self.steps_per_rev * 360
+
+    @property
+    def velocity(self):
+        return self._state()[3]
+
+    @property
+    def acceleration(self):
+        return self._state()[4]
+
+    @property
+    def do_pid(self):
+        return self.core.get_command(self.axis, "mode") == MODE_PID
+
+    @property
+    def distance(self):
+        state = self._state()
+        distance = (state[1] - state[0] / 360 * self.steps_per_rev) % self.steps_per_rev
+        if distance > self.steps_per_rev / 2:
+            distance -= self.steps_per_rev
+        return distance
+
+    @property
+    def pid(self):
+        state = self._state()
+        tunings = tuple(self.core.get_command(self.axis, name) for name in ("p", "i", "d"))
+        return PidView(tunings, tuple(state[6:9]))
+
+    def __str__(self):
+        stats = self.pid_stats()
+        return \
+            f"a: {self.acceleration:.4f}\n" + \
+            f"v: {self.velocity:.4f}\n" + \
+            f"position: {self.sensor_position}\n" + \
+            f"goal: {self.current_goal}\n" + \
+            f"pid enabled: {self.do_pid}\n" + \
+            f"pid tunings: {self.pid.tunings}\n" + \
+            f"pid loop: {stats['achieved_rate']:.0f}/{stats['target_rate']:.0f} Hz, " + \
+            f"jitter: {stats['jitter'] * 1000:.3f} ms, missed: {stats['missed']}\n" + \
+            ""
+
+    # Same dictionary as Stepper.state
+    def state(self):
+        state = self._state()
+        return {
+            "position": state[0],
+            "goal": state[1] / self.steps_per_rev * 360,
+            "goal_rate": state[2] / self.steps_per_rev * 360,
+            "estimated_position": _optional(state[22]),
+            "dead_reckoning": bool(state[23]),
+            "commanded_steps": int(state[21]),
+            "velocity": state[3],
+            "feed_forward_steps": state[2],
+            "acceleration": state[4],
+            "pid": {
+                "enabled": bool(state[17]),
+                "tunings": self.pid.tunings,
+                "components": tuple(state[6:9]),
+                "loop": self.pid_stats(),
+            },
+            "hardware_writes": self.write_stats(),
+        }
+
+    def pid_stats(self):
+        state = self._state()
+        return {
+            "target_rate": state[9],
+            "achieved_rate": state[10],
+            "jitter": state[11],
+            "max_lateness": state[12],
+            "ticks": int(state[13]),
+            "missed": int(state[14]),
+        }
+
+    def write_stats(self):
+        state = self._state()
+        return {
+            "issued": int(state[15]),
+            "suppressed": int(state[16]),
+        }
+
+    def set_target(self, degrees=None, radians=None):
+        if radians:
+            degrees = math.degrees(radians)
+        self.core.command(self.axis, goal=(degrees or 0) / 360 * self.steps_per_rev, goal_rate=0)
+
+    def set_trajectory(self, degrees, rate):
+        self.core.command(self.axis, goal=degrees / 360 * self.steps_per_rev,
+                          goal_rate=rate / 360 * self.steps_per_rev, goal_time=time.monotonic())
+
+    def hold(self):
+        self.core.command(self.axis, goal=self.current_goal, goal_rate=0)
+
+    def offset_target(self, degrees):
+        self.core.command(self.axis, goal=self.goal + degrees / 360 * self.steps_per_rev)
+
+    def tune(self, p, i, d):
+        self.core.command(self.axis, p=p, i=i, d=d)
+
+    def set_pid_delay(self, delay):
+        self.core.command(self.axis, pid_rate=1 / delay)
+
+    # The profile settings are sent in one command, so the control core applies them together
+    def configure(self, tunings, rate, max_velocity, max_acceleration):
+        p, i, d = tunings
+        self.core.command(self.axis, p=p, i=i, d=d, pid_rate=rate,
+                          max_velocity=max_velocity, max_acceleration=max_acceleration)
+
+    def start_pid(self):
+        self.core.command(self.axis, mode=MODE_PID)
+
+    def stop_pid(self):
+        self.core.command(self.axis, mode=MODE_IDLE)
+
+    def stop(self):
+        mode = self.core.get_command(self.axis, "mode")
+        self.core.command(self.axis, velocity=0, stops=self.core.get_command(self.axis, "stops") + 1,
+                          mode=MODE_IDLE if mode == MODE_VELOCITY else mode)
+
+    def disable(self):
+        self.core.command(self.axis, mode=MODE_DISABLED)
+
+    # Movements without pid are run by motion.execute in the main program, it sets the velocity with this
+    def _set_speed(self, velocity):
+        self.core.command(self.axis, mode=MODE_VELOCITY, velocity=velocity)
+        return velocity if abs(velocity) > 1 else 0
+
+    def abort_moves(self):
+        self.stop()
+
+    def zero(self):
+        pass
+
+    def home(self):
+        pass
+
+
+# Looks like a SensorSampler to the rest of the program, the sensor is read by the control core
+class SamplerProxy():
+    def __init__(self, core: ControlCore, rate):
+        self.core = core
+        self.rate = rate
+
+    @property
+    def latest(self):
+        state = self.core.read()
+        return Sample(state[0],
+                      tuple(_optional(value) for value in state[1:4]),
+                      tuple(_optional(value) for value in state[4:8]),
+                      tuple(int(value) for value in state[8:12]))
+
+    @property
+    def age(self):
+        return time.monotonic() - self.latest.timestamp
+
+    def set_rate(self, rate):
+        self.rate = rate
+        self.core.set_sensor_rate(rate)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+# The control core process itself: reads the sensor, runs both pid controllers,
+# and applies the commands and publishes the state at the sync rate
+def run(memory_name, settings, parent):
+    from backend import Backend
+    from control_loop import ControlLoop
+    from dish import Dish
+    from logs import Logs
+    from pointing import Pointing
+    from sensor import SensorSampler
+
+    # Ctrl-C in the terminal, systemd and timeout signal the whole process group, also this process.
+    # Only the shutdown command of the main program (see ControlCore.stop) or its exit stop the core,
+    # so the motors are always disabled below
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    Logs.path = "logs/core.log"
+    Logs.start()
+    # set before any thread is started, the threads inherit the cpu and priority
+    if settings["cpu"] >= 0:
+        try:
+            os.sched_setaffinity(0, {settings["cpu"]})
+        except (AttributeError, OSError) as e:
+            logger.warning(f"Could not pin control core to cpu {settings['cpu']}: {e}")
+    if settings["priority"] > 0:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(settings["priority"]))
+        except (AttributeError, OSError) as e:  # needs root or CAP_SYS_NICE
+            logger.warning(f"Could not set real-time priority {settings['priority']}: {e}")
+
+    memory = _attach(memory_name)
+    commands = SeqLock(memory.buf, COMMAND_OFFSET, COMMAND)
+    state = SeqLock(memory.buf, STATE_OFFSET, STATE)
+
+    Backend.load(settings["backend"], sensor_noise=settings["sim_noise"], sensor_latency=settings["sim_latency"])
+    sampler = SensorSampler(Backend.create_sensor(), rate=settings["sensor_rate"])
+    sampler.start()
+    time.sleep(1)  # give the sensor one second to boot up
+    motors = Dish.create_motors(Pointing(sampler, settings["mount"]))
+
+    applied = [None, None]  # the last applied commands of each motor
+    updates = 0
+    done = False
+
+    def sync():
+        nonlocal updates, done
+        command = commands.read()[1]
+        if command[0] or os.getppid() != parent:  # shutdown, or the main program is gone
+            done = True
+            return
+        if command[1] != sampler.rate:
+            sampler.set_rate(command[1])
+        for axis, motor in enumerate(motors):
+            start = 2 + axis * AXIS_COMMAND_SIZE
+            values = command[start:start + AXIS_COMMAND_SIZE]
+            _apply(motor, values, applied[axis])
+            applied[axis] = values
+
+        sample = sampler.latest
+        values = [sample.timestamp, *map(_number, sample.euler), *map(_number, sample.quaternion),
+                  *sample.calibration_status]
+        for motor in motors:
+            stats = motor.control_loop.stats()
+            values += [motor.sensor_position, motor.current_goal, motor.goal_rate,
+                       motor.velocity, motor.acceleration, motor.correction,
+                       *map(_number, motor.pid.components),
+                       stats["target_rate"], stats["achieved_rate"], stats["jitter"], stats["max_lateness"],
+                       stats["ticks"], stats["missed"],
+                       motor.writes_issued, motor.writes_suppressed, motor.do_pid,
+                       motor.steps_per_rev, motor.max_acceleration, motor.max_velocity,
+                       motor.step_count(), _number(motor.estimated_position), motor.dead_reckoning]
+        updates += 1
+        values += [time.monotonic(), updates, sampler.errors]
+        state.write(values)
+
+    loop = ControlLoop(sync, settings["sync_rate"], name="core-sync")
+    try:
+        loop.start()
+        logger.info("Control core running")
+        while not done:
+            time.sleep(0.1)
+    finally:
+        loop.stop()
+        for motor in motors:
+            motor.disable()
+        sampler.stop()
+        if Backend.GPIO:
+            Backend.GPIO.cleanup()
+        memory.close()
+    logger.info("Control core stopped")
+    Logs.stop()
+
+
+# Make a motor do what the commands say, only the values that changed are applied
+def _apply(motor, values, previous):
+    mode, stops, goal, goal_rate, goal_time, p, i, d, pid_rate, velocity, max_velocity, max_acceleration = values
+    if previous is None:
+        previous = [None] * len(values)
+    # the settings of the profile, applied together (see Stepper.configure)
+    if (p, i, d, pid_rate, max_velocity, max_acceleration) != \
+            tuple(previous[5:9]) + tuple(previous[10:12]) and pid_rate > 0:
+        motor.configure((p, i, d), pid_rate, max_velocity, max_acceleration)
+    if (goal, goal_rate, goal_time) != tuple(previous[2:5]):
+        motor.goal_time = goal_time
+        motor.goal = goal
+        motor.goal_rate = goal_rate
+    if stops != previous[1] and previous[1] is not None:
+        motor.stop()
+
+    if mode != previous[0]:
+        if mode == MODE_PID:
+            motor.stop()  # start from standing still, like Dish.toggle_pid
+            motor.start_pid()
+        elif mode == MODE_DISABLED:
+            motor.disable()
+        elif motor.do_pid:
+            motor.stop_pid()
+        elif mode == MODE_IDLE:
+            motor.stop()
+    if mode == MODE_VELOCITY and (velocity != previous[9] or mode != previous[0]):
+        motor._set_speed(velocity)
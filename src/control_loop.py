@@ -0,0 +1,138 @@
+import collections
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# This class runs a function at a fixed rate in one long-lived thread.
+# It replaces the old way of re-arming a threading.Timer after every pid calculation,
+# which created a new thread thousands of times per second.
+# The loop keeps a schedule of deadlines (one every period). When a tick runs late it tries to catch up
+# by running the missed ticks back to back. When it is too far behind it skips the missed ticks and
+# starts a new schedule from the current time, so it never tries to run a huge burst of ticks at once.
+# The thread is only created once. start and stop only resume and pause it,
+# so stop can safely be called from inside the callback itself.
+# In manual mode no thread is started at all, and something else has to call tick (used by the simulation in sim.py).
+
+
+class ControlLoop():
+    # How many periods the loop may be behind before it skips instead of catching up
+    max_catch_up = 2
+    # How many ticks are used to calculate the statistics
+    stats_window = 1000
+
+    def __init__(self, callback, rate, name="control-loop", clock=time.monotonic, manual=False):
+        self.callback = callback  # the function that is called every tick
+        self.name = name
+        self.clock = clock  # function that returns the current time in seconds
+        self.manual = manual  # when true, no thread is started and tick has to be called by hand
+        self.rate = rate  # target rate in Hz, sets the period as well
+
+        self._active = threading.Event()  # set while the loop is running, cleared while paused
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self.reset_stats()
+
+    # The target rate in Hz. Can be changed while the loop is running, the new rate is used from the next tick on
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate):
+        if rate <= 0:
+            raise ValueError(f"Control loop rate must be positive, got {rate}")
+        self._rate = rate
+        self.period = 1 / rate
+
+    @property
+    def running(self):
+        return self._active.is_set()
+
+    # The time at which the next tick should run
+    @property
+    def deadline(self):
+        return self._deadline
+
+    # Start (or resume) calling the callback at the configured rate
+    def start(self):
+        with self._lock:
+            self._deadline = self.clock()
+            self._last_tick = None
+            self._active.set()
+            if self.manual:
+                return
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name=self.name)
+                self._thread.daemon = True  # Makes sure the thread stops when the process ends/crashes
+                self._thread.start()
+
+    # Pause the loop. The thread stays alive and waits for the next start
+    def stop(self):
+        self._active.clear()
+
+    # This is what the thread is doing
+    def _worker(self):
+        while True:
+            self._active.wait()  # sleep until the loop is started
+            delay = self._deadline - self.clock()
+            if delay > 0:
+                time.sleep(delay)
+                continue  # check again, the loop might have been stopped while sleeping
+            self.tick()
+
+    # Run one iteration: call the callback and move the deadline to the next period.
+    # The worker thread calls this, but it can also be called by hand to run the loop without a thread (used by the simulation)
+    def tick(self):
+        now = self.clock()
+        lateness = now - self._deadline
+        if self._last_tick is not None:
+            self._intervals.append(now - self._last_tick)
+        self._lateness.append(lateness)
+        self._last_tick = now
+
+        try:
+            self.callback()
+        except Exception as e:
+            # A crash in one tick should not kill the loop, but it should be visible
+            logger.error(f"{self.name} tick failed: {e}")
+        self.ticks += 1
+
+        self._deadline += self.period
+        behind = self.clock() - self._deadline
+        if behind > self.period * self.max_catch_up:
+            # Too far behind, skip the missed ticks and start a new schedule from now
+            skipped = math.floor(behind / self.period)
+            self.missed += skipped
+            self._deadline += skipped * self.period
+
+    def reset_stats(self):
+        self.ticks = 0  # amount of ticks run
+        self.missed = 0  # amount of ticks skipped because the loop was too far behind
+        self._intervals = collections.deque(maxlen=self.stats_window)  # time between ticks
+        self._lateness = collections.deque(maxlen=self.stats_window)  # time between deadline and actual tick
+        self._deadline = self.clock()
+        self._last_tick = None
+
+    # Statistics of the last stats_window ticks, used to see the real loop frequency
+    def stats(self):
+        intervals = list(self._intervals)
+        lateness = list(self._lateness)
+        achieved_rate = 0
+        jitter = 0
+        if intervals:
+            mean = sum(intervals) / len(intervals)
+            achieved_rate = 1 / mean if mean > 0 else 0
+            # jitter is the standard deviation of the time between ticks
+            jitter = math.sqrt(sum((i - mean) ** 2 for i in intervals) / len(intervals))
+        return {
+            "target_rate": self.rate,
+            "achieved_rate": achieved_rate,
+            "jitter": jitter,
+            "max_lateness": max(lateness) if lateness else 0,
+            "ticks": self.ticks,
+            "missed": self.missed,
+        }
@@ -1,12 +1,21 @@
 import logging
 import threading
 import time
-from config import Config
-from RPi import GPIO
-from adafruit_bno055 import BNO055_I2C
-import board
-from rpi_hardware_pwm import HardwarePWM
-
+from autotune import AutoTune, AutoTuneFailed
+from config import Config, PROFILE
+from control_core import ControlCore
+from backend import Backend
+from job import Job, JobCancelled
+import math
+import motion
+from peak import PeakSearch
+from pointing import Pointing
+from control_loop import ControlLoop
+from recorder import Recorder
+import sdr
+from sdr import SignalPipeline
+
+from sensor import SensorSampler
 from stepper import Stepper
 
 
@@ -23,8 +32,26 @@ logger = logging.getLogger(__name__)
 class Dish:
     azimuth_motor: Stepper
     elevation_motor: Stepper
-    sensor: BNO055_I2C
+    sensor: any  # BNO055_I2C, or SimBNO055 in simulation
+    sampler: SensorSampler  # reads the sensor in the background, use Dish.sampler.latest instead of Dish.sensor
+    pointing: Pointing  # where the dish points, from the quaternion of the latest sample. See pointing.py
     pid_active = False
+    calibration_job: Job = None  # the last calibration that was started, see Dish.calibrate
+    recorder: Recorder = None  # records the state of the dish many times per second, see Dish._setup_recorder
+    _records_since_flush = 0
+    sdr: SignalPipeline = None  # measures the signal strength, see Dish._setup_sdr
+    # Correction on top of every target (cross-elevation, elevation) in degrees, found by the peak search.
+    # Makes up for the error of the position sensor. See Dish.set_offset
+    offset = (0.0, 0.0)
+    peak_job: Job = None  # the last peak search that was started, see Dish.peak_search
+    autotune_job: Job = None  # the last auto-tune that was started, see Dish.autotune
+    core: ControlCore = None  # the process running the motors and sensor when enabled, see Dish._setup_core
+    # The pid tunings, loop rate and limits come from the tracking profile in the config, see Dish.apply_config.
+    # Tunings tweaked using the web interface during runtime are saved there, so they are persistent across reboots.
+    _subscribed = False
+    # Cruise velocity (steps per second) and shape of moves without the pid controller, see Dish.move_path
+    move_velocity = 4000
+    move_shape = "trapezoid"
 
     # start the dish, is run at start of the program. Could be called to reboot the dish after it has crashed.
     # this should contain the startup sequence of the dish.
@@ -32,113 +59,244 @@ class Dish:
     def start():
         logger.info("starting dish...")
 
-        Dish._setup_sensors()  # start the position sensor
-        time.sleep(1)  # give the sensor one second to boot up
-        Dish._setup_motors()  # start the stepper motors
+        if Config.getCoreEnabled():
+            Dish._setup_core()  # start the motors and sensor in their own process
+        else:
+            Dish._setup_sensors()  # start the position sensor
+            time.sleep(1)  # give the sensor one second to boot up
+            Dish._setup_motors()  # start the stepper motors
+        Dish.apply_config()  # the settings of the tracking profile
+        if not Dish._subscribed:  # use the new values when the config changes
+            Config.subscribe(Dish._config_changed)
+            Dish._subscribed = True
+
+        Dish._setup_sdr()  # start measuring the signal strength
+        Dish._setup_recorder()  # start recording the state of the dish to a file
 
         Dish.log()  # starts a log cycle to print debug data to the terminal every second
 
     @staticmethod
     def _setup_motors():
         logger.debug("setup motors")
+        Dish.pointing = Pointing(Dish.sampler, Config.getMount())
+        Dish.azimuth_motor, Dish.elevation_motor = Dish.create_motors(Dish.pointing)
 
+    # Create both stepper motors, reading their position and error from pointing
+    # Also used by the control core (see control_core.py), which creates the motors in its own process
+    @staticmethod
+    def create_motors(pointing: Pointing):
         # These two methods serve as the position callback function used in Stepper.sensor_position.
-        # These methods separate the different axes from the sensor and provide only one to each motor
+        # These methods separate the different axes from the pointing and provide only one to each motor
+        # They read the latest sample of the sampler, so they never wait for the I2C bus
         def azimuth():
-            return Dish.sensor.euler[0]
+            return pointing.angles()[0]
 
         def elevation():
-            return Dish.sensor.euler[1]
+            return pointing.angles()[1]
+
+        # The time the latest sample was read, so moving goals can be compared to it
+        def sample_time():
+            return pointing.sampler.latest.timestamp
 
         # This creates one instance of the stepper class by calling Stepper.__init__
         # Here we assign the values to make each motor instance unique
-        Dish.azimuth_motor = Stepper(
+        azimuth_motor = Stepper(
             dir_pin=4,
             enable_pin=22,
-            pwm=HardwarePWM(pwm_channel=2, hz=1, chip=2),
-            position_callback=azimuth
+            pwm=Backend.create_pwm(pwm_channel=2, hz=1, chip=2,
+                                   axis="azimuth", dir_pin=4, enable_pin=22),
+            position_callback=azimuth,
+            position_time_callback=sample_time
         )
 
         # This creates one instance of the stepper class by calling Stepper.__init__
         # Here we assign the values to make each motor instance unique
-        Dish.elevation_motor = Stepper(
+        elevation_motor = Stepper(
             dir_pin=17,
             enable_pin=23,
-            pwm=HardwarePWM(pwm_channel=3, hz=1, chip=2),
-            position_callback=elevation
+            pwm=Backend.create_pwm(pwm_channel=3, hz=1, chip=2,
+                                   axis="elevation", dir_pin=17, enable_pin=23),
+            position_callback=elevation,
+            position_time_callback=sample_time
         )
 
-        # configure the default pid tunings for each motor.
-        # Can be tweaked using the web interface during runtime.
-        # When a stable set of values has been found that way, they can be copied here to make them the new default, and persistent across reboots.
-        Dish.azimuth_motor.tune(-1, 0, -2.5)
-        Dish.elevation_motor.tune(-1, 0, -2.5)
+        # the pid controllers get their error from the pointing, calculated for both axes at once
+        pointing.attach(azimuth_motor, elevation_motor)
+        return azimuth_motor, elevation_motor
+
+    # Start the control core: a separate process that reads the sensor and runs the pid controllers (see control_core.py)
+    # The rest of the program uses proxies that look like the motors and the sampler
+    @staticmethod
+    def _setup_core():
+        settings = {
+            "backend": Backend.name,
+            "sim_noise": Config.getSimNoise(),
+            "sim_latency": Config.getSimLatency(),
+            "cpu": Config.getCoreCpu(),
+            "priority": Config.getCorePriority(),
+            "sync_rate": Config.getCoreSyncRate(),
+            "sensor_rate": Config.getProfile().sensor_rate,
+            "mount": Config.getMount(),
+        }
+        Dish.core = ControlCore(settings, Config.getProfile()).start()
+        Dish.sensor = None  # the sensor belongs to the control core
+        Dish.sampler = Dish.core.sampler
+        Dish.pointing = Pointing(Dish.sampler, Config.getMount())  # the motors use their own in the control core
+        Dish.azimuth_motor = Dish.core.azimuth
+        Dish.elevation_motor = Dish.core.elevation
 
     # starts the Position sensor
     @staticmethod
     def _setup_sensors():
         logger.debug("setup sensors")
 
-        i2c = board.I2C()  # configure the I2C bus
-        # everything else is handled by the library
-        Dish.sensor = BNO055_I2C(i2c)
+        # the backend configures the I2C bus and the sensor (or the simulated sensor)
+        Dish.sensor = Backend.create_sensor()
+
+        # start reading the sensor in the background
+        Dish.sampler = SensorSampler(Dish.sensor, rate=Config.getProfile().sensor_rate)
+        Dish.sampler.start()
+
+    # starts measuring the signal strength with the SDR, see sdr.py
+    @staticmethod
+    def _setup_sdr():
+        Dish.sdr = sdr.from_config(Config)
+        if Dish.sdr:
+            Dish.sdr.start()
+
+    # The latest signal strength measurement (see sdr.Reading), None when there is no SDR
+    @staticmethod
+    def signal():
+        return Dish.sdr.latest if Dish.sdr else None
+
+    # starts recording the state of the dish to logs/telemetry.bin, see recorder.py
+    @staticmethod
+    def _setup_recorder():
+        rate = Config.getRecorderRate()
+        if rate <= 0:
+            logger.info("recorder disabled")
+            return
+        Dish.recorder = Recorder(capacity=Config.getRecorderCapacity())
+        Dish._recorder_loop = ControlLoop(Dish.record, rate, name="recorder")
+        Dish._recorder_loop.start()
+
+    # Write the current state of the dish to the recording
+    # Called by the recorder loop, every tick of it
+    @staticmethod
+    def record():
+        heading, roll, pitch = Dish.sampler.latest.euler
+        values = [heading or 0, roll or 0, pitch or 0]
+        for motor in (Dish.azimuth_motor, Dish.elevation_motor):
+            values += [motor.current_goal, motor.velocity, motor.acceleration, *motor.pid.components]
+        Dish.recorder.record(*values)
+        # Make sure the recording is on the disk every few seconds, in case the power goes out
+        Dish._records_since_flush += 1
+        if Dish._records_since_flush >= Dish._recorder_loop.rate * 5:
+            Dish.recorder.flush()
+            Dish._records_since_flush = 0
 
     # this is the calibration sequence for the sensor.
     # The sensor documentation states there are certain requirements to calibrate the sensor properly
     # This involves maintaining 6 stable positions, and performing a figure-8 movement
-    # It does this by calling a series of waypoints using Stepper.move_angle and Stepper.move_angle_sync
-    # The difference between these methods is that one blocks the program, and the other does not.
-    # This makes it possible to do compound movements by waiting for one motor to complete, but not the other
-    # This way both orders are executed at the same time, but the program still waits for one to be complete.
-    # Note that this only checks one motor to be complete, this should be the one that takes the longest time.
-    # Therefore the motor with the longest path should use Stepper.move_angle and the shorter should use Stepper.move_angle_sync
-    # This method blocks the rest of the program, including the web interface.
+    # The sequence runs as a background job (see job.py), so it does not block the program or the web interface.
+    # It returns the job right away, its progress can be followed with Dish.calibration_job.state()
+    # The accelerometer positions are reached by moving one motor at a time. For the figure-8 of the magnetometer
+    # both motors move at the same time and finish every waypoint together (see Dish.move_path).
     # At the moment, this sequence only calibrates 6 out of 9 sensors.
-    # used by webinterface in server.py at RequestHandler.do_GET
+    # used by webinterface in server.py at RequestHandler.do_POST
     @staticmethod
     def calibrate(calibration_time=2):
+        if Dish.calibration_job and Dish.calibration_job.active:
+            logger.warning("Calibration already running")
+            return Dish.calibration_job
+        Dish._check_motors_free()
+
+        holds = len(Dish.accelerometer_waypoints) + 1
+        steps = holds + len(Dish.accelerometer_waypoints) + 1
+        Dish.calibration_job = Job(
+            "calibration",
+            lambda job: Dish._calibration_sequence(job, calibration_time),
+            total_steps=steps,
+            on_cancel=Dish.abort_moves)
+        return Dish.calibration_job.start()
+
+    # The calibration, the peak search and the auto-tune all move the motors, only one of them can run at a time.
+    # Raises when one of them is running, the web interface answers 409 then
+    @staticmethod
+    def _check_motors_free():
+        for job in (Dish.calibration_job, Dish.peak_job, Dish.autotune_job):
+            if job and job.active:
+                raise RuntimeError(f"The {job.name} is moving the motors, wait for it to finish or cancel it")
+
+    # Relative (azimuth, elevation) moves in degrees used by the calibration.
+    # The accelerometer needs the dish to be still at 6 different positions. It holds before each move and at the end:
+    # (0, 0), (45, 0), (45, 45), (-45, 45), (-45, -45), (0, -45) and (0, 0) again, as the moves end up where they started.
+    # These are the single axis moves of the original sequence, only the magnetometer path moves both axes together
+    accelerometer_waypoints = [(45, 0), (0, 45), (-90, 0), (0, -90), (45, 0), (0, 45)]
+    # The magnetometer needs a smooth figure-8 movement
+    magnetometer_waypoints = [(20, 20), (20, -20), (-20, -20), (-20, 20),
+                              (-20, 20), (-20, -20), (20, -20), (20, 20)]
+
+    # The calibration sequence itself, runs inside the calibration job
+    @staticmethod
+    def _calibration_sequence(job: Job, calibration_time):
         logger.debug("Calibrating...")
+        if Dish.pid_active:  # the motors can not be moved by hand while the pid is running
+            Dish.toggle_pid()
 
-        # Keep still at 6 different positions
+        # Keep still at 6 different positions (the last hold is back at the first one)
         logger.debug("Calibrating Accelerometer")
-        time.sleep(calibration_time)
-        Dish.azimuth_motor.move_angle(degrees=45)
-        time.sleep(calibration_time)
-        Dish.elevation_motor.move_angle(degrees=45)
-        time.sleep(calibration_time)
-        Dish.azimuth_motor.move_angle(degrees=-90)
-        time.sleep(calibration_time)
-        Dish.elevation_motor.move_angle(degrees=-90)
-        time.sleep(calibration_time)
-        Dish.azimuth_motor.move_angle(degrees=45)
-        time.sleep(calibration_time)
-        Dish.elevation_motor.move_angle(degrees=45)
-        time.sleep(calibration_time)
+        job.step("Accelerometer: hold position 1")
+        job.sleep(calibration_time)
+        for i, (azimuth, elevation) in enumerate(Dish.accelerometer_waypoints):
+            job.step(f"Accelerometer: move to position {i + 2}")
+            Dish.move_path([(azimuth, elevation)], job)
+            job.step(f"Accelerometer: hold position {i + 2}")
+            job.sleep(calibration_time)
         logger.debug("Accelerometer Calibrated!")
 
         # Smooth movement
         logger.debug("Calibrating Magnetometer")
-        Dish.elevation_motor.move_angle_sync(degrees=20)
-        Dish.azimuth_motor.move_angle(degrees=20)
-        Dish.elevation_motor.move_angle_sync(degrees=-20)
-        Dish.azimuth_motor.move_angle(degrees=20)
-        Dish.elevation_motor.move_angle_sync(degrees=-20)
-        Dish.azimuth_motor.move_angle(degrees=-20)
-        Dish.elevation_motor.move_angle_sync(degrees=20)
-        Dish.azimuth_motor.move_angle(degrees=-20)
-
-        Dish.elevation_motor.move_angle_sync(degrees=20)
-        Dish.azimuth_motor.move_angle(degrees=-20)
-        Dish.elevation_motor.move_angle_sync(degrees=-20)
-        Dish.azimuth_motor.move_angle(degrees=-20)
-        Dish.elevation_motor.move_angle_sync(degrees=-20)
-        Dish.azimuth_motor.move_angle(degrees=20)
-        Dish.elevation_motor.move_angle_sync(degrees=20)
-        Dish.azimuth_motor.move_angle(degrees=20)
+        job.step("Magnetometer: figure-8")
+        Dish.move_path(Dish.magnetometer_waypoints, job)
+        logger.debug("Magnetometer Calibrated!")
 
-        logger.debug("Accelerometer Calibrated!")
         # print calibration results to the console
-        logger.info(f"Calibration Complete: {Dish.sensor.calibration_status}")
+        logger.info(
+            f"Calibration Complete: {Dish.sampler.latest.calibration_status}")
+
+    # Move both motors along a list of (azimuth, elevation) waypoints, relative moves in degrees.
+    # The motion planner (see motion.py) gives every move a velocity profile limited by move_velocity and
+    # Stepper.max_acceleration, and stretches the profiles so both motors finish each move at the same time.
+    # Waits until the path is done. When a job is given, the path stops when the job is cancelled
+    @staticmethod
+    def move_path(waypoints, job: Job = None):
+        if Dish.pid_active:
+            logger.warning("Trying to move while pid is active, ignoring move command")
+            return
+        motors = [Dish.azimuth_motor, Dish.elevation_motor]
+        steps = [tuple(angle / 360 * motor.steps_per_rev for angle, motor in zip(waypoint, motors))
+                 for waypoint in waypoints]
+        limits = [(Dish.move_velocity, motor.max_acceleration)
+                  for motor in motors]
+        plan = motion.plan_moves(steps, limits, Dish.move_shape)
+        motion.execute(plan, motors, Backend.clock,
+                       abort=job.cancel_event if job else None)
+        if job:
+            job.check()
+
+    # Cancel the calibration if it is running
+    # used by webinterface in server.py at RequestHandler.do_POST
+    @staticmethod
+    def cancel_calibration():
+        if Dish.calibration_job:
+            Dish.calibration_job.cancel()
+
+    # Stop all the movements of both motors (not the pid controller)
+    @staticmethod
+    def abort_moves():
+        Dish.azimuth_motor.abort_moves()
+        Dish.elevation_motor.abort_moves()
 
     # Toggles the pid controller on both stepper motors, keeping them synced
     # used by webinterface in server.py at RequestHandler.do_GET
@@ -166,11 +324,127 @@ class Dish:
     @staticmethod
     def set_target(azimuth, elevation):
         logger.info(f"Setting target: {azimuth}, {elevation}")
+        azimuth, elevation = Dish._apply_offset(azimuth, elevation)
 
         Dish.azimuth_motor.set_target(degrees=azimuth)
         Dish.elevation_motor.set_target(degrees=elevation)
 
-    # Set pid values of one of the motors
+    # Set a moving target for the pid controllers: the position in degrees now and the speed in degrees per second
+    # used by the Tracker in tracker.py, which follows satellites
+    @staticmethod
+    def set_trajectory(azimuth, elevation, azimuth_rate, elevation_rate):
+        logger.debug("Setting trajectory: %s, %s at %s, %s deg/s",
+                     azimuth, elevation, azimuth_rate, elevation_rate)
+
+        azimuth, elevation = Dish._apply_offset(azimuth, elevation)
+        Dish.azimuth_motor.set_trajectory(azimuth, azimuth_rate)
+        Dish.elevation_motor.set_trajectory(elevation, elevation_rate)
+
+    # The target with the offset added
+    # Cross-elevation is an angle on the sky, close to the zenith the azimuth has to turn further for it
+    @staticmethod
+    def _apply_offset(azimuth, elevation):
+        cross_elevation, elevation_offset = Dish.offset
+        return azimuth + Dish._azimuth_offset(cross_elevation, elevation), elevation + elevation_offset
+
+    @staticmethod
+    def _azimuth_offset(cross_elevation, elevation):
+        return cross_elevation / max(math.cos(math.radians(elevation)), 0.1)
+
+    # Change the offset, the targets of the pid controllers move along right away
+    @staticmethod
+    def set_offset(cross_elevation, elevation):
+        old_cross_elevation, old_elevation = Dish.offset
+        Dish.offset = (cross_elevation, elevation)
+        goal_elevation = Dish.elevation_motor.goal_degrees
+        Dish.azimuth_motor.offset_target(Dish._azimuth_offset(cross_elevation - old_cross_elevation, goal_elevation))
+        Dish.elevation_motor.offset_target(elevation - old_elevation)
+
+    # Refine the pointing by searching for the strongest signal around the target, see peak.py
+    # The search runs as a background job, like the calibration. The offset it finds stays in use for all targets
+    # used by webinterface in server.py at RequestHandler.do_POST
+    @staticmethod
+    def peak_search():
+        if Dish.peak_job and Dish.peak_job.active:
+            logger.warning("Peak search already running")
+            return Dish.peak_job
+        Dish._check_motors_free()
+        if not Dish.sdr:
+            raise RuntimeError("No signal strength measurement (SDR disabled)")
+        if not Dish.pid_active:
+            raise RuntimeError("The pid controller must be running to search for the peak")
+
+        Dish.peak_job = Job("peak search", Dish._peak_search,
+                            total_steps=Config.getPeakIterations() + 1)
+        return Dish.peak_job.start()
+
+    # The peak search itself, runs inside the peak search job
+    @staticmethod
+    def _peak_search(job: Job):
+        dwell = Config.getPeakDwell()
+
+        def move(cross_elevation, elevation):
+            Dish.set_offset(cross_elevation, elevation)
+            Dish._settle(job)
+
+        def measure():
+            return Dish._measure_power(job, dwell)
+
+        search = PeakSearch(measure, move,
+                            beamwidth=Config.getPeakBeamwidth(),
+                            iterations=Config.getPeakIterations(),
+                            tolerance=Config.getPeakTolerance(),
+                            search_radius=Config.getPeakSearchRadius())
+        start = Dish.offset
+        try:
+            search.run(start, job.step)
+        except JobCancelled:
+            Dish.set_offset(*start)  # go back to where the search started
+            raise
+
+    # Wait until both motors are at their target (according to the sensor), or timeout seconds have passed
+    @staticmethod
+    def _settle(job: Job, tolerance=0.05, timeout=5):
+        start = Backend.clock.monotonic()
+        while Backend.clock.monotonic() - start < timeout:
+            if all(abs(motor.distance) / motor.steps_per_rev * 360 < tolerance
+                   for motor in (Dish.azimuth_motor, Dish.elevation_motor)):
+                return
+            job.sleep(0.02)
+
+    # Average signal power (dB) of the SDR readings that arrive within dwell seconds, at least one reading
+    # Fails when no reading arrives within timeout dwells, the SDR stopped then
+    @staticmethod
+    def _measure_power(job: Job, dwell, timeout=5):
+        start = Dish.sdr.latest.timestamp
+        now = Backend.clock.monotonic()
+        deadline = now + dwell
+        give_up = now + timeout * dwell
+        last = None
+        powers = []
+        while not powers or Backend.clock.monotonic() < deadline:
+            if not powers and Backend.clock.monotonic() > give_up:
+                raise RuntimeError(f"No signal strength readings from the SDR for {timeout * dwell:g} seconds")
+            reading = Dish.sdr.latest
+            if reading is not last and reading.timestamp > start and reading.power is not None:
+                powers.append(10 ** (reading.power / 10))  # average the power, not the dB
+                last = reading
+            job.sleep(0.01)
+        return 10 * math.log10(sum(powers) / len(powers))
+
+    # Cancel the peak search if it is running
+    @staticmethod
+    def cancel_peak_search():
+        if Dish.peak_job:
+            Dish.peak_job.cancel()
+
+    # Stop moving targets where they are now, the pid controllers keep the dish there
+    @staticmethod
+    def hold():
+        Dish.azimuth_motor.hold()
+        Dish.elevation_motor.hold()
+
+    # Set pid values of one of the motors, and save them in the config
     # used by webinterface in server.py at RequestHandler.do_POST
     @staticmethod
     def tune_pid(p, i, d, elevation=False):
@@ -178,6 +452,85 @@ class Dish:
             Dish.elevation_motor.tune(p, i, d)
         else:
             Dish.azimuth_motor.tune(p, i, d)
+        Config.setPidTunings("elevation" if elevation else "azimuth", p, i, d)
+
+    # Find pid tunings for one axis ("azimuth" or "elevation"), or both when axis is None, see autotune.py.
+    # The tuning runs as a background job, like the calibration. The report of every axis ends up in the result of
+    # the job. The tunings are only kept (and saved in the tracking profile) when save is true, so they can be
+    # tried first. The motors are moved without the pid controller, so it has to be stopped first
+    # used by webinterface in server.py at RequestHandler.do_POST
+    @staticmethod
+    def autotune(axis=None, settling_time=None, save=False):
+        if Dish.autotune_job and Dish.autotune_job.active:
+            logger.warning("Auto-tune already running")
+            return Dish.autotune_job
+        Dish._check_motors_free()
+        axes = [axis] if axis else ["azimuth", "elevation"]
+        if any(name not in ("azimuth", "elevation") for name in axes):
+            raise ValueError(f"Unknown axis {axis}")
+        if Dish.pid_active:
+            raise RuntimeError("The pid controller must be stopped to auto-tune")
+
+        settling_time = settling_time or Config.getAutoTuneSettlingTime()
+        Dish.autotune_job = Job("auto-tune", lambda job: Dish._autotune(job, axes, settling_time, save),
+                                total_steps=2 * len(axes))
+        return Dish.autotune_job.start()
+
+    # The auto-tune itself, runs inside the auto-tune job
+    @staticmethod
+    def _autotune(job: Job, axes, settling_time, save):
+        job.result = {}
+        # the simulated sensor reports old angles, the real one has no latency worth mentioning
+        latency = Config.getSimLatency() if Backend.name == "sim" else 0
+        for name in axes:
+            motor = Dish.azimuth_motor if name == "azimuth" else Dish.elevation_motor
+            tuner = AutoTune(motor, job.sleep, Backend.clock.monotonic,
+                             settling_time=settling_time,
+                             damping=Config.getAutoTuneDamping(),
+                             test_speed=Config.getAutoTuneTestSpeed(),
+                             test_time=Config.getAutoTuneTestTime(),
+                             sensor_delay=1 / Dish.sampler.rate + latency)
+            old = motor.pid.tunings
+            try:
+                report = tuner.run(lambda description: job.step(f"{name}: {description}"))
+            except AutoTuneFailed as e:
+                job.result[name] = e.report  # show what the last step did, the job fails with the reason
+                raise
+            finally:
+                motor.tune(*old)  # the tunings of the profile, until the new ones are saved in it
+            job.result[name] = report
+            if save:
+                Dish.tune_pid(*report["tunings"], elevation=name == "elevation")
+
+    # Cancel the auto-tune if it is running
+    @staticmethod
+    def cancel_autotune():
+        if Dish.autotune_job:
+            Dish.autotune_job.cancel()
+
+    # Switch to another tracking profile (see Config.getProfile), the pid keeps running
+    # used by webinterface in server.py at RequestHandler.do_POST
+    # Raises KeyError when the profile does not exist
+    @staticmethod
+    def set_profile(name):
+        Config.setProfile(name)  # the change is applied by _config_changed
+
+    # Give the motors and the sensor the settings of the tracking profile in the config.
+    # Each motor gets all of its settings at once, see Stepper.configure
+    @staticmethod
+    def apply_config():
+        profile = Config.getProfile()
+        logger.info(f"Using profile {profile.name}: pid at {profile.rate} Hz, sensor at {profile.sensor_rate} Hz")
+        Dish.azimuth_motor.configure(profile.azimuth, profile.rate, profile.max_velocity, profile.max_acceleration)
+        Dish.elevation_motor.configure(profile.elevation, profile.rate, profile.max_velocity, profile.max_acceleration)
+        Dish.sampler.set_rate(profile.sensor_rate)
+
+    # Called by the config when values have changed (see Config.subscribe)
+    @staticmethod
+    def _config_changed(changed):
+        profile = PROFILE + Config.getProfileName()
+        if any(section == "PID" or section == profile for section, name in changed):
+            Dish.apply_config()
 
     # Move to zero point (not implemented)
     # used by webinterface in server.py at RequestHandler.do_GET
@@ -190,6 +543,26 @@ class Dish:
     def positionListener(currentPos, targetPos, dir):
         logger.info(currentPos)
 
+    # Collect the state of the whole dish in a dictionary
+    # used by the telemetry stream in telemetry.py
+    @staticmethod
+    def telemetry():
+        sample = Dish.sampler.latest
+        return {
+            "time": sample.timestamp,
+            "azimuth": Dish.azimuth_motor.state(),
+            "elevation": Dish.elevation_motor.state(),
+            "pid_active": Dish.pid_active,
+            "calibration": sample.calibration_status,
+            "calibration_job": Dish.calibration_job.state() if Dish.calibration_job else None,
+            "signal": Dish.signal()._asdict() if Dish.sdr else None,
+            "offset": Dish.offset,
+            "peak_job": Dish.peak_job.state() if Dish.peak_job else None,
+            "autotune_job": Dish.autotune_job.state() if Dish.autotune_job else None,
+            "control_core": Dish.core.stats() if Dish.core else None,
+            "profile": Config.getProfileName(),
+        }
+
     # Stop both the motors, run when the progam exits or crashes
     @staticmethod
     def stop():
@@ -200,15 +573,25 @@ class Dish:
             Dish.elevation_motor.disable()
         except Exception as e:
             logger.error(str(e))
+        if Dish.core:
+            Dish.core.stop()
+            Dish.core = None
+        if Dish.sdr:
+            Dish.sdr.stop()
+        if Dish.recorder:  # write the last records to the disk
+            Dish._recorder_loop.stop()
+            Dish.recorder.close()
+            Dish.recorder = None
 
     # Print "useful" data to the terminal and log file
     @staticmethod
     def log():
+        sample = Dish.sampler.latest
         logger.debug(
             f"\nAzimuth:\n{Dish.azimuth_motor}"
             f"Elevation:\n{Dish.elevation_motor}"
-            f"Sensor pos: {Dish.sensor.euler}\n"
-            f"Sensor calib: {Dish.sensor.calibration_status}"
+            f"Sensor pos: {sample.euler}\n"
+            f"Sensor calib: {sample.calibration_status}"
         )
 
         # Call the same log again after one second
@@ -0,0 +1,155 @@
+import collections
+import logging
+import math
+
+import numpy as np
+from sgp4.api import Satrec, SatrecArray
+
+logger = logging.getLogger(__name__)
+
+# Calculates where satellites are in the sky, as seen from the ground station.
+# The orbits come from TLE sets (two-line elements, the standard format published by e.g. celestrak.org),
+# which are propagated to any point in time with SGP4 (the model the TLE sets are made for).
+# All satellites and all points in time are calculated at once with NumPy arrays, so predicting
+# passes for a whole catalogue is fast.
+#
+# The steps from orbit to pointing direction:
+# 1. SGP4 gives the satellite position in the TEME frame (an inertial frame centered on the earth)
+# 2. Rotating with the earth (GMST angle) gives the position in ECEF (fixed to the earth)
+# 3. Subtracting the ground station position and rotating to the local east, north, up directions
+#    gives the azimuth and elevation the dish should point at
+
+# WGS84 ellipsoid
+EARTH_RADIUS = 6378.137  # km
+EARTH_FLATTENING = 1 / 298.257223563
+
+# Location of the ground station, latitude and longitude in degrees, altitude in meters
+Station = collections.namedtuple("Station", ["latitude", "longitude", "altitude"])
+
+# One satellite from a TLE file
+Satellite = collections.namedtuple("Satellite", ["name", "norad", "line1", "line2", "satrec"])
+
+
+# Read a TLE file. Supports both the two-line format and the three-line format with a name line
+def load_tle(path):
+    satellites = []
+    with open(path) as file:
+        lines = [line.rstrip() for line in file if line.strip()]
+    name = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("1 ") and i + 1 < len(lines) and lines[i + 1].startswith("2 "):
+            satrec = Satrec.twoline2rv(line, lines[i + 1])
+            norad = satrec.satnum
+            satellites.append(Satellite(name or str(norad), norad, line, lines[i + 1], satrec))
+            name = None
+            i += 2
+        else:
+            name = line[2:].strip() if line.startswith("0 ") else line.strip()
+            i += 1
+    logger.info(f"Loaded {len(satellites)} satellites from {path}")
+    return satellites
+
+
+# Convert unix times (seconds) to julian dates, split in a whole and fractional part like sgp4 wants them
+def julian_dates(times):
+    times = np.atleast_1d(np.asarray(times, dtype=float))
+    days = np.floor(times / 86400)
+    return days + 2440587.5, (times - days * 86400) / 86400
+
+
+# Greenwich mean sidereal time in radians (IAU-82 model), for julian dates split in jd and fr
+def gmst(jd, fr):
+    tut1 = ((jd - 2451545.0) + fr) / 36525.0
+    seconds = -6.2e-6 * tut1 ** 3 + 0.093104 * tut1 ** 2 + \
+        (876600.0 * 3600 + 8640184.812866) * tut1 + 67310.54841
+    return np.mod(np.radians(seconds / 240.0), 2 * math.pi)
+
+
+# Position of the station in ECEF coordinates (km)
+def station_ecef(station: Station):
+    latitude = math.radians(station.latitude)
+    longitude = math.radians(station.longitude)
+    altitude = station.altitude / 1000
+    e2 = EARTH_FLATTENING * (2 - EARTH_FLATTENING)
+    n = EARTH_RADIUS / math.sqrt(1 - e2 * math.sin(latitude) ** 2)
+    return np.array([
+        (n + altitude) * math.cos(latitude) * math.cos(longitude),
+        (n + altitude) * math.cos(latitude) * math.sin(longitude),
+        (n * (1 - e2) + altitude) * math.sin(latitude),
+    ])
+
+
+# Rotation from ECEF to the local east, north, up directions of the station
+def enu_rotation(station: Station):
+    latitude = math.radians(station.latitude)
+    longitude = math.radians(station.longitude)
+    sin_lat, cos_lat = math.sin(latitude), math.cos(latitude)
+    sin_lon, cos_lon = math.sin(longitude), math.cos(longitude)
+    return np.array([
+        [-sin_lon, cos_lon, 0],
+        [-sin_lat * cos_lon, -sin_lat * sin_lon, cos_lat],
+        [cos_lat * cos_lon, cos_lat * sin_lon, sin_lat],
+    ])
+
+
+# A set of satellites that can be propagated together
+class Ephemeris():
+    def __init__(self, satellites, station: Station):
+        self.satellites = list(satellites)
+        self.station = station
+        self._index = {satellite.norad: i for i, satellite in enumerate(self.satellites)}
+        self._array = SatrecArray([satellite.satrec for satellite in self.satellites]) \
+            if self.satellites else None
+        self._station = station_ecef(station)
+        self._rotation = enu_rotation(station)
+
+    # Load the satellites from a TLE file
+    @staticmethod
+    def from_file(path, station: Station):
+        return Ephemeris(load_tle(path), station)
+
+    def index(self, norad):
+        return self._index[norad]
+
+    # Azimuth, elevation (degrees) and range (km) of all satellites at the given unix times.
+    # Returns three arrays of shape (satellites, times). Satellites that can not be propagated get NaN
+    def look_angles(self, times):
+        jd, fr = julian_dates(times)
+        if self._array is None:
+            empty = np.empty((0, len(jd)))
+            return empty, empty, empty
+        errors, positions, _ = self._array.sgp4(jd, fr)  # TEME positions (satellites, times, 3) in km
+        positions[errors != 0] = np.nan
+
+        # rotate with the earth: TEME -> ECEF
+        theta = gmst(jd, fr)
+        cos_t, sin_t = np.cos(theta), np.sin(theta)
+        x = cos_t * positions[..., 0] + sin_t * positions[..., 1]
+        y = -sin_t * positions[..., 0] + cos_t * positions[..., 1]
+        ecef = np.stack([x, y, positions[..., 2]], axis=-1)
+
+        # relative to the station, in east, north, up directions
+        enu = (ecef - self._station) @ self._rotation.T
+        distance = np.linalg.norm(enu, axis=-1)
+        azimuth = np.mod(np.degrees(np.arctan2(enu[..., 0], enu[..., 1])), 360)
+        elevation = np.degrees(np.arcsin(enu[..., 2] / distance))
+        return azimuth, elevation, distance
+
+    # Azimuth and elevation (degrees) of one satellite at one unix time
+    def look_angle(self, norad, time):
+        satrec = self.satellites[self.index(norad)].satrec
+        jd, fr = julian_dates(time)
+        error, position, _ = satrec.sgp4(jd[0], fr[0])
+        if error != 0:
+            raise ValueError(f"Satellite {norad} could not be propagated (sgp4 error {error})")
+        theta = gmst(jd[0], fr[0])
+        ecef = np.array([
+            math.cos(theta) * position[0] + math.sin(theta) * position[1],
+            -math.sin(theta) * position[0] + math.cos(theta) * position[1],
+            position[2],
+        ])
+        east, north, up = self._rotation @ (ecef - self._station)
+        distance = math.sqrt(east ** 2 + north ** 2 + up ** 2)
+        return math.degrees(math.atan2(east, north)) % 360, math.degrees(math.asin(up / distance))
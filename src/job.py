@@ -0,0 +1,116 @@
+import logging
+import threading
+import uuid
+
+from backend import Backend
+
+logger = logging.getLogger(__name__)
+
+# Raised inside a job when it has been cancelled, stops the job at the next step or sleep
+class JobCancelled(Exception):
+    pass
+
+# A job is a long task (like the calibration sequence) that runs in its own thread,
+# so the web interface and the rest of the program keep working while it runs.
+# Every job has an id, can be cancelled, and keeps track of its progress step by step.
+# The task is a function that takes the job as its only argument.
+# It should call job.step to report progress and use job.sleep to wait, both stop the task when the job is cancelled.
+
+
+class Job():
+    def __init__(self, name, task, total_steps, on_cancel=None, clock=None):
+        self.id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.task = task
+        self.total_steps = total_steps  # used to calculate the progress
+        self.on_cancel = on_cancel  # called once when the job is cancelled, for example to stop the motors
+        self.clock = clock or Backend.clock
+
+        self.status = "pending"  # pending, running, done, cancelled or failed
+        self.current_step = 0
+        self.description = ""  # what the job is doing right now
+        self.error = ""
+        self.result = None  # what the task found, set by the task itself (like the report of Dish.autotune)
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"job-{name}")
+        self._thread.daemon = True  # Makes sure the job stops when the process crashes
+
+    @property
+    def progress(self):
+        if self.total_steps == 0:
+            return 1
+        return min(1, self.current_step / self.total_steps)
+
+    # Event that is set when the job is cancelled, can be used to stop waiting for something else
+    @property
+    def cancel_event(self):
+        return self._cancel
+
+    @property
+    def active(self):
+        return self.status in ("pending", "running")
+
+    def start(self):
+        logger.info(f"Starting job {self.name} ({self.id})")
+        self.status = "running"
+        self._thread.start()
+        return self
+
+    # Ask the job to stop. The task stops at its next step or sleep
+    def cancel(self):
+        if not self.active or self._cancel.is_set():
+            return
+        logger.info(f"Cancelling job {self.name} ({self.id})")
+        self._cancel.set()
+        if self.on_cancel:
+            self.on_cancel()
+
+    # Wait for the job to finish, returns true if it finished within the timeout
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    # Report that the task has started the next step
+    def step(self, description):
+        self.check()
+        self.current_step += 1
+        self.description = description
+        logger.debug(f"{self.name} step {self.current_step}/{self.total_steps}: {description}")
+
+    # Wait for a number of seconds, stops the task when the job is cancelled while waiting
+    def sleep(self, seconds):
+        if self.clock.wait(self._cancel, seconds):
+            raise JobCancelled()
+
+    # Stop the task if the job has been cancelled
+    def check(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    # The state of the job as a dictionary, used by the web interface
+    def state(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "step": self.current_step,
+            "total_steps": self.total_steps,
+            "progress": self.progress,
+            "description": self.description,
+            "error": self.error,
+            "result": self.result,
+        }
+
+    # This is what the thread is doing
+    def _run(self):
+        try:
+            self.task(self)
+            self.status = "done"
+            logger.info(f"Job {self.name} ({self.id}) done")
+        except JobCancelled:
+            self.status = "cancelled"
+            logger.info(f"Job {self.name} ({self.id}) cancelled")
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            logger.error(f"Job {self.name} ({self.id}) failed: {e}")
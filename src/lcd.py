@@ -1,6 +1,7 @@
-import os
+import threading
 import time
 from lib.grove import JHD1802
+from network import Network
 import logging
 
 
@@ -8,11 +9,21 @@ logger = logging.getLogger(__name__)
 
 # This class provides easy interaction between the program and the lcd api
 # Main function of the lcd is to display the ip address where the web interface is accessible
+# The class keeps a copy of what is on the screen (the framebuffer).
+# When something new is written, only the characters that are different from the framebuffer are sent to the screen.
+# This keeps the I2C bus free for the position sensor, and the screen does not flicker because it is never cleared.
 
 
 class LCD():
 
     lcd: JHD1802
+    rows = 2
+    columns = 16
+    # What is on the screen right now, one string per row
+    _screen = [" " * columns] * rows
+    # Unchanged characters between two changes that are sent anyway, cheaper than moving the cursor
+    _max_gap = 2
+    _lock = threading.Lock()
 
     # start the lcd screen, run on startup
     def start():
@@ -25,18 +36,19 @@ class LCD():
             time.sleep(1)
 
             LCD.lcd.backlight(True)  # Turn on
-            LCD.lcd.setCursor(0, 0)  # Reset
+            LCD.lcd.clear()  # Reset, the framebuffer now matches the empty screen
+            LCD._screen = [" " * LCD.columns] * LCD.rows
             LCD.write("Started At:")  # write the current ip, plus text
+            Network.subscribe(LCD.writeIP)  # update the ip when it changes
         except Exception as e:  # this runs when the lcd is not connected or crashes
             logger.warning("Failed to Start LCD (not connected?): " + str(e))
 
-    def writeIP():
-        ip = str(os.popen('hostname -I').read())  # Retrieve current ip address
+    def writeIP(ip=None):
+        ip = ip or Network.ip()  # cached current ip address, see network.py
         logger.debug(ip)  # print it to the console
 
         # Write the ip on the second line
-        LCD.lcd.setCursor(1, 0)
-        LCD.lcd.write(str(ip))
+        LCD.show(1, ip)
 
     @staticmethod
     def write(msg):
@@ -44,9 +56,34 @@ class LCD():
         if not hasattr(LCD, "lcd"):
             logger.warning("Failed to write to LCD: LCD not started.")
             return
-        # Clear the screen and write the text on the first line
-        LCD.lcd.clear()
-        LCD.lcd.setCursor(0, 0)
-        LCD.lcd.write(str(msg))
+        # write the text on the first line
+        LCD.show(0, str(msg))
         # write the ip on the second line
         LCD.writeIP()
+
+    # Show text on one row of the screen. Only the characters that changed are sent
+    @staticmethod
+    def show(row, text):
+        if not hasattr(LCD, "lcd"):
+            return
+        # pad or cut the text to exactly one row, a new line ends the text
+        new = text.split("\n")[0].ljust(LCD.columns)[:LCD.columns]
+        with LCD._lock:
+            old = LCD._screen[row]
+            for start, end in LCD._changes(old, new):
+                LCD.lcd.writeAt(row, start, new[start:end])
+            LCD._screen[row] = new
+
+    # The (start, end) ranges of characters that differ between old and new.
+    # Changes that are only a few characters apart are merged into one range
+    @staticmethod
+    def _changes(old, new):
+        changes = []
+        for i in range(len(new)):
+            if old[i] == new[i]:
+                continue
+            if changes and i - changes[-1][1] <= LCD._max_gap:
+                changes[-1][1] = i + 1
+            else:
+                changes.append([i, i + 1])
+        return changes
@@ -247,8 +247,36 @@ class JHD1802(Display):
         Returns:
             None
         '''
-        for c in msg:
-            self._bus.write_byte_data(self._addr, 0x40, ord(c))
+        data = [self._charCode(c) for c in msg]
+        if not data:
+            return
+        # Control byte 0x40 (Co=0, RS=1): every following byte is display data,
+        # so the whole message goes out in a single I2C transaction
+        self._bus.i2c_rdwr(i2c_msg.write(self._addr, [0x40] + data))
+
+    def writeAt(self, row, column, msg):
+        '''
+        Position the cursor and write character(s) in a single I2C transaction.
+
+        Args:
+            row   (int): the row at which to start writing, with 0 being the first row
+            column(int): the column at which to start writing, with 0 being the first column
+            msg (string): the character(s) to write to the display
+
+        Returns:
+            None
+        '''
+        data = [self._charCode(c) for c in msg]
+        cursor = (0x40 * row) + (column % 0x10) + 0x80
+        # Control byte 0x80 (Co=1, RS=0): one command byte follows, then another control byte.
+        # Control byte 0x40 (Co=0, RS=1): the rest of the message is display data.
+        self._bus.i2c_rdwr(i2c_msg.write(
+            self._addr, [0x80, cursor, 0x40] + data))
+
+    def _charCode(self, c):
+        # The character ROM only has 8 bit codes
+        code = ord(c)
+        return code if code < 0x100 else ord('?')
 
     def _cursor_on(self, enable):
         if enable:
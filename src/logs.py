@@ -0,0 +1,89 @@
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# This class sets up the logs of the program, both in the console and in logs/latest.log.
+# The parts of the program that log a lot (like the pid controller, which runs a thousand times per second)
+# should never have to wait for the SD card. So log messages are put in a queue,
+# and a separate thread (the QueueListener) takes them out of the queue and writes them to the console and the file.
+# The file is rotated when it gets too big, so it can not fill up the SD card.
+# Debug messages are rate limited per line of code: each line can log at most one debug message per debug_interval.
+# As there is only one logging setup, all methods are static.
+
+
+# Drops records of a line of code that has already logged within the interval.
+# Only records at or below level are limited, warnings and errors are always logged
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval=1.0, level=logging.DEBUG, clock=time.monotonic):
+        super().__init__()
+        self.interval = interval
+        self.level = level
+        self.clock = clock
+        self._last = {}  # (file, line) -> time of the last record that was let through
+        self._suppressed = {}  # (file, line) -> amount of records dropped since then
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.level or self.interval <= 0:
+            return True
+        site = (record.pathname, record.lineno)
+        now = self.clock()
+        with self._lock:
+            last = self._last.get(site)
+            if last is not None and now - last < self.interval:
+                self._suppressed[site] = self._suppressed.get(site, 0) + 1
+                return False
+            self._last[site] = now
+            suppressed = self._suppressed.pop(site, 0)
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+class Logs():
+    path = "logs/latest.log"
+    level = logging.DEBUG
+    max_bytes = 5 * 1024 * 1024  # size of the log file before it is rotated
+    backup_count = 3  # amount of old log files that are kept (latest.log.1, latest.log.2, ...)
+    debug_interval = 1.0  # seconds between two debug messages of the same line of code
+    format = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+    listener: logging.handlers.QueueListener = None
+    rate_limit: RateLimitFilter
+
+    # Configure logging, run at the start of the program
+    @staticmethod
+    def start():
+        os.makedirs(os.path.dirname(Logs.path), exist_ok=True)
+        formatter = logging.Formatter(Logs.format)
+
+        file_handler = logging.handlers.RotatingFileHandler(
+            Logs.path, maxBytes=Logs.max_bytes, backupCount=Logs.backup_count, encoding="utf-8")
+        console_handler = logging.StreamHandler(sys.stdout)
+        for handler in (file_handler, console_handler):
+            handler.setFormatter(formatter)
+
+        # the program only puts messages in the queue, the listener writes them in its own thread
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        Logs.rate_limit = RateLimitFilter(Logs.debug_interval)
+        queue_handler.addFilter(Logs.rate_limit)
+
+        root = logging.getLogger()
+        root.handlers = [queue_handler]
+        root.setLevel(Logs.level)
+
+        Logs.listener = logging.handlers.QueueListener(
+            log_queue, file_handler, console_handler, respect_handler_level=True)
+        Logs.listener.start()
+
+    # Write all the messages still in the queue and stop the listener, run when the program exits
+    @staticmethod
+    def stop():
+        if Logs.listener:
+            Logs.listener.stop()
+            Logs.listener = None
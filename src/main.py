@@ -2,26 +2,20 @@
 import logging
 import signal
 import sys
-try:
-    import RPi.GPIO as GPIO
-    print("Detected Raspberry Pi environment.")
-except:
-    import Mock.GPIO as GPIO
-    print("Not a Raspberry Pi. Switching to Mock.")
-    sys.modules['RPi.GPIO'] = GPIO
 
+from backend import Backend
+from catalogue import Catalogue
 from config import Config
 from dish import Dish
 from lcd import LCD
+from logs import Logs
+from network import Network
 from server import Server
+from tracker import Tracker
 
 # This file is where the python program starts.
 
-# Configure logs to log both in the console and to a file
 logger = logging.getLogger(__name__)
-logging.basicConfig(handlers=[logging.FileHandler("logs/latest.log"),
-                              logging.StreamHandler(sys.stdout)],
-                    encoding='utf-8', level=logging.DEBUG)
 
 # this runs when the program exits or crashes
 
@@ -30,13 +24,22 @@ def sigterm_handler(_signo, _stack_frame):
     # Gracefully stop the server when the program exits or crashes
     logger.info("stopping...")
     Server.stop()
+    Tracker.stop()
+    Catalogue.stop()
     Dish.stop()
-    GPIO.cleanup()
+    Network.stop()
+    Config.stop()  # write the config changes that are not saved yet
+    if Backend.GPIO:
+        Backend.GPIO.cleanup()
     LCD.write("Stopped: " + str(_signo))
+    Logs.stop()  # write the last log messages before exiting
     sys.exit(0)
 
 
 if __name__ == "__main__":  # This runs on startup:
+    # Configure logs to log both in the console and to a file (see logs.py)
+    # Only here, the control core process (see control_core.py) imports this file as well and has its own log
+    Logs.start()
 
     # Register our shutdown handler to be called at signal "terminate" (sigterm)
     # This signal is emitted when something in the program has crashed
@@ -46,9 +49,16 @@ if __name__ == "__main__":  # This runs on startup:
     # Start all the parts of the progarm
     logger.info("starting")
     try:
-        Config.start()  # not important (yet)
+        Config.start()  # load the config and watch it for changes
+        # use the real hardware on the raspberry pi, or the simulation everywhere else
+        Backend.load(Config.getBackend(),
+                     sensor_noise=Config.getSimNoise(),
+                     sensor_latency=Config.getSimLatency())
+        Network.start()  # find the ip address and watch for changes
         LCD.start()  # display ip address on lcd screen
         Dish.start()  # the motors and sensor
+        Catalogue.start()  # load the satellites that can be tracked
+        Tracker.start()
         Server.start()  # the web interface (this contains an infinite loop (waiting for user input) so it goes last)
     except Exception as e:  # This runs when something crashed
         logger.error(str(e))
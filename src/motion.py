@@ -0,0 +1,159 @@
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Motion planner for moves without the pid controller (like the calibration sequence).
+# Instead of switching a motor on at a constant speed and sleeping for the time the move should take,
+# every move gets a velocity profile: speed up with a limited acceleration, cruise, and slow down again.
+# This lets the motors move faster without skipping steps.
+# For moves of both axes, the profiles are stretched so that both axes start and finish at the same time.
+# One scheduler (execute) runs the profiles of all axes from a single loop.
+#
+# Two shapes are available for speeding up and slowing down:
+# "trapezoid": constant acceleration, the velocity goes up in a straight line
+# "s-curve": the acceleration itself ramps up and down (a cosine), which is smoother for the mechanics
+
+
+# How much longer a ramp takes than a trapezoid ramp with the same maximum acceleration
+RAMP_FACTOR = {"trapezoid": 1, "s-curve": math.pi / 2}
+
+
+# Velocity profile of a single move of one axis
+class Profile():
+    def __init__(self, distance, max_velocity, max_acceleration, duration=None, shape="trapezoid"):
+        if shape not in RAMP_FACTOR:
+            raise ValueError(f"Unknown profile shape: {shape}")
+        self.distance = distance  # steps, negative for the other direction
+        self.shape = shape
+        k = RAMP_FACTOR[shape]
+        d = abs(distance)
+        a = max_acceleration
+
+        # the quickest possible move
+        if d >= k * max_velocity ** 2 / a:  # reaches max_velocity
+            velocity = max_velocity
+            minimum = d / velocity + k * velocity / a
+        else:  # has to slow down before reaching max_velocity
+            velocity = math.sqrt(a * d / k)
+            minimum = 2 * k * velocity / a if d else 0
+
+        # stretch the move to the given duration by lowering the cruise velocity
+        if duration and duration > minimum:
+            velocity = (a * duration - math.sqrt((a * duration) ** 2 - 4 * k * a * d)) / (2 * k)
+        else:
+            duration = minimum
+
+        self.duration = duration  # seconds
+        self.velocity = velocity  # cruise velocity in steps per second, always positive
+        self.ramp_time = k * velocity / a  # time to speed up (and to slow down)
+        self._direction = 1 if distance >= 0 else -1
+
+    # Amount of steps done after t seconds
+    def position(self, t):
+        t = max(0, min(self.duration, t))
+        ramp = self.ramp_time
+        if ramp <= 0:
+            return self._direction * self.velocity * t
+        ramp_distance = self.velocity * ramp / 2
+
+        if t < ramp:
+            done = self._ramp(t / ramp) * ramp_distance
+        elif t <= self.duration - ramp:
+            done = ramp_distance + self.velocity * (t - ramp)
+        else:
+            done = abs(self.distance) - self._ramp((self.duration - t) / ramp) * ramp_distance
+        return self._direction * done
+
+    # Fraction of the ramp distance covered after fraction x of the ramp time
+    def _ramp(self, x):
+        if self.shape == "s-curve":
+            return x - math.sin(math.pi * x) / math.pi
+        return x * x
+
+
+# A list of moves for a number of axes, executed one after the other.
+# Within every move, all axes start and stop at the same time
+class MotionPlan():
+    def __init__(self):
+        self.segments = []  # (start time, tuple of one Profile per axis)
+        self.duration = 0
+
+    def add(self, profiles):
+        self.segments.append((self.duration, tuple(profiles)))
+        self.duration += max(profile.duration for profile in profiles)
+
+    # Amount of steps done by an axis after t seconds since the start of the plan
+    def position(self, axis, t):
+        done = 0
+        for start, profiles in self.segments:
+            if t < start:
+                break
+            done += profiles[axis].position(t - start)
+        return done
+
+
+# Create a plan from a list of waypoints. Each waypoint is a tuple with a relative move in steps for every axis
+# limits is a list with (max_velocity, max_acceleration) for every axis
+def plan_moves(waypoints, limits, shape="trapezoid"):
+    plan = MotionPlan()
+    for waypoint in waypoints:
+        # the slowest axis sets the duration of this move, the others are stretched to match
+        duration = max(Profile(distance, velocity, acceleration, shape=shape).duration
+                       for distance, (velocity, acceleration) in zip(waypoint, limits))
+        plan.add([Profile(distance, velocity, acceleration, duration, shape)
+                  for distance, (velocity, acceleration) in zip(waypoint, limits)])
+    return plan
+
+
+# Run a plan on a list of Steppers (one per axis of the plan) and wait until it is done
+# Every tick, each motor gets the velocity that brings it exactly to the planned position at the next tick,
+# based on the steps commanded so far. So a late tick is made up for in the next one, as far as the
+# max_velocity and max_acceleration of the motor allow.
+# Returns false when the plan was aborted with the abort event
+def execute(plan, axes, clock, rate=200, abort=None):
+    logger.debug(f"Executing motion plan of {plan.duration:.2f} seconds")
+    period = 1 / rate
+    start = clock.monotonic()
+    commanded = [0.0] * len(axes)  # steps commanded so far per axis
+    velocities = [0.0] * len(axes)  # velocity each motor is running at
+    last = 0
+    changed = 0  # time of the last change of the velocities
+    completed = True
+
+    while True:
+        t = clock.monotonic() - start
+        for i in range(len(axes)):
+            commanded[i] += velocities[i] * (t - last)
+        last = t
+        if t >= plan.duration:
+            break
+
+        next_t = min(t + period, plan.duration)
+        # the last bit of the plan is shorter than a tick, dividing by it would ask for a huge velocity.
+        # The motors keep their velocity until the end instead
+        if t + period <= plan.duration:
+            # the velocity may change by max_acceleration over the time since the last change (one tick at the start)
+            change = max(t - changed, period)
+            changed = t
+            for i, axis in enumerate(axes):
+                velocity = (plan.position(i, next_t) - commanded[i]) / (next_t - t)
+                # a late tick can not be made up for faster than the motor can go
+                velocity = max(velocities[i] - axis.max_acceleration * change,
+                               min(velocities[i] + axis.max_acceleration * change, velocity))
+                velocity = max(-axis.max_velocity, min(axis.max_velocity, velocity))
+                # remember the velocity the motor really runs at, it can differ a bit from the one asked for
+                velocities[i] = axis._set_speed(velocity)
+
+        # wait for the next tick
+        delay = start + next_t - clock.monotonic()
+        if abort is not None:
+            if clock.wait(abort, max(0, delay)):
+                completed = False
+                break
+        elif delay > 0:
+            clock.sleep(delay)
+
+    for axis in axes:
+        axis._set_speed(0)
+    return completed
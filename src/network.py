@@ -0,0 +1,101 @@
+import fcntl
+import logging
+import socket
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+# This class knows the ip addresses of the raspberry pi, shown on the lcd and in the server log.
+# The addresses are read directly from the network interfaces (no "hostname -I" subprocess) and cached.
+# A watcher thread listens to the kernel (netlink) for address changes, for example when the hotspot or
+# ethernet cable comes up, and only then reads the addresses again. Where netlink is not available,
+# the watcher checks the addresses every poll_interval seconds instead.
+# As there is only one network, all methods are static.
+
+SIOCGIFADDR = 0x8915  # ioctl request to get the address of an interface
+RTMGRP_LINK = 0x1  # netlink group for interfaces going up or down
+RTMGRP_IPV4_IFADDR = 0x10  # netlink group for ipv4 address changes
+
+
+class Network():
+    poll_interval = 10  # seconds between two checks when netlink is not available
+    _addresses = []  # cached ipv4 addresses, without the loopback address
+    _listeners = []  # called with the new ip string when the addresses change
+    _stop = threading.Event()
+    _thread: threading.Thread = None
+
+    # Read the addresses and start watching for changes, run on startup
+    @staticmethod
+    def start():
+        Network._addresses = Network.read_addresses()
+        logger.info(f"ip address: {Network.ip()}")
+        Network._stop.clear()
+        Network._thread = threading.Thread(target=Network._watch, name="network")
+        Network._thread.daemon = True  # Makes sure the thread stops when the process ends/crashes
+        Network._thread.start()
+
+    @staticmethod
+    def stop():
+        Network._stop.set()
+
+    # The cached addresses as one string, separated by spaces (like "hostname -I")
+    @staticmethod
+    def ip():
+        return " ".join(Network._addresses)
+
+    # Call listener with the new ip string every time the addresses change
+    @staticmethod
+    def subscribe(listener):
+        Network._listeners.append(listener)
+
+    # Read the ipv4 address of every network interface, except the loopback
+    @staticmethod
+    def read_addresses():
+        addresses = []
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for index, name in socket.if_nameindex():
+                try:
+                    request = struct.pack("256s", name[:15].encode())
+                    result = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)
+                except OSError:  # the interface has no ipv4 address
+                    continue
+                address = socket.inet_ntoa(result[20:24])
+                if not address.startswith("127."):
+                    addresses.append(address)
+        return addresses
+
+    # Read the addresses again and tell the listeners if they changed
+    @staticmethod
+    def refresh():
+        addresses = Network.read_addresses()
+        if addresses == Network._addresses:
+            return
+        Network._addresses = addresses
+        logger.info(f"ip address changed: {Network.ip()}")
+        for listener in Network._listeners:
+            try:
+                listener(Network.ip())
+            except Exception as e:
+                logger.error(f"network listener failed: {e}")
+
+    # This is what the thread is doing
+    @staticmethod
+    def _watch():
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+            sock.settimeout(1)  # wake up every second to check if the watcher should stop
+        except (AttributeError, OSError) as e:
+            logger.info(f"netlink not available ({e}), checking ip every {Network.poll_interval} seconds")
+            while not Network._stop.wait(Network.poll_interval):
+                Network.refresh()
+            return
+
+        with sock:
+            while not Network._stop.is_set():
+                try:
+                    sock.recv(65536)  # blocks until the kernel reports a change
+                except socket.timeout:
+                    continue
+                Network.refresh()
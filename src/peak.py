@@ -0,0 +1,125 @@
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Points the dish at the strongest signal, instead of trusting the angles of the position sensor.
+# The sensor drifts and is never perfectly calibrated, so when the dish points where the sensor says the
+# satellite is, it can still be a bit off. The search moves the dish around that position (an offset on
+# top of the target) and measures the signal power (see sdr.py) at every point it visits.
+#
+# Near the satellite the received power in dB is close to a parabola (the main lobe of the dish is shaped like
+# a gaussian). The conical scan measures the center and one point on each side of it, on both axes (5 dwells).
+# A parabola through the three points of an axis gives the position of the peak directly, so the search
+# usually converges in one or two scans. Far from the peak the parabola does not fit, then it steps uphill.
+# With a noisy signal the estimates keep jumping around the peak by a small amount. When the steps stop getting smaller,
+# more scans do not help: the search stops and uses the average of the estimates close to the peak.
+# When the scan does not see any difference in power, the satellite is not in the beam at all: the search
+# walks a spiral outwards until it finds the signal, and starts scanning from there.
+#
+# Offsets are (cross-elevation, elevation) in degrees. Cross-elevation is the angle on the sky, the azimuth
+# motor has to turn cross-elevation / cos(elevation) for it, see Dish.set_offset.
+
+
+class PeakSearch():
+    def __init__(self, measure, move, beamwidth=3.0, iterations=8, tolerance=0.05,
+                 flat=0.5, search_radius=10.0):
+        self.measure = measure  # measure() -> power in dB at the current offset, waits one dwell period
+        self.move = move  # move(cross_elevation, elevation) -> moves to an offset and waits until it is there
+        self.beamwidth = beamwidth  # width of the main lobe of the dish in degrees
+        self.radius = beamwidth * 0.3  # distance between the center and the points of the conical scan
+        self.iterations = iterations  # maximum amount of conical scans
+        self.tolerance = tolerance  # stop when the peak moves less than this (degrees)
+        self.flat = flat  # power differences below this (dB) are seen as no signal
+        self.search_radius = search_radius  # how far the spiral goes (degrees)
+        self.dwells = 0  # amount of measurements done
+        self.best = None  # (power, offset) of the strongest point measured
+
+    # Find the peak, starting at offset. Returns the offset of the peak
+    # step is called with a description of what the search is doing, it can stop the search by raising
+    def run(self, offset=(0.0, 0.0), step=lambda description: None):
+        offset = tuple(offset)
+        estimates = []  # estimates of the peak made close to it
+        moved = math.inf
+        for iteration in range(self.iterations):
+            step(f"Conical scan {iteration + 1}")
+            center, powers = self._scan(offset)
+            if max(powers + [center]) - min(powers + [center]) < self.flat:
+                if iteration > 0:  # lost the signal, go back to the best point
+                    break
+                step("Spiral search")
+                found = self._spiral(offset, center)
+                if found is None:
+                    logger.info("Peak search: no signal found")
+                    break
+                offset = found
+                continue
+
+            new_offset = tuple(o + self._peak(center, plus, minus)
+                               for o, (plus, minus) in zip(offset, (powers[0:2], powers[2:4])))
+            previous, moved = moved, math.dist(offset, new_offset)
+            offset = new_offset
+            logger.debug(f"Peak search: offset {offset}, moved {moved:.3f}")
+            if moved < self.radius:
+                estimates.append(offset)
+            if moved < self.tolerance or (len(estimates) > 1 and moved >= previous):
+                break
+
+        if len(estimates) > 1:  # average out the noise of the last estimates
+            offset = tuple(sum(axis) / len(estimates) for axis in zip(*estimates))
+
+        # end at the best point that was measured, the last estimate is not always better
+        self.move(*offset)
+        power = self._dwell(offset)
+        if self.best and self.best[0] > power + self.flat:
+            offset = self.best[1]
+            self.move(*offset)
+        logger.info(f"Peak search done after {self.dwells} dwells: offset {offset}")
+        return offset
+
+    # Measure the center and the points on both sides of it, on both axes
+    # Returns the power at the center and [+cross, -cross, +elevation, -elevation]
+    def _scan(self, offset):
+        x, y = offset
+        r = self.radius
+        self.move(x, y)
+        center = self._dwell(offset)
+        powers = []
+        for point in ((x + r, y), (x - r, y), (x, y + r), (x, y - r)):
+            self.move(*point)
+            powers.append(self._dwell(point))
+        return center, powers
+
+    # Distance from the center to the peak on one axis, from a parabola through the three points
+    def _peak(self, center, plus, minus):
+        r = self.radius
+        curvature = plus + minus - 2 * center
+        if curvature < 0:  # a maximum, jump to it (but not further than one beamwidth)
+            shift = r * (minus - plus) / (2 * curvature)
+            return max(-self.beamwidth, min(self.beamwidth, shift))
+        # not near the peak (or in a minimum between lobes): step uphill
+        return r if plus > minus else -r
+
+    # Walk a spiral around offset until the power rises above start, the power the scan measured at offset
+    # Returns the offset where the signal was found, None if it was not found
+    def _spiral(self, offset, start):
+        spacing = self.radius * 2  # distance between the points, and between the turns of the spiral
+        angle = 0
+        while True:
+            # archimedean spiral: the radius grows one spacing every turn, points are one spacing apart
+            angle += spacing / max(spacing * angle / (2 * math.pi), spacing)
+            distance = spacing * angle / (2 * math.pi)
+            if distance > self.search_radius:
+                return None
+            point = (offset[0] + distance * math.cos(angle), offset[1] + distance * math.sin(angle))
+            self.move(*point)
+            if self._dwell(point) > start + self.flat:
+                return point
+
+    # Measure the power at the current point and remember the best one
+    def _dwell(self, offset):
+        power = self.measure()
+        self.dwells += 1
+        if self.best is None or power > self.best[0]:
+            self.best = (power, tuple(offset))
+        return power
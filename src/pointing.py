@@ -0,0 +1,149 @@
+import collections
+import math
+
+import numpy as np
+
+# Where the dish points, calculated from the orientation quaternion of the BNO055 instead of its euler angles.
+# The euler angles of the sensor jump when an angle passes ±90 or 180 degrees, and the pid controllers used to
+# get one angle each and wrap it themselves (modulo 360). Here both axes are calculated from the same sample:
+# 1. the quaternion is turned into a rotation matrix, from the frame of the sensor to the frame of the world
+#    (the fusion frame of the sensor, z points up)
+# 2. it rotates the boresight (the direction the dish points at) and the axle of the elevation motor.
+#    The axle stays horizontal, so it gives the azimuth also when the dish points straight up or past it
+# 3. the azimuth error is the angle between the horizontal directions of the dish and the goal (atan2 of the cross
+#    and dot product). It is always the short way around and has no jump at 0/360, so there is nothing to wrap.
+#    The elevation is the angle of the boresight above the horizontal direction of the dish, it never jumps at 90
+# All functions work on numpy arrays, one quaternion (shape (4,)) or many of them (shape (n, 4)) at once.
+#
+# The mount geometry says how the sensor is fixed to the dish, as vectors:
+# boresight: the direction the dish points at, in the frame of the sensor
+# axle: the direction of the axle of the elevation motor, in the frame of the sensor. Elevation increases
+#       counterclockwise around it (right hand rule)
+# north, east: the directions of azimuth 0 and 90 degrees, in the frame of the world (horizontal)
+# The default matches the simulated sensor (see SimBNO055.quaternion): heading turns around z, roll around x.
+Mount = collections.namedtuple("Mount", ["boresight", "axle", "north", "east"])
+DEFAULT_MOUNT = Mount((0.0, 1.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (-1.0, 0.0, 0.0))
+
+
+# Rotation matrices of quaternions (w, x, y, z), shape (..., 4) -> (..., 3, 3)
+# The quaternions do not need to be normalized
+def rotation_matrices(quaternions):
+    quaternions = np.asarray(quaternions, dtype=float)
+    w, x, y, z = np.moveaxis(quaternions / np.linalg.norm(quaternions, axis=-1, keepdims=True), -1, 0)
+    return np.stack((
+        np.stack((1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)), axis=-1),
+        np.stack((2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)), axis=-1),
+        np.stack((2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)), axis=-1),
+    ), axis=-2)
+
+
+# The parts of the pointing that the angles are calculated from, each of shape (...):
+# north, east: the horizontal direction of the dish (not normalized)
+# up, level: the boresight upwards and along the horizontal direction of the dish
+def _components(quaternions, mount: Mount):
+    rotation = rotation_matrices(quaternions)
+    boresight = rotation @ np.asarray(mount.boresight, dtype=float)
+    axle = rotation @ np.asarray(mount.axle, dtype=float)
+    # horizontal direction of the dish: the axle turned 90 degrees around the vertical (up x axle)
+    forward = np.stack((-axle[..., 1], axle[..., 0], np.zeros_like(axle[..., 0])), axis=-1)
+    north = forward @ np.asarray(mount.north, dtype=float)
+    east = forward @ np.asarray(mount.east, dtype=float)
+    level = np.sum(boresight * forward, axis=-1) / np.hypot(north, east)
+    return north, east, boresight[..., 2], level
+
+
+# The azimuth (0 to 360) and elevation (-180 to 180) the dish points at, in degrees
+def look_angles(quaternions, mount: Mount = DEFAULT_MOUNT):
+    north, east, up, level = _components(quaternions, mount)
+    return _angles(north, east, up, level)
+
+
+def _angles(north, east, up, level):
+    return np.degrees(np.arctan2(east, north)) % 360, np.degrees(np.arctan2(up, level))
+
+
+# The angles from where the dish points to the goals, in degrees, shape (..., 2): (azimuth error, elevation error)
+# goals: (azimuth, elevation) in degrees, shape (..., 2). Any azimuth works, like -10 or 370
+# The azimuth error is between -180 and 180
+def errors(quaternions, goals, mount: Mount = DEFAULT_MOUNT):
+    return _errors(*_components(quaternions, mount), goals)
+
+
+# errors, from the components of the pointing
+def _errors(north, east, up, level, goals):
+    goals = np.radians(np.asarray(goals, dtype=float))
+    goal_north = np.cos(goals[..., 0])
+    goal_east = np.sin(goals[..., 0])
+    # the horizontal directions of the dish and the goal: cross product -> sine, dot product -> cosine
+    azimuth = np.arctan2(north * goal_east - east * goal_north, north * goal_north + east * goal_east)
+    elevation = goals[..., 1] - np.arctan2(up, level)
+    return np.degrees(np.stack((azimuth, elevation), axis=-1))
+
+
+# Gives the pid controllers of both motors their error, calculated from the latest sample of the sampler.
+# Both errors are calculated in one go and kept until the sample or one of the goals changes,
+# so the motors (which run faster than the sensor) do not calculate the same thing again every tick.
+# The pid controllers of both motors call it from their own thread. Each cache is one tuple, together with the key
+# it belongs to, and replacing it is a single assignment, so no thread ever sees the key of one result with another.
+class Pointing():
+    def __init__(self, sampler, mount: Mount = DEFAULT_MOUNT):
+        self.sampler = sampler  # SensorSampler, or anything else with a latest sample
+        self.mount = mount
+        self.motors = ()  # (azimuth motor, elevation motor), see attach
+        # (key of the sample, components of the pointing (see _components), angles) of the latest sample
+        self._sample = (None, None, (None, None))
+        self._errors = (None, (0.0, 0.0))  # (key of the sample and the goals, errors)
+
+    # Give the motors their error from this pointing, instead of from their own axis of the sensor
+    def attach(self, azimuth_motor, elevation_motor):
+        self.motors = (azimuth_motor, elevation_motor)
+        azimuth_motor.error_callback = lambda: self.errors()[0]
+        elevation_motor.error_callback = lambda: self.errors()[1]
+
+    # Rotate the quaternion of the latest sample, once for every new sample. Returns (key, components, angles)
+    def _update(self, sample):
+        key = (sample.timestamp, sample.quaternion)
+        cached = self._sample
+        if key == cached[0]:
+            return cached
+        if None in sample.quaternion:  # the sensor was not read yet
+            cached = (key, None, (None, None))
+        else:
+            components = _components(sample.quaternion, self.mount)
+            cached = (key, components, tuple(float(angle) for angle in _angles(*components)))
+        self._sample = cached
+        return cached
+
+    # The azimuth and elevation of the latest sample in degrees, (None, None) before the sensor was read
+    def angles(self):
+        return self._update(self.sampler.latest)[2]
+
+    # The errors of both motors in degrees: (azimuth, elevation)
+    # A moving goal is taken at the time of the sample, where the goal was when the position was measured
+    def errors(self):
+        sample = self.sampler.latest
+        sample_key, components, _ = self._update(sample)
+        azimuth_motor, elevation_motor = self.motors
+        goals = (azimuth_motor.goal_at(sample.timestamp) / azimuth_motor.steps_per_rev * 360,
+                 elevation_motor.goal_at(sample.timestamp) / elevation_motor.steps_per_rev * 360)
+        key = (sample_key, goals)
+        cached = self._errors
+        if key == cached[0]:
+            return cached[1]
+        if components is None:  # no position yet, do not move
+            result = (0.0, 0.0)
+        else:
+            azimuth, elevation = _errors(*components, goals)
+            result = (float(azimuth), float(elevation))
+        self._errors = (key, result)
+        return result
+
+
+# The mount geometry from comma separated vectors, like "0, 1, 0"
+def parse_mount(boresight, axle, north, east):
+    def vector(text):
+        values = tuple(float(value) for value in text.split(","))
+        if len(values) != 3 or not math.hypot(*values):
+            raise ValueError(f"Not a 3d direction: {text}")
+        return values
+    return Mount(vector(boresight), vector(axle), vector(north), vector(east))
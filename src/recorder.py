@@ -0,0 +1,152 @@
+import bisect
+import csv
+import io
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Records the state of the dish many times per second in a file, so it can be analysed after a pass.
+# The file is a ring buffer of fixed size: when it is full, the oldest records are overwritten.
+# Every record is a fixed amount of bytes (see RECORD), written directly into the file through a memory map.
+# Writing a record is just copying a few bytes into memory, the operating system writes it to the SD card later.
+# Because the memory belongs to the operating system and not to the program, the records survive a crash of the program.
+#
+# The records are stamped with the monotonic clock, turned into unix time with the wall clock at the start of the run.
+# The wall clock of a raspberry pi without a real time clock jumps when it is set over the network, the stamps do not.
+# A new run can still start with an earlier time than the last run ended, the header remembers from which record on
+# the times are in order, so only the records before it are searched one by one.
+#
+# File layout:
+#   header (HEADER_SIZE bytes): magic, version, record size, capacity, amount of records ever written,
+#                               first record of the records with times in order
+#   capacity records of RECORD.size bytes, record n is stored at index n % capacity
+
+MAGIC = b"SSARFREC"
+VERSION = 2
+HEADER = struct.Struct("<8sIIIIQQ")  # magic, version, record size, capacity, padding, count, ordered
+HEADER_SIZE = 64
+COUNT_OFFSET = 24  # position of the count in the header
+ORDERED_OFFSET = 32  # position of the first ordered record in the header
+
+# The values in one record, in order
+FIELDS = [
+    "time",  # unix time in seconds, see the stamps above
+    "euler_heading", "euler_roll", "euler_pitch",  # sensor euler angles in degrees
+    "azimuth_goal", "azimuth_velocity", "azimuth_acceleration",  # steps, steps/s, steps/s^2
+    "azimuth_p", "azimuth_i", "azimuth_d",  # pid terms
+    "elevation_goal", "elevation_velocity", "elevation_acceleration",
+    "elevation_p", "elevation_i", "elevation_d",
+]
+RECORD = struct.Struct("<d15f")
+
+
+class Recorder():
+    def __init__(self, path="logs/telemetry.bin", capacity=360000, clock=time.monotonic, wall_clock=time.time):
+        self.path = path
+        self.capacity = capacity  # amount of records that fit in the file
+        self.clock = clock
+        self.epoch = wall_clock() - clock()  # unix time at 0 on the clock
+        self.count = 0  # amount of records ever written, also when they have been overwritten since
+        self.ordered = 0  # from this record on, the times of the records only go up
+        self._lock = threading.Lock()
+        self._open()
+
+    # Open the file, or create it if it does not exist or has a different layout
+    def _open(self):
+        size = HEADER_SIZE + self.capacity * RECORD.size
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        existing = os.path.exists(self.path) and os.path.getsize(self.path) == size
+        self._file = open(self.path, "r+b" if existing else "w+b")
+        if not existing:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+        magic, version, record_size, capacity, _, count, ordered = HEADER.unpack_from(self._map, 0)
+        if existing and (magic, version, record_size, capacity) == (MAGIC, VERSION, RECORD.size, self.capacity):
+            self.count = count  # continue after the records of the last run
+            self.ordered = ordered
+            logger.info(f"Opened recording {self.path} with {min(count, capacity)} records")
+        else:
+            HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD.size, self.capacity, 0, 0, 0)
+            logger.info(f"Created recording {self.path} for {self.capacity} records")
+
+    # Write one record. values are the FIELDS after time, the time is added here
+    def record(self, *values):
+        with self._lock:
+            stamp = self.epoch + self.clock()
+            if self.count > 0 and stamp < self._time(self.count - 1):
+                # earlier than the last record (of the last run), the records before this one are out of order
+                self.ordered = self.count
+                struct.pack_into("<Q", self._map, ORDERED_OFFSET, self.ordered)
+            RECORD.pack_into(self._map, self._offset(self.count), stamp, *values)
+            self.count += 1
+            # update the count after the record, so a crash never leaves a half written record in the count
+            struct.pack_into("<Q", self._map, COUNT_OFFSET, self.count)
+
+    # Ask the operating system to write everything to the disk now
+    def flush(self):
+        with self._lock:
+            self._map.flush()
+
+    def close(self):
+        with self._lock:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+
+    # All the records (as tuples) with a time between start and end, in the order they were written
+    def read(self, start=None, end=None):
+        with self._lock:
+            return [RECORD.unpack_from(self._map, self._offset(n)) for n in self._window(start, end)]
+
+    # Numbers of the records with a time between start and end, in the order they were written
+    def _window(self, start, end):
+        first = max(0, self.count - self.capacity)
+        records = range(max(first, self.ordered), self.count)
+        # these records are in order of time, so the window can be found with a binary search
+        if start is not None:
+            records = records[bisect.bisect_left(records, start, key=self._time):]
+        if end is not None:
+            records = records[:bisect.bisect_right(records, end, key=self._time)]
+        if first >= self.ordered:
+            return records
+        # the older records are not in order, check them one by one
+        return [n for n in range(first, self.ordered)
+                if (start is None or self._time(n) >= start) and (end is None or self._time(n) <= end)] + list(records)
+
+    # Position of record n in the file
+    def _offset(self, n):
+        return HEADER_SIZE + (n % self.capacity) * RECORD.size
+
+    # Time of record n
+    def _time(self, n):
+        return struct.unpack_from("<d", self._map, self._offset(n))[0]
+
+    # The records between start and end as NumPy arrays, one array per field
+    def export_numpy(self, start=None, end=None):
+        import numpy as np
+        dtype = np.dtype([(FIELDS[0], "<f8")] + [(name, "<f4") for name in FIELDS[1:]])
+        with self._lock:
+            window = self._window(start, end)
+            ring = np.frombuffer(self._map, dtype=dtype, count=self.capacity, offset=HEADER_SIZE)
+            # copy only the records in the window, in the order they were written
+            if isinstance(window, range):
+                indices = np.arange(window.start, window.stop) % self.capacity
+            else:
+                indices = np.array(window, dtype=np.int64) % self.capacity
+            records = ring[indices]
+            del ring  # the memory map can not be closed while an array uses it
+        return {name: records[name] for name in FIELDS}
+
+    # The records between start and end as CSV text, with the field names on the first line
+    def export_csv(self, start=None, end=None):
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerow(FIELDS)
+        writer.writerows(self.read(start, end))
+        return text.getvalue()
@@ -0,0 +1,260 @@
+import argparse
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Measures the strength of the signal received by the dish, from the IQ samples of an SDR (software defined radio).
+# A source delivers the samples in blocks, the PowerEstimator turns every block into a power spectrum with
+# Welch's method (the block is cut into overlapping segments, each one is windowed and put through an FFT,
+# and the spectra of all segments are averaged), and the power inside the band of interest is published
+# as one Reading in SignalPipeline.latest.
+#
+# Sources:
+# - FileSource: replays a recording (.cfile: raw complex64 like gnuradio writes, .npy: numpy array), no hardware needed
+# - RtlSdrSource: the USB SDR dongle, needs the pyrtlsdr library
+#
+# All buffers are allocated once, so processing a block does not create new arrays (the Pi 4 has to keep up with 2.4 MS/s).
+# Benchmark the processing speed on this computer with:
+#   python src/sdr.py                 synthetic samples
+#   python src/sdr.py recording.cfile a recording
+
+# One measurement of the signal. This is a tuple, so it can not be changed after it has been created.
+# timestamp: time of the measurement in seconds (time.monotonic)
+# power: power in the band in dB (relative to full scale of the SDR)
+# peak: strongest frequency in the band in Hz, relative to the center frequency
+Reading = collections.namedtuple("Reading", ["timestamp", "power", "peak"])
+
+# numpy 2 can write the FFT into an existing array
+FFT_OUT = np.lib.NumpyVersion(np.__version__) >= "2.0.0"
+
+
+# Replays IQ samples from a file, in a loop
+class FileSource():
+    def __init__(self, path, sample_rate, realtime=True, clock=time.monotonic):
+        if path.endswith(".npy"):
+            self.samples = np.load(path, mmap_mode="r")
+        else:  # .cfile and other raw recordings: interleaved 32 bit floats
+            self.samples = np.memmap(path, dtype=np.complex64, mode="r")
+        if len(self.samples) == 0:
+            raise ValueError(f"No samples in {path}")
+        self.sample_rate = sample_rate
+        # wait between blocks like a real SDR would, turn off to process as fast as possible
+        self.realtime = realtime
+        self.clock = clock
+        self._position = 0
+        self._next_time = None
+
+    # Fill buffer with the next samples, returns the amount of samples
+    def read_into(self, buffer):
+        count = len(buffer)
+        filled = 0
+        while filled < count:
+            part = min(count - filled, len(self.samples) - self._position)
+            buffer[filled:filled + part] = self.samples[self._position:self._position + part]
+            filled += part
+            self._position = (self._position + part) % len(self.samples)
+
+        if self.realtime:
+            now = self.clock()
+            if self._next_time is None or self._next_time < now:
+                self._next_time = now
+            self._next_time += count / self.sample_rate
+            time.sleep(max(0, self._next_time - now))
+        return count
+
+    def close(self):
+        pass
+
+
+# Reads IQ samples from an RTL-SDR USB dongle
+class RtlSdrSource():
+    def __init__(self, sample_rate, center_frequency, gain="auto"):
+        from rtlsdr import RtlSdr  # only needed with the dongle, see start.sh
+        self.sdr = RtlSdr()
+        self.sdr.sample_rate = sample_rate
+        self.sdr.center_freq = center_frequency
+        self.sdr.gain = gain
+        self.sample_rate = self.sdr.sample_rate
+        self._raw = None
+
+    # Fill buffer with the next samples, returns the amount of samples
+    def read_into(self, buffer):
+        count = len(buffer)
+        if self._raw is None or len(self._raw) != count * 2:
+            self._raw = np.empty(count * 2, dtype=np.float32)
+        # the dongle sends unsigned bytes: I, Q, I, Q, ... centered around 127.5
+        data = np.frombuffer(self.sdr.read_bytes(count * 2), dtype=np.uint8)
+        np.subtract(data, 127.5, out=self._raw)
+        self._raw *= 1 / 127.5
+        buffer[:] = self._raw.view(np.complex64)
+        return count
+
+    def close(self):
+        self.sdr.close()
+
+
+# Power spectrum of blocks of IQ samples with Welch's method
+class PowerEstimator():
+    def __init__(self, sample_rate, block_size=262144, fft_size=1024, overlap=0.5, band=None):
+        self.sample_rate = sample_rate
+        self.fft_size = fft_size
+        self.step = int(fft_size * (1 - overlap))
+        self.segments = (block_size - fft_size) // self.step + 1
+        self.block_size = block_size
+
+        self.window = np.hanning(fft_size).astype(np.float32)
+        # scale so the spectrum is a power spectral density (power per Hz)
+        self.scale = 1 / (sample_rate * np.sum(self.window ** 2) * self.segments)
+        # frequency of every bin relative to the center frequency, in the order of the FFT output
+        self.frequencies = np.fft.fftfreq(fft_size, 1 / sample_rate)
+        self.set_band(*(band or (-sample_rate / 2, sample_rate / 2)))
+
+        # the buffers used for every block
+        self._windowed = np.empty((self.segments, fft_size), dtype=np.complex64)
+        self._fft = np.empty((self.segments, fft_size), dtype=np.complex64)
+        self._power = np.empty((self.segments, fft_size), dtype=np.float32)
+        self.spectrum = np.empty(fft_size, dtype=np.float64)  # power spectral density of the last block
+
+    # Only the power between low and high (Hz, relative to the center frequency) is counted
+    def set_band(self, low, high):
+        self.band = (low, high)
+        self._mask = (self.frequencies >= low) & (self.frequencies <= high)
+
+    # Calculate the spectrum of one block of block_size samples
+    # Returns the power in the band (dB) and the strongest frequency in the band (Hz)
+    def update(self, block):
+        # the overlapping segments, as a view on the block (nothing is copied)
+        segments = np.lib.stride_tricks.as_strided(
+            block, shape=(self.segments, self.fft_size),
+            strides=(block.strides[0] * self.step, block.strides[0]), writeable=False)
+        np.multiply(segments, self.window, out=self._windowed)
+        if FFT_OUT:
+            np.fft.fft(self._windowed, axis=1, out=self._fft)
+        else:
+            self._fft[:] = np.fft.fft(self._windowed, axis=1)
+        np.abs(self._fft, out=self._power)
+        np.square(self._power, out=self._power)
+        np.sum(self._power, axis=0, out=self.spectrum)
+        self.spectrum *= self.scale
+
+        band = self.spectrum[self._mask]
+        if not len(band):  # the band is outside of the spectrum
+            return None, None
+        power = np.sum(band) * self.sample_rate / self.fft_size
+        peak = self.frequencies[self._mask][np.argmax(band)]
+        return float(10 * np.log10(power + 1e-20)), float(peak)
+
+
+# Reads a source in its own thread and publishes the signal power of every block in latest.
+# Replacing latest with a new tuple is a single assignment, so readers never need a lock.
+class SignalPipeline():
+    latest: Reading  # the most recent measurement
+
+    def __init__(self, source, estimator: PowerEstimator, clock=time.monotonic):
+        self.source = source
+        self.estimator = estimator
+        self.clock = clock
+        self.latest = Reading(0, None, None)
+        self.blocks = 0  # amount of blocks processed
+        self.errors = 0  # amount of failed reads
+        self._buffer = np.empty(estimator.block_size, dtype=np.complex64)
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+
+    def start(self):
+        logger.info(f"Starting signal measurement at {self.estimator.sample_rate / 1e6:.2f} MS/s")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sdr")
+        self._thread.daemon = True  # Makes sure the thread stops when the process ends/crashes
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        self.source.close()
+
+    # Read and process one block
+    def poll(self):
+        self.source.read_into(self._buffer)
+        power, peak = self.estimator.update(self._buffer)
+        self.blocks += 1
+        self.latest = Reading(self.clock(), power, peak)
+
+    # This is what the thread is doing
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Failed to read SDR: {e}")
+                self._stop.wait(1)  # the dongle might be unplugged, try again later
+
+
+# Create the pipeline with the settings of the [SDR] section of the config, None when it is disabled
+def from_config(config):
+    kind = config.getSdrSource()
+    sample_rate = config.getSdrSampleRate()
+    if kind == "file":
+        path = config.getSdrFile()
+        if not os.path.exists(path):
+            logger.warning(f"No SDR recording at {path}, signal measurement disabled")
+            return None
+        source = FileSource(path, sample_rate)
+    elif kind == "rtlsdr":
+        try:
+            source = RtlSdrSource(sample_rate, config.getSdrFrequency(), config.getSdrGain())
+        except Exception as e:  # library not installed, or the dongle is not connected
+            logger.warning(f"Failed to start SDR (not connected?): {e}")
+            return None
+        sample_rate = source.sample_rate
+    else:
+        logger.info("signal measurement disabled")
+        return None
+    estimator = PowerEstimator(sample_rate, config.getSdrBlockSize(), config.getSdrFftSize(),
+                               band=config.getSdrBand())
+    return SignalPipeline(source, estimator)
+
+
+# Benchmark: process blocks as fast as possible and report the samples per second
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the SDR signal power pipeline")
+    parser.add_argument("file", nargs="?", help=".cfile or .npy IQ recording, synthetic samples if not given")
+    parser.add_argument("--rate", type=float, default=2.4e6, help="sample rate in samples per second")
+    parser.add_argument("--block", type=int, default=262144, help="samples per block")
+    parser.add_argument("--fft", type=int, default=1024, help="fft size")
+    parser.add_argument("--seconds", type=float, default=5, help="how long to run")
+    args = parser.parse_args(argv)
+
+    path = args.file
+    if path is None:  # a carrier 100 kHz above the center frequency, with some noise
+        rng = np.random.default_rng(0)
+        t = np.arange(args.block * 4) / args.rate
+        samples = 0.1 * np.exp(2j * np.pi * 100e3 * t) + \
+            0.01 * (rng.standard_normal(len(t)) + 1j * rng.standard_normal(len(t)))
+        path = os.path.join("logs", "sdr-benchmark.npy")
+        os.makedirs("logs", exist_ok=True)
+        np.save(path, samples.astype(np.complex64))
+
+    estimator = PowerEstimator(args.rate, args.block, args.fft)
+    pipeline = SignalPipeline(FileSource(path, args.rate, realtime=False), estimator)
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.seconds:
+        pipeline.poll()
+    elapsed = time.perf_counter() - start
+    rate = pipeline.blocks * args.block / elapsed
+    print(f"{pipeline.blocks} blocks in {elapsed:.2f}s: {rate / 1e6:.2f} MS/s "
+          f"({rate / args.rate:.1f}x real time), power {pipeline.latest.power:.1f} dB, "
+          f"peak {pipeline.latest.peak / 1e3:.1f} kHz")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
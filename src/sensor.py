@@ -0,0 +1,79 @@
+import collections
+import logging
+import time
+
+from control_loop import ControlLoop
+
+logger = logging.getLogger(__name__)
+
+# One reading of the position sensor. This is a tuple, so it can not be changed after it has been created.
+# timestamp: time of the reading in seconds (time.monotonic)
+# euler: (heading, roll, pitch) in degrees
+# quaternion: (w, x, y, z)
+# calibration_status: (system, gyro, accelerometer, magnetometer), each 0 to 3
+Sample = collections.namedtuple(
+    "Sample", ["timestamp", "euler", "quaternion", "calibration_status"])
+
+# This class is the only thing that reads the BNO055 position sensor.
+# It reads the sensor in its own thread at the rate the sensor produces new data (100 Hz in fusion mode)
+# and stores the result as one Sample in SensorSampler.latest.
+# Everything else (the pid controllers, the log and the web interface) reads SensorSampler.latest instead of the I2C bus.
+# This way the amount of I2C traffic stays the same, no matter how many things want to know the position.
+# Replacing latest with a new tuple is a single assignment, so readers never need a lock and never see half a sample.
+
+
+class SensorSampler():
+    # The BNO055 updates its fusion output at 100 Hz, reading faster only returns the same data again
+    rate = 100
+    # The calibration status changes slowly, so it is only read once every this many samples
+    calibration_interval = 10
+
+    latest: Sample  # the most recent reading of the sensor
+
+    def __init__(self, sensor, rate=None, clock=time.monotonic):
+        self.sensor = sensor  # the BNO055 instance, created in Dish._setup_sensors
+        self.clock = clock
+        if rate:
+            self.rate = rate
+        self.latest = Sample(0, (None, None, None),
+                             (None, None, None, None), (0, 0, 0, 0))
+        self.errors = 0  # amount of failed readings
+        self._count = 0
+        self.loop = ControlLoop(self.poll, self.rate, name="sensor", clock=clock)
+
+    # Start reading the sensor in the background
+    def start(self):
+        logger.info(f"Starting sensor sampler at {self.rate} Hz")
+        self.poll()  # make sure there is a sample before anything reads it
+        self.loop.start()
+
+    def stop(self):
+        self.loop.stop()
+
+    # Change how often the sensor is read (in Hz)
+    def set_rate(self, rate):
+        self.rate = rate
+        self.loop.rate = rate
+
+    # How old the latest sample is in seconds
+    @property
+    def age(self):
+        return self.clock() - self.latest.timestamp
+
+    # Read the sensor once and publish the result as the new latest sample
+    def poll(self):
+        previous = self.latest
+        try:
+            euler = tuple(self.sensor.euler)
+            quaternion = tuple(self.sensor.quaternion)
+            calibration_status = previous.calibration_status
+            if self._count % self.calibration_interval == 0:
+                calibration_status = tuple(self.sensor.calibration_status)
+        except Exception as e:  # keep the previous sample if the sensor could not be read
+            self.errors += 1
+            logger.warning(f"Failed to read sensor: {e}")
+            return
+        self._count += 1
+
+        self.latest = Sample(self.clock(), euler,
+                             quaternion, calibration_status)
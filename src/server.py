@@ -1,10 +1,19 @@
+import asyncio
+import concurrent.futures
+import io
 import json
-import os
 import logging
-import socketserver
-from http import server
+import time
+from email.utils import formatdate
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+from assets import Assets
+from catalogue import Catalogue
 from config import Config
 from dish import Dish
+from network import Network
+from telemetry import Telemetry
+from tracker import Tracker
 
 # To be moved to user manual:
 # When the raspberry hosts the website, it is not publicly available, only on the local network. This would mean only on eduroam
@@ -18,54 +27,224 @@ logger = logging.getLogger(__name__)
 # The website is divided in a server and a client, both of them run a part of the program
 # This file defines the server and is run on the raspberry pi.
 # The client part is defined by all the files in the client folder, and is run on the client device (your laptop or phone)
-# http is the protocol they use to communicate, all of that is standardized and done by the "server" part included in python
+# http is the protocol they use to communicate. The server speaks HTTP/1.1 itself, with the asyncio library of python:
+# - all connections are handled by one thread (the event loop), instead of one thread per connection.
+#   A connection that waits for its next request, or for the next telemetry frame, costs no thread at all
+# - connections stay open between requests (keep-alive), so the polling of the web interface does not open
+#   a new connection every time. An idle connection is closed after keep_alive seconds
+# - at most max_clients connections are open at the same time, more get "503 Service Unavailable"
+# - the routes (see RequestHandler) call the Dish, which can take a while. They run in a small pool of worker
+#   threads (the executor), so the event loop keeps serving the other clients in the meantime
 # This class serves to deliver the html and js files from the client folder to the client device when requested
 # and to call functions in dish.py when the client requests them.
-# This class extends the default pyhton httpserver, meaning there is lots of functionality hidden behind that
-
-
-class Server(socketserver.ThreadingMixIn, server.HTTPServer):
-
-    # Standard pyhton server stuff
-    instance: any
-    allow_reuse_address = True
-    daemon_threads = True
-
-    # initialize the server, done by pyhton
-    def __init__(self, address, requestHandler):
-        super().__init__(address, requestHandler)
-
-    # Start the http server and wait indefinitely for user requests
-    def run(self):
-        logger.info('Server running at' +
-                    str(Server.instance.server_address))
-        try:
-            # Set up and start the server
-            self.serve_forever()
-        finally:
-            # Stop serving when the program stops or crashes
-            logger.info("Server stopped.")
-
-    # Start the server
+# As there is only one web interface, all methods are static.
+
+
+class Server():
+    port: int
+    files = ['src/client/index.html', 'src/client/index.js', 'src/client/favicon.ico']  # see RequestHandler.sendFile
+    max_clients = 32  # connections open at the same time
+    workers = 4  # threads that run the routes
+    keep_alive = 15  # seconds an idle connection stays open
+    max_header_lines = 100  # more than this is not a request of the web interface
+    max_body = 1024 * 1024  # bytes in the body of one request
+    connections = 0  # amount of open connections
+    _loop: asyncio.AbstractEventLoop = None
+    _stopped: asyncio.Event = None  # set to stop the server, see Server.stop
+    _executor: concurrent.futures.ThreadPoolExecutor = None
+    _frame: asyncio.Event = None  # set when the telemetry has a new frame, replaced by a new event every frame
+
+    # Start the server and wait for requests until it is stopped
+    @staticmethod
     def start():
         Server.port = Config.getWebPort()
-        # This creates an instance of the server class and runs it
-        # It is a bit weird how this class creates an instance of itself. Can be done neater
+        Server.max_clients = Config.getWebMaxClients()
+        Server.workers = Config.getWebWorkers()
+        Server.keep_alive = Config.getWebKeepAlive()
         logger.debug('starting server...')
         logger.debug('sever port %i', Server.port)
-        address = ('0.0.0.0', Server.port)
-        Server.instance = Server(address, RequestHandler)
-        Server.instance.run()
+        Telemetry.start(Config.getStreamRate())  # start pushing telemetry to the clients
+        Assets.load(Server.files)  # the files of the web interface, read once
+        Server._executor = concurrent.futures.ThreadPoolExecutor(Server.workers, thread_name_prefix="http")
+        try:
+            asyncio.run(Server._serve())
+        finally:
+            # Stop serving when the program stops or crashes
+            Server._executor.shutdown(wait=False)
+            logger.info("Server stopped.")
 
-    # Stop the server
+    # Stop the server, can be called from any thread
+    @staticmethod
     def stop():
-        # This shuts the instance down and stops all camera streams
         logger.debug('stopping server')
-        try:
-            Server.instance.shutdown()
-            Server.instance.server_close()
-        except AttributeError:
+        Telemetry.stop()  # closes all the telemetry streams
+        loop = Server._loop
+        if loop and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(Server._stopped.set)
+            except RuntimeError:  # the loop stopped in the meantime
+                pass
+
+    # This is what the event loop is doing: accept connections until the server is stopped
+    @staticmethod
+    async def _serve():
+        Server._loop = asyncio.get_running_loop()
+        Server._stopped = asyncio.Event()
+        Server._frame = asyncio.Event()
+        Telemetry.listen(lambda: Server._loop.call_soon_threadsafe(Server._new_frame))
+        listener = await asyncio.start_server(Server._connection, '0.0.0.0', Server.port, reuse_address=True)
+        logger.info(f"Server running at {listener.sockets[0].getsockname()}")
+        for ip in Network.ip().split():
+            logger.info(f"Web interface available at http://{ip}:{Server.port}/")
+        async with listener:
+            await Server._stopped.wait()
+
+    # Wake up all the telemetry streams, runs in the event loop
+    @staticmethod
+    def _new_frame():
+        frame, Server._frame = Server._frame, asyncio.Event()
+        frame.set()
+
+    # Serve the requests of one connection, one after the other, until it is closed
+    @staticmethod
+    async def _connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if Server.connections >= Server.max_clients:
+            writer.write(Server._error(HTTPStatus.SERVICE_UNAVAILABLE, "Too many connections", keep_alive=False))
+            await Server._close(writer)
             return
+        Server.connections += 1
+        try:
+            while True:
+                try:
+                    request = await Server._read_request(reader)
+                except asyncio.TimeoutError:  # idle for too long
+                    break
+                except ValueError as e:  # not a valid http request
+                    writer.write(Server._error(HTTPStatus.BAD_REQUEST, str(e), keep_alive=False))
+                    break
+                if request is None:  # the client closed the connection
+                    break
+                method, path, headers, body, keep_alive = request
+
+                handler = RequestHandler(method, path, headers, body)
+                await Server._loop.run_in_executor(Server._executor, handler.handle)
+                if handler.stream:
+                    await Server._stream(writer)
+                    break
+                writer.write(handler.response)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            logger.debug("client disconnected")
+        finally:
+            Server.connections -= 1
+            await Server._close(writer)
+
+    @staticmethod
+    async def _close(writer: asyncio.StreamWriter):
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    # Read the next request of a connection: (method, path, headers, body, keep_alive), None when it is closed
+    # Raises ValueError when it is not a valid request, and asyncio.TimeoutError when none arrives in time
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader):
+        line = await asyncio.wait_for(reader.readline(), Server.keep_alive)
+        while line in (b"\r\n", b"\n"):  # some clients send an empty line between requests
+            line = await asyncio.wait_for(reader.readline(), Server.keep_alive)
+        if not line:
+            return None
+        try:
+            method, path, version = line.decode("latin-1").split()
+        except ValueError:
+            raise ValueError("Bad request line")
+        if not version.startswith("HTTP/1."):
+            raise ValueError(f"Unsupported version {version}")
+
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), Server.keep_alive)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= Server.max_header_lines:
+                raise ValueError("Too many headers")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "transfer-encoding" in headers:
+            raise ValueError("Chunked requests are not supported")
+        length = int(headers.get("content-length", "0") or "0")
+        if length < 0 or length > Server.max_body:
+            raise ValueError("Request body too large")
+        body = await asyncio.wait_for(reader.readexactly(length), Server.keep_alive) if length else b""
+
+        # HTTP/1.1 keeps the connection open unless the client says otherwise, HTTP/1.0 only when it asks for it
+        connection = headers.get("connection", "").lower()
+        if version == "HTTP/1.0":
+            keep_alive = "keep-alive" in connection
+        else:
+            keep_alive = "close" not in connection
+        return method, path, headers, body, keep_alive
+
+    # Keep the connection open and send every new telemetry frame to the client (Server-Sent Events)
+    # Every frame is built once in telemetry.py, this only writes it to the socket
+    @staticmethod
+    async def _stream(writer: asyncio.StreamWriter):
+        writer.write(Server._head(HTTPStatus.OK, [
+            ("Content-Type", "text/event-stream"),
+            ("Cache-Control", "no-cache"),
+            ("Connection", "close"),
+        ]))
+        Telemetry.subscribe()
+        sequence = Telemetry.sequence
+        try:
+            while Telemetry.running():
+                frame_event = Server._frame
+                try:
+                    await asyncio.wait_for(frame_event.wait(), 5)
+                except asyncio.TimeoutError:
+                    pass
+                new_sequence, frame = Telemetry.latest()
+                if new_sequence == sequence:
+                    # No new frame, send a comment so the connection does not time out
+                    frame = b": keep-alive\n\n"
+                sequence = new_sequence
+                writer.write(frame)
+                await writer.drain()  # a slow client only waits for itself
+        except ConnectionError:
+            logger.debug("telemetry client disconnected")
+        finally:
+            Telemetry.unsubscribe()
+
+    # The status line and headers of a response
+    @staticmethod
+    def _head(status, headers, reason=None):
+        lines = [f"HTTP/1.1 {status.value} {reason or status.phrase}",
+                 f"Date: {formatdate(usegmt=True)}",
+                 "Server: SSA_RF_Monitor"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1", "replace")
+
+    # A whole response, the body has to fit in memory
+    @staticmethod
+    def _response(status, body=b"", headers=(), reason=None, keep_alive=True):
+        headers = list(headers) + [("Content-Length", str(len(body)))]
+        if not keep_alive:
+            headers.append(("Connection", "close"))
+        return Server._head(status, headers, reason) + body
+
+    # An error response, the message is also used as the reason so the client can show it (response.statusText)
+    @staticmethod
+    def _error(status, message=None, keep_alive=True):
+        reason = " ".join((message or status.phrase).split())  # no line breaks in the status line
+        body = f"{status.value} {reason}\n".encode("utf-8")
+        return Server._response(status, body, [("Content-Type", "text/plain; charset=utf-8")],
+                                reason, keep_alive)
 
 # This class is where all the requests from the client are received.
 # Requests are separated into get and post requests.
@@ -74,9 +253,38 @@ class Server(socketserver.ThreadingMixIn, server.HTTPServer):
 # Each request contains a path or url that specifies what the client is requesting
 
 
-class RequestHandler(server.SimpleHTTPRequestHandler):
+class RequestHandler():
     # This handles the requests sent to the http server (from the fetch function in index.js for example)
     # Requests always contain a path/url that describes what the request wants from the server
+    # One handler is made for every request, Server._connection runs it in a worker thread (run_in_executor),
+    # so the routes can call the Dish and wait for it without holding up the other clients
+
+    def __init__(self, method, path, headers, body):
+        self.command = method  # GET or POST
+        self.path = path
+        self.headers = headers  # header names in lower case
+        self.body = body  # the data sent with a POST request, as bytes
+        self.response = b""  # status line, headers and body, built by one of the send methods
+        self.stream = False  # True when the connection should become a telemetry stream, see Server._stream
+
+    # Call the route of the request, an error in a route becomes a 500 response
+    def handle(self):
+        try:
+            if self.command == "GET":
+                self.do_GET()
+            elif self.command == "POST":
+                self.do_POST()
+            else:
+                self.send_error(HTTPStatus.NOT_IMPLEMENTED, f"Unsupported method {self.command}")
+        except (KeyError, ValueError, TypeError) as e:  # missing or invalid data in the request
+            logger.warning(f"Bad request {self.command} {self.path}: {e}")
+            self.send_error(HTTPStatus.BAD_REQUEST, "Invalid request data")
+        except Exception as e:
+            logger.error(f"Request {self.command} {self.path} failed: {e}")
+            self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR)
+        if not self.response and not self.stream:
+            self.sendPageNotFound()  # a POST to an unknown path
+        return self
 
     def do_GET(self):
         # read the request url and call the appropriate function
@@ -93,40 +301,51 @@ class RequestHandler(server.SimpleHTTPRequestHandler):
             self.sendFile('src/client/index.js')
 
         elif self.path == "/api/get-current-position":  # request the current positions of the dish
-            # Get the sensor data
-            yaw, roll, pitch = Dish.sensor.euler
+            # Get the angles of the latest sensor data, this does not read the sensor itself
+            azimuth, elevation = Dish.pointing.angles()
             data = {
-                "azimuth": yaw,
-                "elevation": roll
+                "azimuth": azimuth,
+                "elevation": elevation
             }
-            # Convert the data to a JSON string
-            response_data = json.dumps(data)
+            self.sendJson(data)
+
+        elif self.path == "/api/calibration":  # request the progress of the calibration
+            job = Dish.calibration_job
+            self.sendJson(job.state() if job else None)
+
+        elif self.path == "/api/autotune":  # request the progress and the report of the auto-tune
+            job = Dish.autotune_job
+            self.sendJson(job.state() if job else None)
+
+        elif self.path == "/api/track":  # request what satellite is being tracked
+            self.sendJson(Tracker.state())
+
+        elif self.path.startswith("/api/satellites"):  # search the satellites that can be seen
+            self.sendSatellites()
 
-            # Set the response headers and status
-            self.send_response(server.HTTPStatus.OK)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
+        elif self.path == "/api/profiles":  # request the tracking profiles and which one is in use
+            self.sendJson({
+                "active": Config.getProfileName(),
+                "profiles": [Config.getProfile(name)._asdict() for name in Config.getProfileNames()],
+            })
 
-            # Write the JSON response back to the client
-            self.wfile.write(response_data.encode("utf-8"))
+        elif self.path == "/api/stream":  # push the telemetry to the client until it disconnects
+            self.stream = True  # the server keeps the connection open, see Server._stream
+
+        elif self.path.startswith("/api/recording"):  # download a part of the recording
+            self.sendRecording()
 
         else:
             # An unknown request was sent
-            server.SimpleHTTPRequestHandler.do_GET(self)
+            self.sendPageNotFound()
 
     def do_POST(self):
         if self.path == '/':
             self.redirectHome()
         elif self.path == "/api/set-target":  # Set a new target for the pid controller
 
-            # Get the length of the data
-            content_length = int(self.headers['Content-Length'])
-
-            # Read the data sent in the POST request
-            post_data = self.rfile.read(content_length)
-
-            # Convert the data from JSON to a Python dictionary
-            data = json.loads(post_data.decode('utf-8'))
+            # Convert the data sent in the POST request from JSON to a Python dictionary
+            data = json.loads(self.body.decode('utf-8'))
 
             # Extract the two values from the data
             azimuth = data.get('azimuth')
@@ -142,8 +361,58 @@ class RequestHandler(server.SimpleHTTPRequestHandler):
             Dish.zero()  # Pass the order to the dish class
             self.redirectHome()  # return something to let the client know its request is processed
 
-        elif self.path == "/api/calibrate":  # perform the calibration sequence
-            Dish.calibrate()  # Pass the order to the dish class
+        elif self.path == "/api/calibrate":  # start the calibration sequence in the background
+            try:
+                job = Dish.calibrate()  # Pass the order to the dish class
+            except RuntimeError as e:
+                self.send_error(HTTPStatus.CONFLICT, str(e))
+                return
+            # return the job, so the client can follow its progress at /api/calibration
+            self.sendJson(job.state(), HTTPStatus.ACCEPTED)
+
+        elif self.path == "/api/calibration/cancel":  # stop the calibration sequence
+            Dish.cancel_calibration()  # Pass the order to the dish class
+            self.redirectHome()  # return something to let the client know its request is processed
+
+        elif self.path == "/api/peak-search":  # point at the strongest signal, in the background
+            try:
+                job = Dish.peak_search()  # Pass the order to the dish class
+            except RuntimeError as e:
+                self.send_error(HTTPStatus.CONFLICT, str(e))
+                return
+            # return the job, so the client can follow its progress in the telemetry
+            self.sendJson(job.state(), HTTPStatus.ACCEPTED)
+
+        elif self.path == "/api/peak-search/cancel":  # stop the peak search
+            Dish.cancel_peak_search()  # Pass the order to the dish class
+            self.redirectHome()  # return something to let the client know its request is processed
+
+        elif self.path == "/api/autotune":  # find pid tunings from a step response, in the background
+
+            # Convert the data sent in the POST request from JSON to a Python dictionary
+            data = json.loads(self.body.decode('utf-8') or "{}")
+
+            settling_time = data.get('settling_time')
+            try:
+                job = Dish.autotune(  # Pass the order to the dish class
+                    data.get('axis') or None,
+                    float(settling_time) if settling_time else None,
+                    bool(data.get('save')))
+            except ValueError as e:
+                self.send_error(HTTPStatus.BAD_REQUEST, str(e))
+                return
+            except RuntimeError as e:
+                self.send_error(HTTPStatus.CONFLICT, str(e))
+                return
+            # return the job, so the client can follow its progress at /api/autotune
+            self.sendJson(job.state(), HTTPStatus.ACCEPTED)
+
+        elif self.path == "/api/autotune/cancel":  # stop the auto-tune
+            Dish.cancel_autotune()  # Pass the order to the dish class
+            self.redirectHome()  # return something to let the client know its request is processed
+
+        elif self.path == "/api/offset/reset":  # forget the offset found by the peak search
+            Dish.set_offset(0, 0)
             self.redirectHome()  # return something to let the client know its request is processed
 
         elif self.path == "/api/toggle-pid":  # turn the pid controller on or off
@@ -151,16 +420,39 @@ class RequestHandler(server.SimpleHTTPRequestHandler):
             Dish.toggle_pid()  # Pass the order to the dish class
             self.redirectHome()  # return something to let the client know its request is processed
 
-        elif self.path == "/api/set-pid":  # set the pid tuning variables
+        elif self.path == "/api/track":  # follow a satellite
+
+            # Convert the data sent in the POST request from JSON to a Python dictionary
+            data = json.loads(self.body.decode('utf-8'))
+
+            try:
+                Tracker.track(int(data.get('norad')))  # Pass the order to the tracker
+            except (KeyError, TypeError, ValueError):
+                self.send_error(HTTPStatus.NOT_FOUND, "Unknown satellite")
+                return
+            self.sendJson(Tracker.state())
+
+        elif self.path == "/api/track/stop":  # stop following the satellite
+            Tracker.stop()
+            self.redirectHome()  # return something to let the client know its request is processed
 
-            # Get the length of the data
-            content_length = int(self.headers['Content-Length'])
+        elif self.path == "/api/set-profile":  # switch to another tracking profile, the pid keeps running
 
-            # Read the data sent in the POST request
-            post_data = self.rfile.read(content_length)
+            # Convert the data sent in the POST request from JSON to a Python dictionary
+            data = json.loads(self.body.decode('utf-8'))
 
-            # Convert the data from JSON to a Python dictionary
-            data = json.loads(post_data.decode('utf-8'))
+            try:
+                Dish.set_profile(str(data.get('name')))  # Pass the order to the dish class
+            except KeyError:
+                self.send_error(HTTPStatus.NOT_FOUND, "Unknown profile")
+                return
+            logger.info(f"Switched to profile {data.get('name')}")
+            self.sendJson(Config.getProfile()._asdict())
+
+        elif self.path == "/api/set-pid":  # set the pid tuning variables
+
+            # Convert the data sent in the POST request from JSON to a Python dictionary
+            data = json.loads(self.body.decode('utf-8'))
 
             # Extract the three values from the data
             p = float(data.get('p'))
@@ -175,34 +467,100 @@ class RequestHandler(server.SimpleHTTPRequestHandler):
             logger.info(f"Received new pid: {p}, {i}, {d}")
             self.redirectHome()  # return something to let the client know its request is processed
 
+    # Send data to the client as JSON
+    def sendJson(self, data, status=HTTPStatus.OK):
+        # Convert the data to a JSON string
+        response_data = json.dumps(data).encode("utf-8")
+        self.response = Server._response(status, response_data, [("Content-Type", "application/json")])
+
+    # Send an error to the client, the message tells it what went wrong
+    def send_error(self, status, message=None):
+        self.response = Server._error(HTTPStatus(status), message)
+
+    # Send the satellites of the catalogue that are visible, filtered with the query of the url (see Catalogue.visible)
+    def sendSatellites(self):
+        query = parse_qs(urlsplit(self.path).query)
+        try:
+            min_elevation = float(query.get("min_elevation", ["0"])[0])
+            hours = float(query.get("hours", ["0"])[0])
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "min_elevation and hours must be numbers")
+            return
+        self.sendJson(Catalogue.visible(min_elevation, hours,
+                                        name=query.get("name", [None])[0],
+                                        orbit=query.get("class", [None])[0]))
+
+    # Send a time window of the recording (see recorder.py) as a CSV or NumPy (.npz) file
+    # The window is given in the url: /api/recording?start=<unix time>&end=<unix time>&format=csv
+    # Without start, the last 60 seconds are sent
+    def sendRecording(self):
+        if not Dish.recorder:
+            self.send_error(HTTPStatus.NOT_FOUND, "Recorder disabled")
+            return
+        query = parse_qs(urlsplit(self.path).query)
+        try:
+            end = float(query["end"][0]) if "end" in query else None
+            start = float(query["start"][0]) if "start" in query else (end or time.time()) - 60
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "start and end must be numbers")
+            return
+        file_format = query.get("format", ["csv"])[0]
+        if file_format not in ("csv", "npz"):
+            self.send_error(HTTPStatus.BAD_REQUEST, "format must be csv or npz")
+            return
+
+        if file_format == "npz":
+            import numpy as np
+            data = io.BytesIO()
+            np.savez(data, **Dish.recorder.export_numpy(start, end))
+            body = data.getvalue()
+            content_type = "application/octet-stream"
+        else:  # csv
+            body = Dish.recorder.export_csv(start, end).encode("utf-8")
+            content_type = "text/csv"
+
+        self.response = Server._response(HTTPStatus.OK, body, [
+            ("Content-Type", content_type),
+            ("Content-Disposition", f'attachment; filename="recording.{file_format}"'),
+        ])
+
     # return the index.html page
     def redirectHome(self, permanently=False):
         if permanently:
             # this tells the client to not request this anymore but load the homepage from its cache
-            self.send_response(301)
+            status = HTTPStatus.MOVED_PERMANENTLY
         else:
             # this tells the client this was a one off page and request a new one next time
-            self.send_response(302)
-        self.send_header('Location', '/index.html')
-        self.end_headers()
+            status = HTTPStatus.FOUND
+        self.response = Server._response(status, headers=[('Location', '/index.html')])
 
     # the client has requested a page we don't have, so we return 404
     def sendPageNotFound(self):
-        self.send_error(404)
-        self.end_headers()
+        self.send_error(HTTPStatus.NOT_FOUND)
 
-    # Send a file to the client
+    # Send a file to the client, from the copy in memory (see assets.py)
     def sendFile(self, filePath):
-        # This opens a file on the raspberry and sends that to the webpage
         logger.debug("sending file: " + filePath)
-        if not os.path.isfile(filePath):
+        asset = Assets.get(filePath)
+        if asset is None:
             # If the file does not exist, send a warning and redirect to the home page
             logger.warning('File does not exist: ' + filePath)
             self.redirectHome()
             return
 
-        # The built-in class "SimpleHTTPRequestHandler", which this class extends, already has this functionality
-        # This wrapper allows us to have the request path and the file path not be the same, and handle non-existent files correctly as above
-        self.path = filePath
-        # let the built-in class handle the file requests
-        server.SimpleHTTPRequestHandler.do_GET(self)
+        # the compressed variant when the client can read it
+        encoding, body, etag = asset.variant(self.headers.get("accept-encoding"))
+        headers = [
+            ("ETag", etag),
+            ("Last-Modified", asset.last_modified),
+            ("Cache-Control", asset.cache_control),
+            ("Vary", "Accept-Encoding"),
+        ]
+        if asset.not_modified(etag, self.headers.get("if-none-match"), self.headers.get("if-modified-since")):
+            # the client already has this file, it does not have to be sent again
+            self.response = Server._head(HTTPStatus.NOT_MODIFIED, headers)
+            return
+        headers.append(("Content-Type", asset.content_type))
+        if encoding != "identity":
+            headers.append(("Content-Encoding", encoding))
+        self.response = Server._response(HTTPStatus.OK, body, headers)
@@ -0,0 +1,291 @@
+import collections
+import math
+import random
+import threading
+
+from backend import Clock
+from pointing import Pointing
+from sensor import SensorSampler
+from stepper import Stepper
+
+# Simulated versions of the hardware of the dish, used when the program does not run on the raspberry pi (see backend.py).
+# SimPWM replaces the hardware pwm and keeps track of the angle the motor would have turned to,
+# SimBNO055 replaces the position sensor and reports the angles of the simulated motors,
+# SimGPIO replaces the GPIO pins.
+# The Simulation class at the bottom puts these together with two Steppers and a virtual clock,
+# so that an hour of tracking can be simulated in a few seconds, and gives the same result every time.
+
+
+# A clock that only moves when it is told to. Sleeping moves the clock forward instead of waiting.
+class SimClock(Clock):
+    def __init__(self, start=0.0):
+        self.now = start
+        self._lock = threading.Lock()
+
+    def monotonic(self):
+        return self.now
+
+    def monotonic_ns(self):
+        return round(self.now * 1e9)
+
+    # Move the clock forward by a number of seconds
+    def advance(self, seconds):
+        with self._lock:
+            self.now += seconds
+
+    # Move the clock forward to a point in time, if that is not in the past
+    def advance_to(self, time):
+        with self._lock:
+            self.now = max(self.now, time)
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def wait(self, event, timeout):
+        if not event.is_set():
+            self.advance(timeout)
+        return event.is_set()
+
+
+# Replaces the RPi.GPIO module. Only remembers the state of each pin.
+# Other simulated parts can listen to pin changes, the SimPWM uses this to know the direction of the motor
+class SimGPIO():
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self):
+        self.pins = {}
+        self._listeners = collections.defaultdict(list)
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, enabled):
+        pass
+
+    def setup(self, channels, direction, initial=LOW):
+        for channel in self._channels(channels):
+            self.pins[channel] = initial
+
+    def output(self, channels, value):
+        for channel in self._channels(channels):
+            for listener in self._listeners[channel]:
+                listener()  # called before the change, so the listener can finish the old state first
+            self.pins[channel] = value
+
+    def input(self, channel):
+        return self.pins.get(channel, self.LOW)
+
+    def cleanup(self, channels=None):
+        if channels is None:
+            self.pins.clear()
+        else:
+            for channel in self._channels(channels):
+                self.pins.pop(channel, None)
+
+    # Call listener every time the output of a pin is about to change
+    def add_listener(self, channel, listener):
+        self._listeners[channel].append(listener)
+
+    @staticmethod
+    def _channels(channels):
+        if isinstance(channels, (list, tuple)):
+            return channels
+        return [channels]
+
+
+# Replaces rpi_hardware_pwm.HardwarePWM. Instead of sending pulses to the stepper driver,
+# it counts the steps the driver would have made (frequency * time) and turns them into a shaft angle
+# using the resolution and gear ratio of the motor. The direction comes from the dir pin, like on the real driver.
+class SimPWM():
+    def __init__(self, pwm_channel, hz, chip, gpio, dir_pin, enable_pin, clock,
+                 resolution=3200, gear_ratio=(19+(38/187))):
+        self.pwm_channel = pwm_channel
+        self.chip = chip
+        self.gpio = gpio
+        self.dir_pin = dir_pin
+        self.enable_pin = enable_pin
+        self.clock = clock
+        self.resolution = resolution
+        self.gear_ratio = gear_ratio
+
+        self.frequency = hz
+        self.duty_cycle = 0
+        self.running = False
+        self.steps = 0.0  # amount of steps made, negative for counter clockwise
+        self._last_time = clock.monotonic()
+
+        # count the steps up to a pin change before the direction or enable pin changes
+        gpio.add_listener(dir_pin, self._update)
+        gpio.add_listener(enable_pin, self._update)
+
+    # The angle of the shaft after the gearbox in degrees
+    @property
+    def angle(self):
+        self._update()
+        return self.steps / (self.resolution * self.gear_ratio) * 360
+
+    def start(self, initial_duty_cycle):
+        self._update()
+        self.duty_cycle = initial_duty_cycle
+        self.running = True
+
+    def stop(self):
+        self._update()
+        self.running = False
+
+    def change_duty_cycle(self, duty_cycle):
+        self._update()
+        self.duty_cycle = duty_cycle
+
+    def change_frequency(self, hz):
+        if hz < 1:
+            raise ValueError("Frequency must be at least 1 Hz")
+        self._update()
+        # the hardware runs at a whole amount of nanoseconds per period, like rpi_hardware_pwm writes it
+        self.frequency = 1e9 / int(1e9 / hz)
+
+    # Add the steps made since the last update
+    def _update(self):
+        now = self.clock.monotonic()
+        dt = now - self._last_time
+        self._last_time = now
+        if not self.running or self.gpio.input(self.enable_pin) != self.gpio.HIGH:
+            return
+        # the motor turns clockwise (positive) when the dir pin is low, see Stepper._set_speed
+        direction = 1 if self.gpio.input(self.dir_pin) == self.gpio.LOW else -1
+        self.steps += direction * self.frequency * dt
+
+
+# Replaces adafruit_bno055.BNO055_I2C. Reports the angles of the simulated motors as euler angles.
+# noise is the standard deviation of the random noise added to each angle (in degrees)
+# latency is how old the reported angles are (in seconds)
+class SimBNO055():
+    def __init__(self, clock, noise=0.0, latency=0.0, seed=0, calibration_status=(3, 3, 3, 3)):
+        self.clock = clock
+        self.noise = noise
+        self.latency = latency
+        self.calibration_status = calibration_status
+        self.axes = {}  # simulated motors by axis name
+        self._random = random.Random(seed)
+        self._history = collections.deque()  # (time, azimuth, elevation) for the latency
+
+    # Connect a simulated motor to an axis of the sensor, "azimuth" or "elevation"
+    def attach(self, axis, pwm):
+        self.axes[axis] = pwm
+
+    def _angle(self, axis):
+        pwm = self.axes.get(axis)
+        return pwm.angle if pwm else 0.0
+
+    # The true angles of the motors, delayed by the latency
+    def _angles(self):
+        now = self.clock.monotonic()
+        angles = (self._angle("azimuth"), self._angle("elevation"))
+        if self.latency <= 0:
+            return angles
+        self._history.append((now, *angles))
+        # drop everything older than the latency, except the newest sample that is old enough
+        while len(self._history) > 1 and self._history[1][0] <= now - self.latency:
+            self._history.popleft()
+        return self._history[0][1:]
+
+    @property
+    def euler(self):
+        azimuth, elevation = self._angles()
+        azimuth += self._random.gauss(0, self.noise) if self.noise else 0
+        elevation += self._random.gauss(0, self.noise) if self.noise else 0
+        heading = azimuth % 360
+        roll = (elevation + 180) % 360 - 180
+        return (heading, roll, 0.0)
+
+    # Quaternion (w, x, y, z) of a rotation of heading around z followed by roll around x
+    @property
+    def quaternion(self):
+        heading, roll, pitch = self.euler
+        h = math.radians(heading) / 2
+        r = math.radians(roll) / 2
+        return (math.cos(h) * math.cos(r),
+                math.cos(h) * math.sin(r),
+                math.sin(h) * math.sin(r),
+                math.sin(h) * math.cos(r))
+
+
+# The whole dish in simulation: two Steppers driving simulated motors, read by a simulated sensor,
+# all running on a virtual clock in a single thread. The control loops are ticked by the simulation
+# instead of by their own threads, so every run gives exactly the same result.
+class Simulation():
+    def __init__(self, pid_rate=1000, sensor_rate=100, noise=0.0, latency=0.0, seed=0,
+                 tunings=(-1, 0, -2.5)):
+        self.clock = SimClock()
+        self.gpio = SimGPIO()
+        self.sensor = SimBNO055(self.clock, noise=noise,
+                                latency=latency, seed=seed)
+        self.sampler = SensorSampler(
+            self.sensor, rate=sensor_rate, clock=self.clock.monotonic)
+        self.sampler.poll()
+
+        self.pointing = Pointing(self.sampler)
+        self.azimuth_motor = self._create_motor(
+            "azimuth", 0, pwm_channel=2, dir_pin=4, enable_pin=22)
+        self.elevation_motor = self._create_motor(
+            "elevation", 1, pwm_channel=3, dir_pin=17, enable_pin=23)
+        self.motors = [self.azimuth_motor, self.elevation_motor]
+        self.pointing.attach(self.azimuth_motor, self.elevation_motor)
+        for motor in self.motors:
+            motor.set_pid_delay(1 / pid_rate)
+            motor.tune(*tunings)
+
+        self._next_sample = self.clock.now + 1 / self.sampler.rate
+
+    def _create_motor(self, axis, index, pwm_channel, dir_pin, enable_pin):
+        pwm = SimPWM(pwm_channel=pwm_channel, hz=1, chip=2, gpio=self.gpio,
+                     dir_pin=dir_pin, enable_pin=enable_pin, clock=self.clock)
+        self.sensor.attach(axis, pwm)
+        motor = Stepper(
+            dir_pin=dir_pin,
+            enable_pin=enable_pin,
+            pwm=pwm,
+            position_callback=lambda: self.pointing.angles()[index],
+            position_time_callback=lambda: self.sampler.latest.timestamp,
+            gpio=self.gpio,
+            clock=self.clock,
+        )
+        motor.control_loop.manual = True  # ticked by the simulation instead of its own thread
+        return motor
+
+    # Put the simulated motors at an angle (in degrees), without them having to move there
+    def set_position(self, azimuth, elevation):
+        for motor, angle in ((self.azimuth_motor, azimuth), (self.elevation_motor, elevation)):
+            motor.pwm.steps = angle / 360 * motor.pwm.resolution * motor.pwm.gear_ratio
+        self.sampler.poll()
+
+    # The true angles of the motors in degrees, without sensor noise or latency
+    def true_position(self):
+        return (self.azimuth_motor.pwm.angle, self.elevation_motor.pwm.angle)
+
+    # Move the clock to the next thing that has to happen (a sensor reading or a pid tick) and run it
+    def step(self):
+        loops = [motor.control_loop for motor in self.motors if motor.do_pid]
+        next_time = min([self._next_sample] + [loop.deadline for loop in loops])
+        self.clock.advance_to(next_time)
+
+        if self.clock.now >= self._next_sample:
+            self.sampler.poll()
+            self._next_sample += 1 / self.sampler.rate
+        for loop in loops:
+            if self.clock.now >= loop.deadline:
+                loop.tick()
+
+    # Run the simulation for a number of (virtual) seconds
+    # callback is called after every step with the simulation as argument
+    def run(self, duration, callback=None):
+        end = self.clock.now + duration
+        while self.clock.now < end:
+            self.step()
+            if callback:
+                callback(self)
@@ -2,13 +2,11 @@ import math
 import threading
 import queue
 import logging
-import multiprocessing
-import time
-from adafruit_bno055 import BNO055_I2C
 from simple_pid import PID
 from config import Config
-from RPi import GPIO
-from rpi_hardware_pwm import HardwarePWM
+from backend import Backend, Clock
+from control_loop import ControlLoop
+import motion
 
 logger = logging.getLogger(__name__)
 
@@ -32,14 +30,29 @@ class Stepper():
     gear_ratio: float  # Ratio of the gearbox. Used to convert angles to amount of steps
     # Microstepping setting of motordriver (see stepper driver datasheet). Is the amount of steps in one motor revolution, ignoring the gearbox
     resolution: int
+    # Conversion factors between steps and degrees, calculated from the resolution and gear ratio when they are set
+    steps_per_degree: float
+    degrees_per_step: float
 
-    pwm: HardwarePWM  # Pulse Width Modulation library. Used to drive the step pin of the stepper driver at high and consistent rates
+    pwm: any  # Pulse Width Modulation library (HardwarePWM, or SimPWM in simulation). Used to drive the step pin of the stepper driver at high and consistent rates
+    gpio: any  # GPIO library used for the dir and enable pins, RPi.GPIO or a simulated version. See backend.py
+    clock: Clock  # Clock used for timing, the real time or a simulated clock. See backend.py
 
     # How long the pid controller should wait before updating again (in seconds)
-    pid_delay = 0.0001
+    # The control loop runs at 1/pid_delay Hz. Use set_pid_delay to change it during runtime
+    pid_delay = 0.001
+    control_loop: ControlLoop  # Long-lived thread that runs _calc_pid every pid_delay
     # Callback function used to get the current position of the motor. Is set Dish._setup_motors.
     # Should return the axis of the position sensor that belongs to this motor
     position_callback: any
+    # Optional callback that returns the clock time at which the position was measured.
+    # With a moving goal, the position is compared to where the goal was at that time, not to where it is now.
+    # Otherwise the goal runs ahead of the position between two sensor readings, which the pid sees as a growing error
+    position_time_callback: any
+    # Optional callback that returns the error (goal - position) in degrees, already wrapped the short way around.
+    # Set by Pointing.attach (see pointing.py), which calculates it from the quaternion of the sensor for both motors at once.
+    # When it is set, distance uses it instead of comparing position_callback to the goal
+    error_callback: any
 
     # PID controller variables:
     pid: PID  # Instance of PID library
@@ -49,9 +62,27 @@ class Stepper():
     max_velocity: float  # steps per second
     # current acceleration and velocity used by the pid controller
     acceleration: float  # steps per second^2
-    velocity: float  # steps per second
+    velocity: float  # steps per second, the sum of the correction and the feed-forward
+    correction: float  # steps per second, the part of the velocity integrated from the pid output
     # Position that the pid controller tries to achieve
     goal: int  # steps
+    # Speed at which the goal moves (steps per second), for moving targets like satellites. See set_trajectory
+    # It is added to the velocity directly (feed-forward), so the pid only has to correct the remaining error
+    goal_rate: float
+    goal_time: float  # clock time at which the goal was set, the goal moves on from there with goal_rate
+
+    # Frequency changes (in Hz) smaller than this are not written to the pwm, see _write_frequency
+    frequency_deadband = 1.0
+
+    # Whole steps sent to the motor driver, negative for counter clockwise. See _count_steps
+    commanded_steps: int
+    # When the latest sensor sample is older than this (in seconds), the position is estimated from the steps
+    # sent to the motor since that sample (dead reckoning), see _dead_reckoning
+    stale_after = 0.05
+    dead_reckoning: bool  # True when the last distance was estimated because the sample was stale
+
+    # Shape of the speed up and slow down of moves without pid control, "trapezoid" or "s-curve". See motion.py
+    move_shape = "trapezoid"
 
     # get the position indicated by the sensor using the position_callback defined in Dish._setup_motors
     @property
@@ -71,34 +102,129 @@ class Stepper():
             self.stop_pid()
             return 0
 
+    # get the goal at this moment, which moves with goal_rate since it was set
+    @property
+    def current_goal(self):
+        return self.goal_at(self.clock.monotonic())
+
+    # get the goal at a clock time
+    def goal_at(self, at):
+        if not self.goal_rate:
+            return self.goal
+        return self.goal + self.goal_rate * (at - self.goal_time)
+
     # get the distance from the current position to the goal
     @property
-    def distance(self) -> int:
-        position = self.sensor_position / 360 * \
-            self.steps_per_rev  # convert from degrees to steps
-        # make the value between 0 and 360 degrees (in steps)
-        distance = (self.goal - position) % self.steps_per_rev
-        # make the value between -180 and 180 degrees (in steps)
-        if distance > self.steps_per_rev / 2:
-            distance -= self.steps_per_rev
-        return distance
+    def distance(self) -> float:
+        sample_time = self.position_time_callback() if self.position_time_callback else None
+        if self.error_callback:
+            distance = self.error_callback() * self.steps_per_degree  # convert from degrees to steps
+        else:
+            position = self.sensor_position * self.steps_per_degree  # convert from degrees to steps
+            if sample_time is not None:
+                goal = self.goal_at(sample_time)  # where the goal was when the position was measured
+            else:
+                goal = self.current_goal
+            # make the value between 0 and 360 degrees (in steps)
+            distance = (goal - position) % self._steps_per_rev
+            # make the value between -180 and 180 degrees (in steps)
+            if distance > self._steps_per_rev / 2:
+                distance -= self._steps_per_rev
+        return distance + self._dead_reckoning(sample_time)
+
+    # Correction of the distance (in steps) for the time since the sample was measured, 0 while the samples are fresh.
+    # When the sensor stops delivering, the steps sent to the motor since the last sample show how far it moved.
+    # This is only as good as the motor following its steps, so it is a fallback until the sensor is back
+    def _dead_reckoning(self, sample_time):
+        if sample_time is None:
+            return 0
+        steps = self.step_count()
+        if sample_time != self._sample_time:  # a new sample, it already contains the steps made until now
+            self._sample_time = sample_time
+            self._sample_steps = steps
+        self.dead_reckoning = self.clock.monotonic() - sample_time > self.stale_after
+        if not self.dead_reckoning:
+            return 0
+        # the goal moved on since the sample, and the motor made steps towards it
+        return self.current_goal - self.goal_at(sample_time) - (steps - self._sample_steps)
+
+    # get the position in degrees estimated from the last sample and the steps made since it was measured
+    @property
+    def estimated_position(self):
+        if self._sample_time is None:
+            return self.sensor_position
+        return self.sensor_position + (self.step_count() - self._sample_steps) * self.degrees_per_step
+
+    # get the goal of the pid controller in degrees
+    @property
+    def goal_degrees(self):
+        return self.current_goal * self.degrees_per_step
 
     # get the amount of steps required for one full revolution
     @property
     def steps_per_rev(self):
-        return self.resolution * self.gear_ratio
+        return self._steps_per_rev
+
+    @property
+    def resolution(self):
+        return self._resolution
+
+    @resolution.setter
+    def resolution(self, resolution):
+        self._resolution = resolution
+        self._update_conversion()
+
+    @property
+    def gear_ratio(self):
+        return self._gear_ratio
+
+    @gear_ratio.setter
+    def gear_ratio(self, gear_ratio):
+        self._gear_ratio = gear_ratio
+        self._update_conversion()
+
+    # Calculate the conversion factors once, instead of every time they are used
+    def _update_conversion(self):
+        self._steps_per_rev = self._resolution * self._gear_ratio
+        self.steps_per_degree = self._steps_per_rev / 360
+        self.degrees_per_step = 360 / self._steps_per_rev
 
     # Return a nice formatted string containing all the information when printing the class to the terminal or logs
     def __str__(self):
+        stats = self.control_loop.stats()
         return \
             f"a: {self.acceleration:.4f}\n" + \
             f"v: {self.velocity:.4f}\n" + \
             f"position: {self.sensor_position}\n" + \
-            f"goal: {self.goal}\n" + \
+            f"goal: {self.current_goal}\n" + \
+            f"goal rate: {self.goal_rate}\n" + \
             f"pid enabled: {self.do_pid}\n" + \
             f"pid tunings: {self.pid.tunings}\n" + \
+            f"pid loop: {stats['achieved_rate']:.0f}/{stats['target_rate']:.0f} Hz, " + \
+            f"jitter: {stats['jitter'] * 1000:.3f} ms, missed: {stats['missed']}\n" + \
             ""
 
+    # Return the current state of the motor as a dictionary, used for the telemetry sent to the web interface
+    def state(self):
+        return {
+            "position": self.sensor_position,
+            "goal": self.goal_degrees,
+            "goal_rate": self.goal_rate * self.degrees_per_step,
+            "estimated_position": self.estimated_position,
+            "dead_reckoning": self.dead_reckoning,
+            "commanded_steps": self.step_count(),
+            "velocity": self.velocity,
+            "feed_forward_steps": self.goal_rate,  # the part of the velocity (steps/s) from the goal rate
+            "acceleration": self.acceleration,
+            "pid": {
+                "enabled": self.do_pid,
+                "tunings": self.pid.tunings,
+                "components": self.pid.components,
+                "loop": self.control_loop.stats(),
+            },
+            "hardware_writes": self.write_stats(),
+        }
+
     # This creates an instance of the stepper class. It is run in Dish._setup_motors as "Stepper()". Once for each motor
     def __init__(
         self,
@@ -106,27 +232,52 @@ class Stepper():
         enable_pin,
         pwm,
         position_callback,
+        position_time_callback=None,
+        error_callback=None,
         resolution=3200,
         gear_ratio=(19+(38/187)),
+        gpio=None,
+        clock=None,
     ):
         logger.info("Creating Stepper")
 
+        # Use the GPIO library and clock of the backend, unless others are given (like in the simulation)
+        self.gpio = gpio or Backend.GPIO
+        self.clock = clock or Backend.clock
+
         # Define Pins
         # Transfer the arguments of this function to properties of the class
         self.dir_pin = dir_pin
         self.enable_pin = enable_pin
         self.pwm = pwm
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup([dir_pin, enable_pin], GPIO.OUT)  # configure pins as output
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setup([dir_pin, enable_pin], self.gpio.OUT)  # configure pins as output
+
+        # Keep track of what has been written to the hardware, to skip writes that change nothing
+        self.writes_issued = 0
+        self.writes_suppressed = 0
+        self._reset_hardware_state()
+
+        # Count the steps sent to the motor driver, see _count_steps
+        self.commanded_steps = 0
+        self._count_time = self.clock.monotonic_ns()
+        self._count_phase = 0
+        self._period = None
+        self.dead_reckoning = False
+        self._sample_time = None  # time of the last sample seen by _dead_reckoning
+        self._sample_steps = 0  # step count when that sample was seen
 
         # Motor properties
-        self.gear_ratio = gear_ratio
-        self.resolution = resolution
+        self._gear_ratio = gear_ratio
+        self._resolution = resolution
+        self._update_conversion()
 
         # Setup the thread and queue that will run the motor.
         # The thread ensures that when the motor is waiting for its movement order to finish, it only blocks its own thread not the whole program.
         # The queue is the way of communicating between the main program and the thread
         self.job_queue = queue.Queue()
+        # Set to abort the current movement and all the movements in the queue, see abort_moves
+        self._abort_move = threading.Event()
         self.worker_thread = threading.Thread(target=self._worker)
         # Ensure the thread also exits when the main program exits
         self.worker_thread.daemon = True
@@ -137,13 +288,24 @@ class Stepper():
         self.max_acceleration = 2000
         self.max_velocity = 100000
         self.position_callback = position_callback
+        self.position_time_callback = position_time_callback
+        self.error_callback = error_callback
         self.acceleration = 0
         self.velocity = 0
+        self.correction = 0
         self.goal = 0
+        self.goal_rate = 0
+        self.goal_time = 0
         self.distance_sum = 0
         self._last_time = 0
         self.pid = PID(0, 0, 0, sample_time=None,
                        output_limits=(-self.max_acceleration, self.max_acceleration))
+        self._pending_settings = None  # settings waiting for the next pid tick, see configure
+        self._settings_lock = threading.Lock()
+
+        # Setup the control loop that runs the pid controller. It is paused until start_pid is called
+        self.control_loop = ControlLoop(
+            self._calc_pid, 1 / self.pid_delay, name=f"pid-{dir_pin}", clock=self.clock.monotonic)
 
     # This is what the thread is doing
     def _worker(self):
@@ -152,8 +314,28 @@ class Stepper():
             args = self.job_queue.get()  # Get the next job
             if args is None:  # no arguments = Stop signal
                 break
-            self.do_steps(*args)  # move the motor with the args from the queue
-            self.job_queue.task_done()  # Signal that the job is done
+            try:
+                self._move(*args)  # move the motor with the args from the queue
+            except Exception as e:
+                logger.error(f"Movement failed: {e}")
+            finally:
+                self.job_queue.task_done()  # Signal that the job is done
+
+    # True when all the movements ordered with do_steps_sync are done
+    @property
+    def idle(self):
+        return self.job_queue.unfinished_tasks == 0
+
+    # Stop the current movement and drop all the movements waiting in the queue
+    def abort_moves(self):
+        logger.debug("aborting movements")
+        try:
+            while True:
+                self.job_queue.get_nowait()
+                self.job_queue.task_done()
+        except queue.Empty:
+            pass
+        self._abort_move.set()
 
     # move the motor to "zero" position
     def zero(self):
@@ -169,71 +351,171 @@ class Stepper():
     def stop(self):
         logger.debug("stopping motor")
         self.velocity = 0  # reset velocity for pid controller
+        self.correction = 0
 
         # stop the pwm controller
-        self.pwm.change_frequency(1)  # frequency 0 hz is not allowed
-        self.pwm.stop()
+        self._write_frequency(1, force=True)  # frequency 0 hz is not allowed
+        self._write_running(False, force=True)
 
         # pull the enable pin low to disable the stepper
-        GPIO.output(self.enable_pin, GPIO.LOW)
+        self._write_enable(self.gpio.LOW, force=True)
 
     # Disable the motor. Only when program exits, cannot start motor again
     def disable(self):
         self.stop_pid()  # stop the pid
         self.stop()  # stop the motor
         # remove the pin associations
-        GPIO.cleanup([self.enable_pin, self.dir_pin])
+        self.gpio.cleanup([self.enable_pin, self.dir_pin])
+        self._reset_hardware_state()
 
     # Sets the pwm to the given speed, handles the direction pin for negative values.
     # Setting to zero velocity stops the motor without it jerking (the stop method does jerk)
+    # Only the pins and pwm settings that actually change are written to the hardware, see _write_enable and the others.
+    # Returns the velocity the motor is actually running at
     def _set_speed(self, velocity: float):
         # Check if the pwm is configured, skip if it isn't
         if self.pwm == None:
             logger.error("No pwm configured!")
-            return
+            return 0
 
-        logger.debug(f"Setting pwm: {velocity}")
+        # This runs every pid tick, so use lazy formatting (the message is only built when it is logged)
+        logger.debug("Setting pwm: %s", velocity)
         # Set enable pin high to enable the stepper
-        GPIO.output(self.enable_pin, GPIO.HIGH)
+        self._write_enable(self.gpio.HIGH)
 
         # Check if stopping, clockwise or counterclockwise
-        if velocity == 0:
-            self.pwm.stop()
-        elif velocity > 1:  # pwm frequency cannot be lower than 1
-            GPIO.output(self.dir_pin, GPIO.LOW)
-            self.pwm.start(50)  # duty cycle of 50%
-            self.pwm.change_frequency(velocity)
+        if velocity > 1:  # pwm frequency cannot be lower than 1
+            self._write_direction(self.gpio.LOW)
+            self._write_running(True)
+            return self._write_frequency(velocity)
         elif velocity < -1:
-            GPIO.output(self.dir_pin, GPIO.HIGH)
-            self.pwm.start(50)
-            self.pwm.change_frequency(-velocity)
-        else:  # velocities between -1 and 1, and other values
+            self._write_direction(self.gpio.HIGH)
+            self._write_running(True)
+            return -self._write_frequency(-velocity)
+        else:  # zero, velocities between -1 and 1, and other values
+            self._write_running(False)
+            return 0
+
+    # The last values written to the hardware. None means unknown, so the next write always goes through
+    def _reset_hardware_state(self):
+        self._enable_state = None
+        self._direction_state = None
+        self._running_state = None
+        self._frequency_state = None
+
+    # Write the enable pin, unless it already has this value (or force is true)
+    def _write_enable(self, value, force=False):
+        if value == self._enable_state and not force:
+            self.writes_suppressed += 1
+            return
+        self._count_steps()
+        self.gpio.output(self.enable_pin, value)
+        self._enable_state = value
+        self.writes_issued += 1
+
+    # Write the direction pin, unless it already has this value
+    def _write_direction(self, value):
+        if value == self._direction_state:
+            self.writes_suppressed += 1
+            return
+        self._count_steps()
+        self.gpio.output(self.dir_pin, value)
+        self._direction_state = value
+        self.writes_issued += 1
+
+    # Start or stop the pwm, unless it already is in that state
+    def _write_running(self, running, force=False):
+        if running == self._running_state and not force:
+            self.writes_suppressed += 1
+            return
+        self._count_steps()
+        if running:
+            self.pwm.start(50)  # duty cycle of 50%
+        else:
             self.pwm.stop()
+        self._running_state = running
+        self.writes_issued += 1
+
+    # Change the pwm frequency, unless it differs less than frequency_deadband from the current frequency
+    # Returns the frequency the pwm is running at
+    def _write_frequency(self, frequency, force=False):
+        if self._frequency_state is not None and not force and \
+                abs(frequency - self._frequency_state) <= self.frequency_deadband:
+            self.writes_suppressed += 1
+            return self._frequency_state
+        self._count_steps()
+        self.pwm.change_frequency(frequency)
+        self._frequency_state = frequency
+        # the pwm hardware runs at a whole amount of nanoseconds per period (the same rounding as rpi_hardware_pwm)
+        period = int(1e9 / frequency)
+        if self._period is not None:
+            # the time into the current period, as the same fraction of the new period.
+            # Carried over as it is, half a slow period would be many steps of a fast one
+            self._count_phase = self._count_phase * period // self._period
+        self._period = period
+        self.writes_issued += 1
+        return frequency
+
+    # True when the driver is getting steps: enabled, and the pwm is running at a known frequency
+    @property
+    def _stepping(self):
+        return self._running_state and self._enable_state == self.gpio.HIGH and self._period is not None
+
+    # Steps made since the last count, and the time (ns) into the period of the next step
+    def _pending_steps(self, now):
+        if not self._stepping:
+            return 0, 0  # the pwm starts a new period when it starts running
+        steps, phase = divmod(now - self._count_time + self._count_phase, self._period)
+        return (steps if self._direction_state == self.gpio.LOW else -steps), phase
+
+    # Add the steps made since the last count to commanded_steps. Called before anything that changes the steps,
+    # so every stretch of time is counted with the frequency, direction and state it had.
+    # Only whole periods of the pwm count as a step, the rest of the time is kept (in integer nanoseconds)
+    # and counted with the next stretch, so the count never drifts
+    def _count_steps(self):
+        now = self.clock.monotonic_ns()
+        steps, self._count_phase = self._pending_steps(now)
+        self.commanded_steps += steps
+        self._count_time = now
+
+    # The amount of steps sent to the motor driver until now
+    def step_count(self):
+        return self.commanded_steps + self._pending_steps(self.clock.monotonic_ns())[0]
+
+    # Amount of hardware writes done and skipped because nothing changed
+    def write_stats(self):
+        return {
+            "issued": self.writes_issued,
+            "suppressed": self.writes_suppressed,
+        }
 
     # Do a specific amount of steps without pid control. Negative steps for other direction
     def do_steps(self, step_count, velocity=1000, *args):
+        self._abort_move.clear()  # a new order, so forget about earlier aborts
+        self._move(step_count, velocity)
+
+    # Perform a movement for do_steps. Stops early when abort_moves is called
+    # The motor speeds up and slows down with max_acceleration, and cruises at velocity (steps per second)
+    def _move(self, step_count, velocity=1000, *args):
         # check if pid is running
         if self.do_pid:
             logger.warning(
                 f"Trying to do steps while pid is active, ignoring step command")
             return
-        duration = abs(step_count/velocity)  # calculate the time required
+        if self._abort_move.is_set() or step_count == 0:
+            return
 
-        logger.debug(f"Doing {step_count} steps. Will take {duration} seconds")
-        GPIO.output(self.enable_pin, GPIO.HIGH)  # enable the stepper
-
-        if step_count > 0:  # set the velocity to have the same sign as the step count
-            velocity = abs(velocity)
-        else:
-            velocity = -abs(velocity)
+        plan = motion.plan_moves(
+            [(step_count,)], [(abs(velocity), self.max_acceleration)], self.move_shape)
+        logger.debug(
+            f"Doing {step_count} steps. Will take {plan.duration} seconds")
 
         # perform the movement:
-        self._set_speed(velocity)
-        time.sleep(duration)
-        self._set_speed(0)
+        motion.execute(plan, [self], self.clock, abort=self._abort_move)
 
     # do_steps, but ordered to the thread instead of the main program
     def do_steps_sync(self, *args):
+        self._abort_move.clear()  # a new order, so forget about earlier aborts
         self.job_queue.put(args)
 
     # Move a specific angle in degrees or radians. It converts to steps and then calls do_steps
@@ -245,7 +527,7 @@ class Stepper():
         elif radians:
             rev = radians / (2*math.pi)
 
-        steps = rev * self.steps_per_rev  # convert to amount of steps
+        steps = round(rev * self._steps_per_rev)  # convert to amount of steps, the driver only makes whole steps
         self.do_steps(steps)  # call do_steps
         duration = steps * 1000
         return duration  # return amount of time required (used for testing)
@@ -258,7 +540,7 @@ class Stepper():
         elif radians:
             rev = radians / (2*math.pi)
 
-        steps = rev * self.steps_per_rev
+        steps = round(rev * self._steps_per_rev)
         self.do_steps_sync(steps)
         duration = steps * 1000
         return duration
@@ -278,15 +560,63 @@ class Stepper():
         elif radians:
             target_rev = radians / (2*math.pi)
 
-        # convert to steps and set pid goal
-        self.goal = target_rev * self.steps_per_rev
+        # convert to steps and set pid goal, a fixed target does not move
+        self.goal = target_rev * self._steps_per_rev
+        self.goal_rate = 0
+
+    # Set a moving target for the pid controller: the position in degrees now, and the speed it moves at in degrees per second
+    # The motor follows the target with the speed as feed-forward, the pid only corrects the remaining error
+    def set_trajectory(self, degrees, rate):
+        self.goal_time = self.clock.monotonic()
+        self.goal = degrees * self.steps_per_degree
+        self.goal_rate = rate * self.steps_per_degree
+
+    # Stop a moving target where it is now, the pid controller keeps the motor there
+    def hold(self):
+        self.goal = self.current_goal
+        self.goal_rate = 0
+
+    # Move the target of the pid controller by an amount of degrees, keeping the speed of a moving target
+    def offset_target(self, degrees):
+        self.goal += degrees * self.steps_per_degree
+
+    # Use the settings of a tracking profile (see Config.getProfile): pid tunings, loop rate (Hz),
+    # max velocity (steps per second) and max acceleration (steps per second^2).
+    # While the pid is running they are applied together at the start of its next tick, so no tick uses half of them
+    def configure(self, tunings, rate, max_velocity, max_acceleration):
+        with self._settings_lock:
+            self._pending_settings = (tunings, rate, max_velocity, max_acceleration)
+        if not self.do_pid:
+            self._apply_settings()
+
+    def _apply_settings(self):
+        with self._settings_lock:
+            settings, self._pending_settings = self._pending_settings, None
+        if settings is None:
+            return
+        tunings, rate, max_velocity, max_acceleration = settings
+        self.tune(*tunings)
+        self.set_pid_delay(1 / rate)
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        self.pid.output_limits = (-max_acceleration, max_acceleration)
+
+    # Change how often the pid controller updates (in seconds). Can be done while the pid is running
+    def set_pid_delay(self, delay):
+        self.pid_delay = delay
+        self.control_loop.rate = 1 / delay
+
+    # Statistics of the control loop: target and achieved rate, jitter and missed ticks
+    def pid_stats(self):
+        return self.control_loop.stats()
 
     # start the pid controller
     def start_pid(self):
         # set the last time to now. prevents the pid from doing a huge timestep
-        self._last_time = time.monotonic()
+        self._last_time = self.clock.monotonic()
         self.do_pid = True
-        self._calc_pid()  # start the pid cycle (_calc_pid calls itself after pid_delay)
+        self.control_loop.reset_stats()
+        self.control_loop.start()  # start the pid cycle (the control loop calls _calc_pid every pid_delay)
 
     # Stop the pid controller
     def stop_pid(self):
@@ -294,6 +624,7 @@ class Stepper():
         self._last_time = 0  # reset the time used for dt calculation
         # do_pid is checked every time in the _calc_pid cycle. Setting to false stops the cycle
         self.do_pid = False
+        self.control_loop.stop()
 
     # Calculates and sets the current velocity using the pid controller
     def _calc_pid(self):
@@ -301,25 +632,24 @@ class Stepper():
         if not self.do_pid:
             logger.debug("PID DISABLED")
             return
+        if self._pending_settings is not None:  # a new profile, see configure
+            self._apply_settings()
 
         # update time
-        now = time.monotonic()
+        now = self.clock.monotonic()
         dt = now - self._last_time
         self._last_time = now
 
         # update dynamics
-        self.acceleration = self.pid(self.distance)  # pid calculation
-        self.velocity += self.acceleration * dt
+        # pid calculation, with the time step of our own clock (the pid library would use the real time, also in simulation)
+        self.acceleration = self.pid(self.distance, dt=dt if dt > 0 else None)
+        self.correction += self.acceleration * dt
+        self.correction = max(-self.max_velocity,
+                              min(self.max_velocity, self.correction))  # clamp the correction
+        # add the speed of the target (feed-forward), so the pid does not have to catch up with a moving target
         self.velocity = max(-self.max_velocity,
-                            min(self.max_velocity, self.velocity))  # clamp the velocity
-        logger.debug(f"calc pid: {self.velocity}"
-                     f"dt: {dt}")
+                            min(self.max_velocity, self.correction + self.goal_rate))  # clamp the velocity
+        logger.debug("calc pid: %s dt: %s", self.velocity, dt)
         # set the speed of the motor to calculated value
+        # The control loop calls this again after pid_delay
         self._set_speed(self.velocity)
-
-        # Run again after pid_delay. Runs in separate thread to not block main program
-        timer = threading.Timer(
-            self.pid_delay,
-            self._calc_pid)
-        timer.daemon = True  # Makes sure the timer stops when the process ends/crashes
-        timer.start()
@@ -0,0 +1,96 @@
+import json
+import logging
+import threading
+
+from control_loop import ControlLoop
+from dish import Dish
+from tracker import Tracker
+
+logger = logging.getLogger(__name__)
+
+# This class pushes the state of the dish to every connected web interface.
+# One thread builds a telemetry frame at a fixed rate and encodes it once.
+# Each connected client (see Server._stream in server.py) is woken up by a listener when there is a new frame
+# and writes it to its socket, so every extra client only costs one socket write per frame.
+# The frames use the Server-Sent Events format, which browsers can read with EventSource (see index.js).
+# As there is only one telemetry feed, all methods are static.
+
+
+class Telemetry():
+    rate = 10  # frames per second
+    clients = 0  # amount of connected clients, no frames are built when nobody is listening
+    frame = b""  # latest encoded frame
+    sequence = 0  # increases by one for every frame, used by clients to detect a new frame
+    _lock = threading.Lock()
+    _listeners = []  # called after every new frame and when the telemetry stops, see Telemetry.listen
+    _loop: ControlLoop
+
+    # Start building frames at the given rate (in Hz)
+    @staticmethod
+    def start(rate=None):
+        if rate:
+            Telemetry.rate = rate
+        logger.info(f"Starting telemetry at {Telemetry.rate} Hz")
+        Telemetry._loop = ControlLoop(
+            Telemetry._publish, Telemetry.rate, name="telemetry")
+        Telemetry._loop.start()
+
+    # True while frames are being built
+    @staticmethod
+    def running():
+        return hasattr(Telemetry, "_loop") and Telemetry._loop.running
+
+    @staticmethod
+    def stop():
+        try:
+            Telemetry._loop.stop()
+        except AttributeError:
+            return
+        # wake up all the clients so they can close their connection
+        Telemetry._notify()
+
+    # Call listener (without arguments) after every new frame, from the telemetry thread.
+    # The server uses this to wake up the streams in its event loop
+    @staticmethod
+    def listen(listener):
+        Telemetry._listeners.append(listener)
+
+    @staticmethod
+    def _notify():
+        for listener in Telemetry._listeners:
+            try:
+                listener()
+            except Exception as e:  # like an event loop that has stopped already
+                logger.debug(f"telemetry listener failed: {e}")
+
+    # Register a new client, called when a web interface connects to the stream
+    @staticmethod
+    def subscribe():
+        with Telemetry._lock:
+            Telemetry.clients += 1
+
+    # Remove a client, called when a web interface disconnects
+    @staticmethod
+    def unsubscribe():
+        with Telemetry._lock:
+            Telemetry.clients -= 1
+
+    # Build a new frame and wake up all the clients
+    @staticmethod
+    def _publish():
+        if Telemetry.clients == 0:
+            return
+        data = Dish.telemetry()
+        data["tracking"] = Tracker.state()
+        data = json.dumps(data)
+        frame = f"data: {data}\n\n".encode("utf-8")
+        with Telemetry._lock:
+            Telemetry.frame = frame
+            Telemetry.sequence += 1
+        Telemetry._notify()
+
+    # The newest frame and its sequence number
+    @staticmethod
+    def latest():
+        with Telemetry._lock:
+            return Telemetry.sequence, Telemetry.frame
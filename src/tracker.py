@@ -0,0 +1,89 @@
+import logging
+import time
+
+from catalogue import Catalogue
+from config import Config
+from control_loop import ControlLoop
+from dish import Dish
+
+logger = logging.getLogger(__name__)
+
+# Makes the dish follow a satellite.
+# A few times per second it calculates where the selected satellite is in the sky (see ephemeris.py)
+# and gives that position, and the speed the satellite moves at, to the pid controllers with Dish.set_trajectory.
+# With the speed the motors move along with the satellite between two updates, instead of lagging behind (feed-forward).
+# The satellites come from the catalogue (see catalogue.py).
+# As there is only one dish to point, all methods are static.
+
+
+class Tracker():
+    target = None  # NORAD id of the satellite being tracked, None when not tracking
+    status = "idle"  # idle, tracking or below horizon
+    azimuth = None  # last calculated position of the target in degrees
+    elevation = None
+    _loop: ControlLoop = None
+    # Time step (seconds) used to calculate the speed of the satellite from two positions
+    rate_step = 1.0
+
+    # Prepare the tracking loop, run on startup after the catalogue is loaded
+    @staticmethod
+    def start():
+        Tracker._loop = ControlLoop(
+            Tracker._update, Config.getTrackRate(), name="tracker")
+
+    # Start following a satellite
+    # used by webinterface in server.py at RequestHandler.do_POST
+    @staticmethod
+    def track(norad):
+        Catalogue.get(norad)  # raises KeyError for unknown satellites
+        logger.info(f"Tracking satellite {norad}")
+        Tracker.target = norad
+        Tracker._loop.start()
+
+    # Stop following the satellite, the dish stays at the last target
+    @staticmethod
+    def stop():
+        if Tracker._loop:
+            Tracker._loop.stop()
+        if Tracker.status == "tracking":
+            Dish.hold()
+        Tracker.target = None
+        Tracker.status = "idle"
+
+    # Calculate the current position of the target and pass it to the dish
+    # Called by the tracking loop, every tick of it
+    @staticmethod
+    def _update():
+        norad = Tracker.target
+        if norad is None:
+            return
+        now = time.time()
+        azimuth, elevation = Catalogue.ephemeris.look_angle(norad, now)
+        Tracker.azimuth, Tracker.elevation = azimuth, elevation
+        if elevation < Config.getMinElevation():
+            # the satellite can not be seen, wait at the last position until it comes up again
+            if Tracker.status == "tracking":
+                Dish.hold()
+            Tracker.status = "below horizon"
+            return
+        Tracker.status = "tracking"
+
+        # the speed of the satellite in degrees per second, from where it is a moment later
+        next_azimuth, next_elevation = Catalogue.ephemeris.look_angle(norad, now + Tracker.rate_step)
+        azimuth_rate = ((next_azimuth - azimuth + 180) % 360 - 180) / Tracker.rate_step
+        elevation_rate = (next_elevation - elevation) / Tracker.rate_step
+        Dish.set_trajectory(azimuth, elevation, azimuth_rate, elevation_rate)
+
+    # The state of the tracker as a dictionary, used by the web interface
+    @staticmethod
+    def state():
+        satellite = None
+        if Tracker.target is not None:
+            satellite = Catalogue.get(Tracker.target).name
+        return {
+            "target": Tracker.target,
+            "name": satellite,
+            "status": Tracker.status,
+            "azimuth": Tracker.azimuth,
+            "elevation": Tracker.elevation,
+        }
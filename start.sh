@@ -21,6 +21,8 @@ python -m venv --system-site-packages ./.venv
 ./.venv/bin/pip install adafruit-circuitpython-busdevice
 ./.venv/bin/pip install adafruit-circuitpython-bno055
 ./.venv/bin/pip install rpi-hardware-pwm
+./.venv/bin/pip install sgp4                    # satellite orbit propagation
+./.venv/bin/pip install pyrtlsdr                # usb sdr dongle
 
 # List installed packages
 ./.venv/bin/pip list